@@ -1,10 +1,10 @@
 from django.contrib import admin
-from .models import Service, Patient, Appointment, Testimonial, BlogPost, ContactMessage, BeforeAfterGallery
+from .models import Service, Patient, Dentist, Chair, Appointment, Testimonial, BlogPost, ContactMessage, BeforeAfterGallery, BackgroundJob
 
 
 @admin.register(Service)
 class ServiceAdmin(admin.ModelAdmin):
-    list_display = ['name', 'price_min', 'price_max', 'duration', 'is_active', 'created_at']
+    list_display = ['name', 'price_min', 'price_max', 'duration', 'duration_minutes', 'is_active', 'created_at']
     list_filter = ['is_active', 'created_at']
     search_fields = ['name', 'description']
     list_editable = ['is_active']
@@ -13,14 +13,30 @@ class ServiceAdmin(admin.ModelAdmin):
 @admin.register(Patient)
 class PatientAdmin(admin.ModelAdmin):
     list_display = ['full_name', 'phone', 'email', 'date_of_birth', 'created_at']
-    search_fields = ['full_name', 'phone', 'email']
+    search_fields = ['full_name', 'phone', 'phone_normalized', 'email']
     list_filter = ['created_at']
+    readonly_fields = ['phone_normalized']
+
+
+@admin.register(Dentist)
+class DentistAdmin(admin.ModelAdmin):
+    list_display = ['full_name', 'is_active', 'created_at']
+    list_filter = ['is_active']
+    search_fields = ['full_name']
+    filter_horizontal = ['services']
+
+
+@admin.register(Chair)
+class ChairAdmin(admin.ModelAdmin):
+    list_display = ['name', 'dentist', 'is_active', 'created_at']
+    list_filter = ['is_active', 'dentist']
+    list_editable = ['is_active']
 
 
 @admin.register(Appointment)
 class AppointmentAdmin(admin.ModelAdmin):
-    list_display = ['patient', 'service', 'appointment_date', 'appointment_time', 'status', 'created_at']
-    list_filter = ['status', 'appointment_date', 'created_at']
+    list_display = ['patient', 'service', 'chair', 'appointment_date', 'appointment_time', 'status', 'created_at']
+    list_filter = ['status', 'chair', 'appointment_date', 'created_at']
     search_fields = ['patient__full_name', 'service__name']
     list_editable = ['status']
     date_hierarchy = 'appointment_date'
@@ -58,3 +74,10 @@ class BeforeAfterGalleryAdmin(admin.ModelAdmin):
     search_fields = ['title', 'description']
     list_editable = ['is_featured', 'is_active', 'display_order']
     readonly_fields = ['created_at', 'updated_at']
+
+
+@admin.register(BackgroundJob)
+class BackgroundJobAdmin(admin.ModelAdmin):
+    list_display = ['kind', 'status', 'attempts', 'max_attempts', 'run_after', 'created_at']
+    list_filter = ['status', 'kind']
+    readonly_fields = ['locked_at', 'last_error', 'created_at', 'updated_at']
@@ -5,3 +5,6 @@ class ClinicConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'clinic'
     verbose_name = 'إدارة العيادة'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,669 @@
+"""
+خدمة تخصيص الحجوزات
+Race-free booking allocator: serializes bookings per clinic day.
+
+القفل: تحديث صف BookingDay لليوم كأول عملية في المعاملة. في PostgreSQL
+هذا قفل صف (row lock) يخص ذلك اليوم فقط، وفي SQLite يأخذ قفل الكتابة على
+قاعدة البيانات فتتسلسل الحجوزات. في PostgreSQL يُضاف قفل استشاري
+(advisory lock) على رقم الهاتف حتى لا يُنشأ نفس المريض مرتين في يومين مختلفين.
+
+البحث عن المواعيد المتاحة يستخدم خريطة بتات لكل يوم (بت لكل فترة في شبكة
+المواعيد) محفوظة في الكاش المشترك وتُحدّث من إشارات الحفظ والحذف.
+التداخل بين المواعيد (حسب مدة الخدمة) يُفحص بفهرس فترات لكل (يوم، كرسي).
+"""
+
+import threading
+import zlib
+from bisect import bisect_left
+from datetime import datetime, time, timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from .durations import DEFAULT_VISIT_MINUTES
+from .jobs import JobQueue
+from .models import Appointment, AppointmentNotification, BookingDay, Patient, QueueHistory, normalize_phone
+from .queue_service import ACTIVE_STATUSES, QueueService, QueueVersion, VersionedDayIndex
+
+PATIENT_LOCK_NAMESPACE = 4201  # مجال الأقفال الاستشارية لأرقام الهواتف
+OPENING_HOURS = [(9, 13), (14, 18)]  # فترات العمل (الصباح والمساء)
+SLOT_MINUTES = 60  # طول الفترة الزمنية لكل موعد
+
+
+class SlotAvailabilityIndex:
+    """
+    خرائط بتات للفترات المحجوزة لكل (يوم، كرسي)
+    Per-day, per-chair bitmaps of occupied slots on the booking grid, kept in the shared cache.
+
+    البت رقم i يعني أن الفترة i من شبكة المواعيد محجوزة (بموعد غير ملغى)
+    على ذلك الكرسي. الفترة حرة إذا كان بتها صفراً على أي كرسي مؤهل. الأيام
+    الناقصة من الكاش تُبنى باستعلام واحد للمدى كله، والإشارات تعدّل البت
+    المعني بعد تأكيد المعاملة. الحجز نفسه يبقى محكوماً بقفل اليوم، لذا
+    أقصى ما قد يسببه بت متأخر هو رد 409 مع بدائل.
+    """
+
+    CACHE_PREFIX = 'clinic:slot_bitmap'
+    TIMEOUT = 10 * 60  # يحدّ من عمر أي تعديل ضائع بين العمليات
+
+    def __init__(self, opening_hours, slot_minutes):
+        self.slots = [
+            time(minute // 60, minute % 60)
+            for start_hour, end_hour in opening_hours
+            for minute in range(start_hour * 60, end_hour * 60, slot_minutes)
+        ]
+        self._positions = {slot: position for position, slot in enumerate(self.slots)}
+        # تغيير شبكة المواعيد يغيّر المفتاح فلا تُقرأ خرائط قديمة
+        self._grid = f"{len(self.slots)}x{slot_minutes}"
+
+    def _key(self, appointment_date) -> str:
+        return f"{self.CACHE_PREFIX}:{self._grid}:{appointment_date}"
+
+    def bit(self, appointment_time) -> int:
+        """قناع البت لوقت معين (0 إذا لم يكن على شبكة المواعيد)"""
+        position = self._positions.get(appointment_time)
+        return 0 if position is None else 1 << position
+
+    def bitmaps(self, start_date, end_date) -> dict:
+        """
+        خرائط البتات لكل يوم في المدى (مع البناء من قاعدة البيانات للأيام الناقصة)
+
+        Returns:
+            {date: {chair_id: bitmap}} مرتبة حسب التاريخ
+        """
+        days = [start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+        cached = cache.get_many([self._key(day) for day in days])
+        result = {day: cached.get(self._key(day)) for day in days}
+
+        missing = [day for day, bitmaps in result.items() if bitmaps is None]
+        if missing:
+            for day in missing:
+                result[day] = {}
+            rows = Appointment.objects.filter(
+                appointment_date__in=missing
+            ).exclude(status='cancelled').values_list('appointment_date', 'appointment_time', 'chair_id')
+            for appointment_date, appointment_time, chair_id in rows:
+                chairs = result[appointment_date]
+                chairs[chair_id] = chairs.get(chair_id, 0) | self.bit(appointment_time)
+            cache.set_many({self._key(day): result[day] for day in missing}, self.TIMEOUT)
+        return result
+
+    def patch(self, appointment_date, appointment_time, chair_id, occupied: bool) -> None:
+        """تعديل بت فترة واحدة على كرسي (لا شيء إذا لم يكن اليوم في الكاش)"""
+        mask = self.bit(Appointment._meta.get_field('appointment_time').to_python(appointment_time))
+        if not mask:
+            return
+        key = self._key(appointment_date)
+        chairs = cache.get(key)
+        if chairs is None:
+            return
+        bitmap = chairs.get(chair_id, 0)
+        chairs[chair_id] = bitmap | mask if occupied else bitmap & ~mask
+        cache.set(key, chairs, self.TIMEOUT)
+
+    def forget(self, *appointment_dates) -> None:
+        """حذف خرائط أيام من الكاش (بعد كتابة جماعية لا تمر بالإشارات)"""
+        cache.delete_many([self._key(appointment_date) for appointment_date in appointment_dates])
+
+    def free_slots(self, appointment_date, chairs: dict, chair_ids=(None,)) -> list:
+        """الفترات الحرة على أي كرسي من chair_ids في يوم معين (بدون الفترات التي مضت)"""
+        now = timezone.localtime()
+        if appointment_date < now.date():
+            return []
+        occupied = -1  # الفترة محجوزة فقط إذا كانت محجوزة على كل الكراسي
+        for chair_id in chair_ids:
+            occupied &= chairs.get(chair_id, 0)
+        free = [slot for position, slot in enumerate(self.slots) if not occupied >> position & 1]
+        if appointment_date == now.date():
+            free = [slot for slot in free if slot > now.time()]
+        return free
+
+
+slot_availability = SlotAvailabilityIndex(OPENING_HOURS, SLOT_MINUTES)
+
+
+def minutes_of(appointment_time) -> int:
+    """الدقائق منذ منتصف الليل"""
+    return appointment_time.hour * 60 + appointment_time.minute
+
+
+class DayIntervalIndex(VersionedDayIndex):
+    """
+    فهرس فترات المواعيد لكل (يوم، كرسي) في الذاكرة
+    In-process interval index of active appointments per (date, chair).
+
+    لكل مفتاح قائمة مرتبة من (البداية، النهاية، معرف الموعد) بالدقائق، حيث
+    النهاية = البداية + مدة الخدمة. المواعيد على نفس الكرسي لا تتداخل، لذا
+    المرشح الوحيد للتداخل مع فترة جديدة هو آخر موعد يبدأ قبل نهايتها، ويتم
+    إيجاده بـ bisect في O(log n). لقطة اليوم مربوطة بإصدار اليوم مثل فهرس
+    الطابور اليومي. الكرسي None يعني المواعيد غير المخصصة لكرسي
+    (العيادة كلها ككرسي واحد قبل تعريف الكراسي).
+    """
+
+    def _build(self, appointment_date) -> dict:
+        """بناء فترات اليوم من قاعدة البيانات (استعلام واحد)"""
+        rows = Appointment.objects.filter(
+            appointment_date=appointment_date,
+            status__in=ACTIVE_STATUSES
+        ).values_list('id', 'appointment_time', 'service__duration_minutes', 'chair_id')
+
+        chairs = {}
+        for appointment_id, appointment_time, duration, chair_id in rows:
+            start = minutes_of(appointment_time)
+            chairs.setdefault(chair_id, []).append((start, start + (duration or DEFAULT_VISIT_MINUTES), appointment_id))
+        for items in chairs.values():
+            items.sort()
+        return chairs
+
+    @staticmethod
+    def overlap(items: list, appointment_time, duration_minutes: int, exclude_id=None):
+        """
+        الموعد المتداخل مع فترة جديدة في قائمة كرسي واحد من لقطة اليوم
+
+        Returns:
+            (البداية، النهاية، معرف الموعد) للموعد المتداخل أو None
+        """
+        start = minutes_of(appointment_time)
+        end = start + (duration_minutes or DEFAULT_VISIT_MINUTES)
+        position = bisect_left(items, (end,)) - 1  # آخر موعد يبدأ قبل نهاية الفترة
+        if position >= 0 and items[position][2] == exclude_id:
+            position -= 1
+        if position >= 0 and items[position][1] > start:
+            return items[position]
+        return None
+
+    def find_overlap(self, appointment_date, appointment_time, duration_minutes: int, chair_id=None, exclude_id=None):
+        """
+        البحث عن موعد يتداخل مع فترة جديدة
+
+        Args:
+            appointment_date: تاريخ الموعد
+            appointment_time: وقت البداية
+            duration_minutes: مدة الخدمة بالدقائق
+            chair_id: الكرسي (None للعيادة كلها)
+            exclude_id: موعد يُستثنى (عند تعديل موعد موجود)
+
+        Returns:
+            (البداية، النهاية، معرف الموعد) للموعد المتداخل أو None
+        """
+        appointment_date, appointment_time = self._coerce(appointment_date, appointment_time)
+        items = self.snapshot(appointment_date).get(chair_id, [])
+        return self.overlap(items, appointment_time, duration_minutes, exclude_id)
+
+    def free_chairs(self, appointment_date, appointment_time, duration_minutes: int, chair_ids) -> list:
+        """
+        الكراسي الحرة طوال مدة الخدمة (لقطة واحدة لليوم لكل الكراسي)
+
+        Returns:
+            معرفات الكراسي الحرة بترتيب chair_ids
+        """
+        appointment_date, appointment_time = self._coerce(appointment_date, appointment_time)
+        chairs = self.snapshot(appointment_date)
+        return [
+            chair_id for chair_id in chair_ids
+            if self.overlap(chairs.get(chair_id, []), appointment_time, duration_minutes) is None
+        ]
+
+
+booking_interval_index = DayIntervalIndex()
+
+
+class BookingIdSequence:
+    """
+    معرفات حجز متسلسلة لكل يوم
+    Per-day sequential booking IDs (BK-YYYYMMDD-####) backed by a counter on BookingDay.
+
+    الأرقام تُحجز بزيادة ذرية واحدة للعداد، فلا تتكرر المعرفات ولا حاجة
+    لإعادة المحاولة. خارج المعاملات تحجز كل عملية كتلة من BOOKING_ID_BLOCK_SIZE
+    رقماً وتوزعها من الذاكرة؛ داخل معاملة يُحجز رقم واحد فقط لأن التراجع
+    يعيد العداد ولا يجوز أن تبقى في الذاكرة أرقام لم تُؤكد. الأرقام غير
+    المستخدمة (إعادة تشغيل، حجز مرفوض) تبقى فجوات.
+    """
+
+    def __init__(self, block_size: int = None):
+        self._lock = threading.Lock()
+        self._block = (None, 1, 0)  # (date, next_number, last_number) لليوم الحالي فقط
+        self._block_size = block_size
+
+    @property
+    def block_size(self) -> int:
+        return max(1, self._block_size or getattr(settings, 'BOOKING_ID_BLOCK_SIZE', 1))
+
+    @staticmethod
+    def format(day, number: int) -> str:
+        return f"BK-{day:%Y%m%d}-{number:04d}"
+
+    @staticmethod
+    def reserve(day, count: int = 1) -> int:
+        """
+        حجز count رقماً من عداد اليوم
+
+        Returns:
+            آخر رقم محجوز (الكتلة هي last - count + 1 .. last)
+        """
+        with transaction.atomic():
+            if not BookingDay.objects.filter(date=day).update(last_booking_number=F('last_booking_number') + count):
+                try:
+                    with transaction.atomic():
+                        BookingDay.objects.create(date=day, last_booking_number=count)
+                    return count
+                except IntegrityError:
+                    # أُنشئ من طلب متزامن
+                    BookingDay.objects.filter(date=day).update(last_booking_number=F('last_booking_number') + count)
+            # الصف مقفل حتى نهاية المعاملة: القيمة المقروءة هي قيمتنا
+            return BookingDay.objects.filter(date=day).values_list('last_booking_number', flat=True).get()
+
+    def next_id(self, day=None) -> str:
+        """المعرف التالي لليوم (اليوم الحالي افتراضياً)"""
+        day = day or timezone.localdate()
+        if connection.in_atomic_block:
+            return self.format(day, self.reserve(day))
+
+        with self._lock:
+            block_day, next_number, last_number = self._block
+            if block_day != day or next_number > last_number:
+                size = self.block_size
+                last_number = self.reserve(day, size)
+                next_number = last_number - size + 1
+            self._block = (day, next_number + 1, last_number)
+        return self.format(day, next_number)
+
+
+booking_id_sequence = BookingIdSequence()
+
+
+class SlotUnavailable(Exception):
+    """الموعد المطلوب محجوز - مع اقتراح مواعيد بديلة"""
+
+    def __init__(self, appointment_date, appointment_time, alternatives):
+        self.appointment_date = appointment_date
+        self.appointment_time = appointment_time
+        self.alternatives = alternatives
+        super().__init__(f"الموعد {appointment_date} {appointment_time} محجوز")
+
+
+# رمز خطأ التحقق المسبق من التداخل في AppointmentCreateSerializer (تحوّله الواجهة إلى 409)
+SLOT_UNAVAILABLE_CODE = 'slot_unavailable'
+
+
+def format_slots(slots) -> list:
+    """المواعيد البديلة بصيغة الاستجابة [{"date": "YYYY-MM-DD", "time": "HH:MM"}]"""
+    return [{'date': slot['date'].isoformat(), 'time': slot['time'].strftime('%H:%M')} for slot in slots]
+
+
+class SeriesConflict(Exception):
+    """مواعيد من سلسلة متكررة محجوزة (عند عدم السماح بتخطيها)"""
+
+    def __init__(self, conflicts):
+        self.conflicts = conflicts
+        super().__init__(f"{len(conflicts)} موعد من السلسلة محجوز")
+
+
+class BookingAllocator:
+    """تخصيص المواعيد بدون تعارض تحت الحجوزات المتزامنة"""
+
+    ALTERNATIVES_LIMIT = 5
+    ALTERNATIVES_SEARCH_DAYS = 7
+
+    @staticmethod
+    def day_slots() -> list:
+        """أوقات المواعيد المتاحة في اليوم حسب ساعات العمل"""
+        return slot_availability.slots
+
+    @staticmethod
+    def lock_day(appointment_date):
+        """قفل يوم الحجز حتى نهاية المعاملة الحالية"""
+        if BookingDay.objects.filter(date=appointment_date).update(bookings_count=F('bookings_count') + 1):
+            return
+        try:
+            with transaction.atomic():
+                BookingDay.objects.create(date=appointment_date)
+        except IntegrityError:
+            # أُنشئ من طلب متزامن
+            pass
+        BookingDay.objects.filter(date=appointment_date).update(bookings_count=F('bookings_count') + 1)
+
+    @staticmethod
+    def lock_patient(phone: str):
+        """قفل استشاري على رقم الهاتف (PostgreSQL فقط؛ SQLite مُسلسل أصلاً)"""
+        if connection.vendor != 'postgresql':
+            return
+        key = zlib.crc32(phone.encode()) - 2 ** 31  # int4
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_xact_lock(%s, %s)', [PATIENT_LOCK_NAMESPACE, key])
+
+    @staticmethod
+    def chairs_for(service_id=None) -> list:
+        """
+        الكراسي المؤهلة للخدمة
+
+        Returns:
+            معرفات الكراسي، أو [None] إذا لم تُعرّف كراسي (طابور واحد)
+        """
+        # خدمة لا يقدمها أي طبيب مُعيّن على كرسي تُقبل على أي كرسي
+        return QueueService.get_chair_pool(service_id) or QueueService.get_chair_pool() or [None]
+
+    @staticmethod
+    def open_slots(appointment_date, chairs: dict, chair_ids, duration_minutes: int = None) -> list:
+        """
+        الفترات الحرة في يوم على أي كرسي مؤهل، بدون الفترات التي تتداخل مع مواعيد أطول
+
+        Args:
+            appointment_date: التاريخ
+            chairs: خرائط البتات لليوم {chair_id: bitmap}
+            chair_ids: الكراسي المؤهلة
+            duration_minutes: مدة الخدمة (اختياري)
+        """
+        free = slot_availability.free_slots(appointment_date, chairs, chair_ids)
+        if not duration_minutes or not free:
+            return free
+        intervals = booking_interval_index.snapshot(appointment_date)
+        return [
+            slot for slot in free
+            if any(
+                DayIntervalIndex.overlap(intervals.get(chair_id, []), slot, duration_minutes) is None
+                for chair_id in chair_ids
+            )
+        ]
+
+    @staticmethod
+    def alternative_slots(
+        appointment_date,
+        appointment_time,
+        duration_minutes: int = None,
+        chair_ids=(None,),
+        limit: int = ALTERNATIVES_LIMIT
+    ) -> list:
+        """
+        أقرب المواعيد المتاحة في نفس اليوم ثم الأيام التالية
+
+        Args:
+            appointment_date: التاريخ المطلوب
+            appointment_time: الوقت المطلوب
+            duration_minutes: مدة الخدمة (لاستبعاد الفترات المتداخلة)
+            chair_ids: الكراسي المؤهلة للخدمة
+            limit: عدد البدائل
+
+        Returns:
+            قائمة {'date': ..., 'time': ...}
+        """
+        last_date = appointment_date + timedelta(days=BookingAllocator.ALTERNATIVES_SEARCH_DAYS)
+        bitmaps = slot_availability.bitmaps(appointment_date, last_date)
+        requested_minutes = minutes_of(appointment_time)
+
+        alternatives = []
+        for day, chairs in bitmaps.items():
+            free = BookingAllocator.open_slots(day, chairs, chair_ids, duration_minutes)
+            if day == appointment_date:
+                # الأقرب إلى الوقت المطلوب أولاً
+                free.sort(key=lambda slot: abs(minutes_of(slot) - requested_minutes))
+            alternatives.extend({'date': day, 'time': slot} for slot in free[:limit - len(alternatives)])
+            if len(alternatives) >= limit:
+                break
+        return alternatives
+
+    @staticmethod
+    def find_overlap(appointment_date, appointment_time, duration_minutes: int, chair_id=None):
+        """
+        فحص التداخل على كرسي من قاعدة البيانات تحت قفل اليوم (استعلام واحد على الفهرس)
+
+        Returns:
+            وقت الموعد المتداخل أو None
+        """
+        start = minutes_of(appointment_time)
+        end = min(start + duration_minutes, 24 * 60 - 1)
+        previous = Appointment.objects.filter(
+            appointment_date=appointment_date,
+            chair_id=chair_id,
+            status__in=ACTIVE_STATUSES,
+            appointment_time__lt=time(end // 60, end % 60)
+        ).order_by('-appointment_time').values_list('appointment_time', 'service__duration_minutes').first()
+        if previous is None:
+            return None
+        previous_start = minutes_of(previous[0])
+        if previous_start >= start or previous_start + (previous[1] or DEFAULT_VISIT_MINUTES) > start:
+            return previous[0]
+        return None
+
+    @staticmethod
+    def get_patient(patient_name: str, patient_phone: str, patient_email=None) -> Patient:
+        """المريض حسب رقم الهاتف الموحد (يُنشأ إن لم يوجد)؛ يُستدعى داخل معاملة الحجز"""
+        phone_normalized = normalize_phone(patient_phone)
+        BookingAllocator.lock_patient(phone_normalized)
+        patient, created = Patient.objects.get_or_create(
+            phone_normalized=phone_normalized,
+            defaults={
+                'full_name': patient_name,
+                'phone': patient_phone,
+                'email': patient_email
+            }
+        )
+
+        # Update email if patient exists but email is new (conditional UPDATE, no read-modify-write)
+        if not created and patient_email and not patient.email:
+            Patient.objects.filter(Q(email__isnull=True) | Q(email=''), id=patient.id).update(
+                email=patient_email, updated_at=timezone.now()
+            )
+            patient.email = patient_email
+        return patient
+
+    @staticmethod
+    def refresh_days(days):
+        """
+        إصدار جديد لأيام كُتبت بـ bulk_create (لا يطلق الإشارات)؛ يُستدعى داخل معاملة الكتابة
+
+        إصدار اليوم يُزاد في نفس المعاملة، وخرائط البتات تُنسى بعد التأكيد.
+        """
+        QueueVersion.bump(*days, all_days=False)
+
+        def on_commit():
+            slot_availability.forget(*days)
+            QueueVersion.bump()
+
+        transaction.on_commit(on_commit)
+
+    @staticmethod
+    def book(patient_name: str, patient_phone: str, patient_email=None, **appointment_data) -> Appointment:
+        """
+        حجز موعد بشكل آمن تحت التزامن
+
+        الموعد يُخصص لأول كرسي مؤهل للخدمة يكون حراً طوال مدتها.
+
+        Raises:
+            SlotUnavailable: إذا كان الوقت محجوزاً أو يتداخل مع موعد آخر على كل الكراسي
+        """
+        appointment_date = appointment_data['appointment_date']
+        appointment_time = appointment_data['appointment_time']
+        service = appointment_data.get('service')
+        duration = service.duration_minutes if service and service.duration_minutes else DEFAULT_VISIT_MINUTES
+
+        chair_ids = BookingAllocator.chairs_for(service.id if service else None)
+        # قبل المعاملة: الرقم يُؤكد فوراً ولا يبقى صف عداد اليوم مقفلاً طوال الحجز
+        booking_id = booking_id_sequence.next_id()
+
+        with transaction.atomic():
+            BookingAllocator.lock_day(appointment_date)
+
+            # أول كرسي مؤهل حر طوال مدة الخدمة
+            for chair_id in chair_ids:
+                if BookingAllocator.find_overlap(appointment_date, appointment_time, duration, chair_id) is None:
+                    break
+            else:
+                raise SlotUnavailable(
+                    appointment_date,
+                    appointment_time,
+                    BookingAllocator.alternative_slots(appointment_date, appointment_time, duration, chair_ids)
+                )
+
+            patient = BookingAllocator.get_patient(patient_name, patient_phone, patient_email)
+
+            # رقم الطابور بـ COUNT واحد تحت القفل (الحجز السابق غيّر إصدار اليوم، فالفهرس سيُعاد بناؤه)؛
+            # المواعيد في نفس الوقت على كراسي أخرى تسبقه لأن معرفاتها أصغر
+            queue_number = Appointment.objects.filter(
+                appointment_date=appointment_date,
+                appointment_time__lte=appointment_time,
+                status__in=ACTIVE_STATUSES
+            ).count() + 1
+
+            appointment = Appointment(
+                booking_id=booking_id, patient=patient, queue_number=queue_number, chair_id=chair_id,
+                **appointment_data
+            )
+            appointment.save()
+            # سجل الطابور والإشعارات في العامل الخلفي (يُؤكد مع الموعد)
+            JobQueue.enqueue('appointment_booked', {'appointment_id': appointment.id})
+            return appointment
+
+    @staticmethod
+    def book_series(
+        patient_name: str,
+        patient_phone: str,
+        patient_email=None,
+        *,
+        service,
+        start_date,
+        appointment_time,
+        every_weeks: int,
+        occurrences: int,
+        skip_conflicts: bool = True,
+        notes=None
+    ) -> tuple:
+        """
+        حجز سلسلة مواعيد متكررة (مثلاً زيارات التقويم الشهرية) في معاملة واحدة
+
+        كل المواعيد المرشحة تُفحص باستعلام واحد على أيامها، ثم تُنشأ المواعيد
+        وسجلات الطابور والإشعارات بـ bulk_create، وتُزاح أرقام الطابور اللاحقة
+        في كل الأيام بتحديث واحد (كل المواعيد في نفس الوقت).
+
+        Args:
+            service: الخدمة (أو None)
+            start_date: تاريخ أول موعد
+            appointment_time: وقت المواعيد
+            every_weeks: عدد الأسابيع بين موعدين
+            occurrences: عدد المواعيد المرشحة
+            skip_conflicts: تخطي الأيام المحجوزة بدل رفض السلسلة كاملة
+
+        Returns:
+            (المواعيد المُنشأة، التواريخ المتخطاة)
+
+        Raises:
+            SeriesConflict: إذا وُجد تعارض و skip_conflicts=False
+        """
+        from .notifications import NotificationService
+
+        days = [start_date + timedelta(weeks=every_weeks * i) for i in range(occurrences)]
+        duration = service.duration_minutes if service and service.duration_minutes else DEFAULT_VISIT_MINUTES
+        chair_ids = BookingAllocator.chairs_for(service.id if service else None)
+        start = minutes_of(appointment_time)
+        end = start + duration
+        issued = timezone.localdate()
+        # قبل المعاملة: الأرقام تُؤكد فوراً؛ الأيام المتخطاة تبقى فجوات
+        first_number = BookingIdSequence.reserve(issued, occurrences) - occurrences + 1
+
+        with transaction.atomic():
+            for day in days:
+                BookingAllocator.lock_day(day)
+
+            # كل المواعيد النشطة في أيام السلسلة (استعلام واحد)
+            booked = {}  # (day, chair_id) -> [(start, end)]
+            day_counts = {}  # day -> عدد المواعيد النشطة حتى وقت السلسلة (ضمناً)
+            for day, other_time, chair_id, other_duration in Appointment.objects.filter(
+                appointment_date__in=days, status__in=ACTIVE_STATUSES
+            ).values_list('appointment_date', 'appointment_time', 'chair_id', 'service__duration_minutes'):
+                other_start = minutes_of(other_time)
+                booked.setdefault((day, chair_id), []).append(
+                    (other_start, other_start + (other_duration or DEFAULT_VISIT_MINUTES))
+                )
+                if other_time <= appointment_time:
+                    day_counts[day] = day_counts.get(day, 0) + 1
+
+            placements = []
+            conflicts = []
+            for day in days:
+                for chair_id in chair_ids:
+                    if not any(
+                        other_start < end and start < other_end
+                        for other_start, other_end in booked.get((day, chair_id), ())
+                    ):
+                        placements.append((day, chair_id))
+                        break
+                else:
+                    conflicts.append(day)
+            if conflicts and not skip_conflicts:
+                raise SeriesConflict(conflicts)
+            if not placements:
+                return [], conflicts
+
+            patient = BookingAllocator.get_patient(patient_name, patient_phone, patient_email)
+            booked_days = [day for day, _ in placements]
+
+            # المواعيد الجديدة هي الأخيرة في وقتها (معرفاتها أكبر): إزاحة ما بعد وقتها فقط
+            later = Appointment.objects.filter(
+                appointment_date__in=booked_days,
+                appointment_time__gt=appointment_time,
+                status__in=ACTIVE_STATUSES
+            )
+            QueueHistory.objects.filter(appointment__in=later.values('id')).update(
+                queue_position=F('queue_position') + 1
+            )
+            later.update(queue_number=F('queue_number') + 1)
+
+            appointments = Appointment.objects.bulk_create([
+                Appointment(
+                    booking_id=BookingIdSequence.format(issued, first_number + days.index(day)),
+                    patient=patient,
+                    service=service,
+                    chair_id=chair_id,
+                    appointment_date=day,
+                    appointment_time=appointment_time,
+                    queue_number=day_counts.get(day, 0) + 1,
+                    notes=notes,
+                )
+                for day, chair_id in placements
+            ])
+
+            # التقدير بعد إدراج كل المواعيد، من قاعدة البيانات مباشرة: فهرس الطابور وجدول
+            # اليوم في الكاش لا يُحدّثان قبل التأكيد (refresh_days)
+            estimates = {}
+            for day in booked_days:
+                estimates.update(QueueService.estimate_day(day, save=False))
+
+            QueueHistory.objects.bulk_create([
+                QueueHistory(
+                    appointment=appointment,
+                    scheduled_start_time=timezone.make_aware(datetime.combine(appointment.appointment_date, appointment_time)),
+                    estimated_wait_minutes=estimates.get(appointment.id, 0),
+                    queue_position=appointment.queue_number,
+                )
+                for appointment in appointments
+            ])
+
+            # تأكيد واحد للسلسلة (أول موعد) وتذكير قبل كل موعد
+            now = datetime.now()
+            channels = [
+                (notification_type, recipient)
+                for notification_type, recipient in (('email', patient.email), ('whatsapp', patient.phone))
+                if recipient
+            ]
+            notifications = [
+                NotificationService.build_notification(
+                    appointments[0], notification_type, recipient, now, 'booking_confirmation'
+                )
+                for notification_type, recipient in channels
+            ] + [
+                NotificationService.build_notification(
+                    appointment, notification_type, recipient, reminder_time, 'appointment_reminder'
+                )
+                for appointment in appointments
+                for reminder_time in [appointment.appointment_datetime() - timedelta(hours=24)]
+                if reminder_time > now
+                for notification_type, recipient in channels
+            ]
+            notifications = AppointmentNotification.objects.bulk_create(notifications)
+            JobQueue.enqueue_many('send_notification', [
+                {'notification_id': notification.id}
+                for notification in notifications if notification.scheduled_time <= now
+            ])
+
+            BookingAllocator.refresh_days(booked_days)
+        return appointments, conflicts
@@ -0,0 +1,113 @@
+"""
+تحليل مدة الخدمة
+Parser for the free-text Service.duration field ("30-60 دقيقة", "1-2 ساعة", "12-24 شهر", ...).
+
+يُستخدم عند حفظ الخدمة لتخزين المدة كأعداد صحيحة، حتى لا يقوم مسار
+حساب الطابور بأي تحليل نصي.
+"""
+
+import re
+from functools import lru_cache
+from typing import NamedTuple
+
+DEFAULT_VISIT_MINUTES = 30  # مدة الزيارة الافتراضية عندما لا تُحدّد بالدقائق أو الساعات
+
+# (بادئات الوحدة، عدد الدقائق، هل تعبّر عن مدة الزيارة نفسها) - الترتيب مهم
+UNITS = [
+    (('دقيق', 'دقائق', 'min'), 1, True),
+    (('ساع', 'hour', 'hr'), 60, True),
+    (('يوم', 'أيام', 'ايام', 'day'), 24 * 60, False),
+    (('أسبوع', 'اسبوع', 'أسابيع', 'اسابيع', 'week'), 7 * 24 * 60, False),
+    (('شهر', 'أشهر', 'اشهر', 'month'), 30 * 24 * 60, False),
+    (('سنة', 'سنوات', 'عام', 'أعوام', 'year'), 365 * 24 * 60, False),
+    (('جلس', 'زيار', 'session', 'visit'), DEFAULT_VISIT_MINUTES, False),
+]
+
+# صيغة المثنى بدون رقم: "ساعتين"، "شهرين"، "يومين"
+DUAL_SUFFIXES = ('ين', 'ان')
+
+WORD_NUMBERS = {
+    'ربع': 0.25,
+    'نصف': 0.5,
+    'half': 0.5,
+    'واحد': 1,
+    'one': 1,
+}
+
+ARABIC_DIGITS = str.maketrans('٠١٢٣٤٥٦٧٨٩٫', '0123456789.')
+RANGE_WORDS = re.compile(r'\s*(?:إلى|الى|to|–|—|~)\s*')
+NUMBER = re.compile(r'\d+(?:\.\d+)?')
+
+
+class ParsedDuration(NamedTuple):
+    visit_minutes: int  # مدة الزيارة الواحدة (تُستخدم في حساب الطابور)
+    min_minutes: int  # الحد الأدنى للمدة الكاملة
+    max_minutes: int  # الحد الأقصى للمدة الكاملة
+
+
+def _find_unit(text: str):
+    for prefixes, minutes, is_visit_time in UNITS:
+        for prefix in prefixes:
+            position = text.find(prefix)
+            if position != -1:
+                return prefix, minutes, is_visit_time, position
+    return None, 1, True, -1  # بدون وحدة: دقائق
+
+
+@lru_cache(maxsize=256)
+def parse_duration(duration_str) -> ParsedDuration:
+    """
+    تحليل نص المدة إلى دقائق
+
+    Examples:
+        "30 دقيقة" -> (30, 30, 30)
+        "30-60 دقيقة" -> (45, 30, 60)
+        "1-2 ساعة" -> (90, 60, 120)
+        "ساعة ونصف" -> (90, 90, 90)
+        "12-24 شهر" -> (30, 518400, 1036800)  # علاج طويل: مدة الزيارة افتراضية
+        "1-3 جلسات" -> (30, 30, 90)
+
+    Args:
+        duration_str: نص مدة الخدمة
+
+    Returns:
+        ParsedDuration
+    """
+    default = ParsedDuration(DEFAULT_VISIT_MINUTES, DEFAULT_VISIT_MINUTES, DEFAULT_VISIT_MINUTES)
+    if not duration_str:
+        return default
+
+    text = str(duration_str).lower().strip().translate(ARABIC_DIGITS)
+    text = RANGE_WORDS.sub('-', text)
+
+    unit, unit_minutes, is_visit_time, unit_position = _find_unit(text)
+    numbers = [float(n) for n in NUMBER.findall(text)]
+
+    if not numbers:
+        if unit is None:
+            return default
+        words = [value for word, value in WORD_NUMBERS.items() if word in text]
+        word_after_unit = text[unit_position:].split()[0] if text[unit_position:].split() else ''
+        if word_after_unit.endswith(DUAL_SUFFIXES) and word_after_unit != unit:
+            numbers = [2]
+        elif words and not ('ونصف' in text or 'and a half' in text):
+            numbers = [words[0]]
+        else:
+            numbers = [1]
+
+    if 'ونصف' in text or 'and a half' in text:
+        numbers = [n + 0.5 for n in numbers]
+
+    low = numbers[0]
+    high = numbers[1] if len(numbers) > 1 else low
+    low, high = min(low, high), max(low, high)
+
+    min_minutes = int(round(low * unit_minutes))
+    max_minutes = int(round(high * unit_minutes))
+    if is_visit_time:
+        visit_minutes = int(round((min_minutes + max_minutes) / 2))
+    else:
+        # أيام/أشهر/جلسات: مدة العلاج الكاملة وليست مدة الزيارة
+        visit_minutes = DEFAULT_VISIT_MINUTES
+
+    return ParsedDuration(max(1, visit_minutes), min_minutes, max_minutes)
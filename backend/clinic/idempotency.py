@@ -0,0 +1,135 @@
+"""
+مفاتيح عدم التكرار لطلبات POST العامة
+Idempotency-Key support: a retried POST replays the stored response instead of running again.
+
+الطلب الأول يحجز المفتاح بإدراج صف (القيد الفريد يمنع طلبين متزامنين)،
+ثم تُحفظ استجابته الناجحة حتى IDEMPOTENCY_KEY_TTL. الإعادة بنفس المفتاح
+ونفس المحتوى تُرجع الاستجابة المحفوظة دون المرور بمسار الحجز؛ نفس المفتاح
+بمحتوى مختلف يُرفض. الاستجابات غير الناجحة لا تُحفظ فيمكن إعادة المحاولة.
+المفاتيح خاصة بكل عميل (المستخدم أو عنوان IP)، والمفتاح المحجوز لطلب لم
+ينتهِ (توقفت عمليته) يُسترد بعد IDEMPOTENCY_IN_PROGRESS_TIMEOUT.
+"""
+
+import hashlib
+import json
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.throttling import BaseThrottle
+from .models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+
+def request_fingerprint(request) -> str:
+    """بصمة الطلب: المسار والمحتوى بعد ترتيب المفاتيح"""
+    data = request.data
+    if hasattr(data, 'lists'):
+        data = {key: values if len(values) > 1 else values[0] for key, values in data.lists()}
+    body = json.dumps(data, sort_keys=True, default=str)
+    return hashlib.sha256(f"{request.method} {request.path}\n{body}".encode()).hexdigest()
+
+
+def request_client(request) -> str:
+    """هوية العميل لنطاق المفتاح: المستخدم المسجل، وإلا عنوان IP (مع NUM_PROXIES كما في التقييد)"""
+    if request.user and request.user.is_authenticated:
+        return f"user:{request.user.pk}"
+    return f"ip:{BaseThrottle().get_ident(request)}"[:64]
+
+
+def purge_expired_keys() -> int:
+    """حذف المفاتيح المنتهية (يُستدعى دورياً من العامل الخلفي)"""
+    deleted, _ = IdempotencyKey.objects.filter(expires_at__lte=timezone.now()).delete()
+    return deleted
+
+
+def idempotent_response(request, scope: str, handler):
+    """
+    تنفيذ handler مرة واحدة لكل مفتاح
+
+    Args:
+        request: طلب DRF
+        scope: نطاق المفتاح (اسم نقطة النهاية)
+        handler: دالة بدون معاملات تُرجع Response
+
+    Returns:
+        استجابة handler، أو الاستجابة المحفوظة عند الإعادة
+    """
+    key = request.headers.get(IDEMPOTENCY_HEADER)
+    if not key:
+        return handler()
+    if len(key) > MAX_KEY_LENGTH:
+        return Response(
+            {"error": f"{IDEMPOTENCY_HEADER} must be at most {MAX_KEY_LENGTH} characters"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    fingerprint = request_fingerprint(request)
+    client = request_client(request)
+    now = timezone.now()
+    # مفتاح منتهٍ، أو محجوز لطلب لم ينتهِ خلال المهلة (توقفت عمليته قبل حفظ الاستجابة أو حذف الصف)
+    lease = timedelta(seconds=getattr(settings, 'IDEMPOTENCY_IN_PROGRESS_TIMEOUT', 60))
+    IdempotencyKey.objects.filter(
+        Q(expires_at__lte=now) | Q(status_code__isnull=True, created_at__lte=now - lease),
+        scope=scope, client=client, key=key
+    ).delete()
+    try:
+        with transaction.atomic():
+            record = IdempotencyKey.objects.create(
+                scope=scope,
+                client=client,
+                key=key,
+                request_hash=fingerprint,
+                expires_at=now + timedelta(seconds=getattr(settings, 'IDEMPOTENCY_KEY_TTL', 24 * 3600)),
+            )
+    except IntegrityError:
+        return replay(scope, client, key, fingerprint)
+
+    try:
+        response = handler()
+    except Exception:
+        record.delete()
+        raise
+
+    if status.is_success(response.status_code):
+        IdempotencyKey.objects.filter(id=record.id).update(
+            status_code=response.status_code, response_body=response.data
+        )
+    else:
+        record.delete()
+    return response
+
+
+def replay(scope: str, client: str, key: str, fingerprint: str):
+    """الاستجابة لطلب مُعاد بمفتاح محجوز"""
+    record = IdempotencyKey.objects.filter(scope=scope, client=client, key=key).values(
+        'request_hash', 'status_code', 'response_body'
+    ).first()
+    if record is None or record['status_code'] is None:
+        return Response(
+            {"error": f"A request with this {IDEMPOTENCY_HEADER} is still in progress"},
+            status=status.HTTP_409_CONFLICT
+        )
+    if record['request_hash'] != fingerprint:
+        return Response(
+            {"error": f"{IDEMPOTENCY_HEADER} was already used with a different request"},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+    return Response(record['response_body'], status=record['status_code'], headers={'Idempotent-Replayed': 'true'})
+
+
+class IdempotentCreateMixin:
+    """Honour the Idempotency-Key header on create (POST to the list endpoint)"""
+    idempotency_scope = None
+
+    def create(self, request, *args, **kwargs):
+        return idempotent_response(
+            request,
+            self.idempotency_scope or self.basename,
+            lambda: super(IdempotentCreateMixin, self).create(request, *args, **kwargs)
+        )
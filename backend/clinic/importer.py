@@ -0,0 +1,279 @@
+"""
+استيراد المواعيد بالجملة
+Streaming CSV/NDJSON appointment import with bulk inserts and single-pass queue numbering.
+
+الملف يُقرأ سطراً بسطر ويُعالج على دفعات (chunks)، كل دفعة في معاملة:
+المرضى يُطابقون برقم الهاتف الموحد عبر خريطة في الذاكرة، ومعرفات الحجز
+تُحجز بزيادة واحدة لعداد اليوم. أرقام الطابور تُحسب بعد آخر دفعة بمرور
+واحد مرتب على كل يوم مستورد (المواعيد الموجودة + الجديدة) بدل استعلام
+COUNT لكل صف. الإدراج بـ bulk_create لا يمر بالإشارات، لذا تُمسح فهارس
+وكاش الأيام المتأثرة بعد تأكيد الترقيم.
+"""
+
+import csv
+import json
+import time
+from collections import Counter
+from contextlib import nullcontext
+from datetime import datetime
+from django.db import transaction
+from django.utils import timezone
+from .booking import BookingAllocator, BookingIdSequence
+from .models import Appointment, Patient, QueueHistory, Service, normalize_phone
+
+
+class ImportRowError(ValueError):
+    """صف غير صالح في ملف الاستيراد"""
+
+
+class AppointmentImporter:
+    """استيراد مواعيد من CSV أو NDJSON"""
+
+    CHUNK_SIZE = 2000  # صفوف لكل معاملة
+    BATCH_SIZE = 500  # صفوف لكل استعلام إدراج
+    DAYS_PER_PASS = 50  # أيام لكل معاملة في مرور الترقيم
+    MAX_REPORTED_ERRORS = 20
+    DATE_FORMATS = ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y')
+    TIME_FORMATS = ('%H:%M', '%H:%M:%S')
+    FORMATS = ('csv', 'ndjson')
+    COLUMN_ALIASES = {
+        'name': 'patient_name',
+        'phone': 'patient_phone',
+        'email': 'patient_email',
+        'date': 'appointment_date',
+        'time': 'appointment_time',
+    }
+
+    def __init__(self, chunk_size: int = None, dry_run: bool = False):
+        self.chunk_size = chunk_size or self.CHUNK_SIZE
+        self.dry_run = dry_run
+        self.statuses = {value for value, _ in Appointment.STATUS_CHOICES}
+        self.patients = {}  # رقم الهاتف الموحد -> معرف المريض
+        self.services = {}  # المعرف أو الاسم بأحرف صغيرة -> معرف الخدمة
+        self.touched_days = set()
+        self.stats = Counter()
+        self.errors = []
+
+    @staticmethod
+    def detect_format(filename: str) -> str:
+        return 'ndjson' if filename.lower().endswith(('.ndjson', '.jsonl')) else 'csv'
+
+    @staticmethod
+    def read_rows(stream, file_format: str = 'csv'):
+        """
+        قراءة الصفوف تدريجياً
+
+        Yields:
+            (رقم السطر، قاموس الأعمدة)
+        """
+        if file_format == 'ndjson':
+            for line_number, line in enumerate(stream, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as e:
+                    yield line_number, ImportRowError(f"JSON غير صالح: {e}")
+                    continue
+                yield line_number, row if isinstance(row, dict) else ImportRowError("السطر ليس كائن JSON")
+        else:
+            reader = csv.DictReader(stream)
+            for row in reader:
+                yield reader.line_num, row
+
+    def run(self, stream, file_format: str = 'csv') -> dict:
+        """
+        استيراد الملف كاملاً
+
+        Args:
+            stream: ملف نصي مفتوح
+            file_format: csv أو ndjson
+
+        Returns:
+            ملخص الاستيراد (الأعداد، الأخطاء، الصفوف في الثانية)
+        """
+        if file_format not in self.FORMATS:
+            raise ValueError(f"صيغة غير مدعومة: {file_format}")
+
+        started = time.perf_counter()
+        # التجربة تعمل في معاملة واحدة تُلغى في النهاية حتى تكون أعدادها مطابقة للاستيراد الفعلي
+        with transaction.atomic() if self.dry_run else nullcontext():
+            self._load_lookups()
+            chunk = []
+            for line_number, row in self.read_rows(stream, file_format):
+                self.stats['rows'] += 1
+                try:
+                    if isinstance(row, ImportRowError):
+                        raise row
+                    chunk.append(self._parse(row))
+                except ImportRowError as e:
+                    self.stats['invalid'] += 1
+                    if len(self.errors) < self.MAX_REPORTED_ERRORS:
+                        self.errors.append({'line': line_number, 'error': str(e)})
+                if len(chunk) >= self.chunk_size:
+                    self._import_chunk(chunk)
+                    chunk = []
+            if chunk:
+                self._import_chunk(chunk)
+            self.renumber_days()
+            if self.dry_run:
+                transaction.set_rollback(True)
+
+        elapsed = time.perf_counter() - started
+        return {
+            'rows': self.stats['rows'],
+            'imported': self.stats['imported'],
+            'patients_created': self.stats['patients_created'],
+            'renumbered': self.stats['renumbered'],
+            'conflicts': self.stats['conflicts'],
+            'invalid': self.stats['invalid'],
+            'errors': self.errors,
+            'dry_run': self.dry_run,
+            'elapsed_seconds': round(elapsed, 3),
+            'rows_per_second': round(self.stats['rows'] / elapsed, 1) if elapsed else 0,
+        }
+
+    def _load_lookups(self):
+        """تحميل المرضى والخدمات الموجودة مرة واحدة"""
+        self.patients.update(Patient.objects.values_list('phone_normalized', 'id').iterator())
+        for service_id, name in Service.objects.values_list('id', 'name'):
+            self.services[str(service_id)] = service_id
+            self.services.setdefault(name.strip().lower(), service_id)
+
+    def _parse(self, row: dict) -> dict:
+        """التحقق من صف وتحويله"""
+        row = {
+            self.COLUMN_ALIASES.get(key.strip().lower(), key.strip().lower()): (str(value).strip() if value is not None else '')
+            for key, value in row.items() if key
+        }
+        phone = normalize_phone(row.get('patient_phone'))
+        if not 9 <= len(phone.lstrip('+')) <= 15:
+            raise ImportRowError(f"رقم هاتف غير صالح: {row.get('patient_phone')!r}")
+        service = row.get('service', '')
+        service_id = self.services.get(service.lower()) if service else None
+        if service and service_id is None:
+            raise ImportRowError(f"خدمة غير معروفة: {service!r}")
+        status = (row.get('status') or 'pending').lower()
+        if status not in self.statuses:
+            raise ImportRowError(f"حالة غير معروفة: {status!r}")
+
+        return {
+            'patient_name': row.get('patient_name') or phone,
+            'patient_email': row.get('patient_email') or None,
+            'phone': phone,
+            'service_id': service_id,
+            'appointment_date': self._parse_value(row.get('appointment_date'), self.DATE_FORMATS, 'تاريخ').date(),
+            'appointment_time': self._parse_value(row.get('appointment_time'), self.TIME_FORMATS, 'وقت').time(),
+            'status': status,
+            'notes': row.get('notes') or None,
+        }
+
+    @staticmethod
+    def _parse_value(value, formats, label):
+        for value_format in formats:
+            try:
+                return datetime.strptime(value or '', value_format)
+            except ValueError:
+                continue
+        raise ImportRowError(f"{label} غير صالح: {value!r}")
+
+    def _import_chunk(self, rows: list):
+        """إدراج دفعة في معاملة واحدة (أرقام الطابور تُحسب لاحقاً في renumber_days)"""
+        days = sorted({row['appointment_date'] for row in rows})
+        with transaction.atomic():
+            # نفس ترتيب الأقفال دائماً لتفادي الجمود مع دفعات أو حجوزات أخرى
+            for day in days:
+                BookingAllocator.lock_day(day)
+
+            # المرضى الجدد (مرة واحدة لكل رقم موحد)
+            new_patients = {}
+            for row in rows:
+                if row['phone'] not in self.patients and row['phone'] not in new_patients:
+                    new_patients[row['phone']] = Patient(
+                        full_name=row['patient_name'], phone=row['phone'], phone_normalized=row['phone'],
+                        email=row['patient_email']
+                    )
+            if new_patients:
+                # مرضى أُنشئوا بنفس الرقم الموحد بعد _load_lookups (حجز متزامن) يُربطون بدل إنشائهم،
+                # و ignore_conflicts يغطي ما يُنشأ بين الاستعلامين، فلا يُلغي الفهرس الفريد الاستيراد
+                existing = dict(
+                    Patient.objects.filter(phone_normalized__in=list(new_patients)).values_list('phone_normalized', 'id')
+                )
+                self.patients.update(existing)
+                for phone in existing:
+                    del new_patients[phone]
+                Patient.objects.bulk_create(new_patients.values(), batch_size=self.BATCH_SIZE, ignore_conflicts=True)
+                self.patients.update(
+                    Patient.objects.filter(phone_normalized__in=list(new_patients)).values_list('phone_normalized', 'id')
+                )
+
+            # تخطي المواعيد الفعالة في وقت محجوز (نفس قيد قاعدة البيانات)
+            taken = set(
+                Appointment.objects.filter(appointment_date__in=days, chair__isnull=True)
+                .exclude(status='cancelled').values_list('appointment_date', 'appointment_time')
+            )
+            accepted = []
+            for row in rows:
+                if row['status'] != 'cancelled':
+                    slot = (row['appointment_date'], row['appointment_time'])
+                    if slot in taken:
+                        self.stats['conflicts'] += 1
+                        continue
+                    taken.add(slot)
+                accepted.append(row)
+
+            # معرفات الحجز: زيادة واحدة لعداد اليوم للدفعة كلها
+            issued = timezone.localdate()
+            last_number = BookingIdSequence.reserve(issued, len(accepted)) if accepted else 0
+            first_number = last_number - len(accepted) + 1
+            Appointment.objects.bulk_create([
+                Appointment(
+                    booking_id=BookingIdSequence.format(issued, first_number + position),
+                    patient_id=self.patients[row['phone']],
+                    service_id=row['service_id'],
+                    appointment_date=row['appointment_date'],
+                    appointment_time=row['appointment_time'],
+                    status=row['status'],
+                    notes=row['notes'],
+                    queue_number=0,
+                )
+                for position, row in enumerate(accepted)
+            ], batch_size=self.BATCH_SIZE)
+
+        self.touched_days.update(row['appointment_date'] for row in accepted)
+        self.stats['patients_created'] += len(new_patients)
+        self.stats['imported'] += len(accepted)
+
+    def renumber_days(self):
+        """
+        مرور واحد مرتب لكل يوم مستورد: أرقام الطابور حسب (الوقت، المعرف)
+
+        يُنفذ مرة واحدة بعد كل الدفعات حتى لا يُعاد ترقيم يوم تتوزع صفوفه
+        على عدة دفعات أكثر من مرة. لا يُكتب إلا ما تغيّر رقمه.
+        """
+        days = sorted(self.touched_days)
+        for start in range(0, len(days), self.DAYS_PER_PASS):
+            group = days[start:start + self.DAYS_PER_PASS]
+            with transaction.atomic():
+                for day in group:
+                    BookingAllocator.lock_day(day)
+                rows = Appointment.objects.filter(appointment_date__in=group).exclude(status='cancelled').order_by(
+                    'appointment_date', 'appointment_time', 'id'
+                ).values_list('id', 'appointment_date', 'queue_number', 'queue_history__id')
+
+                renumbered = []
+                histories = []
+                current_day, queue_number = None, 0
+                for appointment_id, day, current, history_id in rows.iterator():
+                    queue_number = queue_number + 1 if day == current_day else 1
+                    current_day = day
+                    if current != queue_number:
+                        renumbered.append(Appointment(id=appointment_id, queue_number=queue_number))
+                        if history_id:
+                            histories.append(QueueHistory(id=history_id, queue_position=queue_number))
+
+                Appointment.objects.bulk_update(renumbered, ['queue_number'], batch_size=self.BATCH_SIZE)
+                QueueHistory.objects.bulk_update(histories, ['queue_position'], batch_size=self.BATCH_SIZE)
+                if not self.dry_run:
+                    BookingAllocator.refresh_days(group)
+                self.stats['renumbered'] += len(renumbered)
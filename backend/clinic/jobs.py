@@ -0,0 +1,182 @@
+"""
+طابور المهام الخلفية
+Durable database-backed job queue, drained by the run_worker management command.
+
+يعمل بدون Celery أو Redis: المهمة صف في جدول BackgroundJob يُكتب في نفس
+معاملة العملية التي أنشأته، فلا تضيع مهمة لعملية تم تأكيدها ولا تُنفذ مهمة
+لعملية تراجعت. العامل يستلم المهام بتحديث شرطي (يعمل على SQLite و
+PostgreSQL)، وينفذ كل مهمة في معاملتها الخاصة، ويعيد المحاولة عند الفشل
+بتأخير متزايد حتى max_attempts.
+"""
+
+import logging
+from datetime import datetime, timedelta
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from .models import Appointment, AppointmentNotification, BackgroundJob, QueueHistory
+
+logger = logging.getLogger(__name__)
+
+JOB_HANDLERS = {}  # kind -> handler(**payload)
+
+
+def job_handler(kind: str):
+    """تسجيل دالة كمنفذ لنوع مهمة"""
+    def register(handler):
+        JOB_HANDLERS[kind] = handler
+        return handler
+    return register
+
+
+class JobQueue:
+    """إضافة المهام واستلامها وتنفيذها"""
+
+    RETRY_BASE_SECONDS = 30  # تأخير أول إعادة محاولة (يتضاعف مع كل محاولة)
+    RETRY_MAX_SECONDS = 3600  # أقصى تأخير بين محاولتين
+    LOCK_TIMEOUT_SECONDS = 600  # مهمة "قيد التنفيذ" أقدم من هذا تُعتبر من عامل متوقف
+
+    @staticmethod
+    def enqueue(kind: str, payload: dict, run_after=None) -> BackgroundJob:
+        """
+        إضافة مهمة (داخل معاملة المستدعي إن وجدت)
+
+        Args:
+            kind: نوع المهمة (مسجل بـ job_handler)
+            payload: معاملات المنفذ (JSON)
+            run_after: أقرب وقت للتنفيذ (الآن افتراضياً)
+
+        Returns:
+            كائن BackgroundJob
+        """
+        return BackgroundJob.objects.create(kind=kind, payload=payload, run_after=run_after or timezone.now())
+
+    @staticmethod
+    def enqueue_many(kind: str, payloads: list) -> list:
+        """إضافة عدة مهام من نفس النوع باستعلام واحد"""
+        now = timezone.now()
+        return BackgroundJob.objects.bulk_create([
+            BackgroundJob(kind=kind, payload=payload, run_after=now) for payload in payloads
+        ])
+
+    @staticmethod
+    def claim(limit: int = 10) -> list:
+        """
+        استلام مهام جاهزة للتنفيذ
+
+        كل مهمة تُستلم بتحديث شرطي على حالتها المقروءة، فإذا سبق عامل آخر
+        إليها لا يُحدَّث أي صف وتُترك له.
+
+        Args:
+            limit: أقصى عدد من المهام
+
+        Returns:
+            قائمة (id, kind, payload, attempts, max_attempts)
+        """
+        now = timezone.now()
+        stale = now - timedelta(seconds=JobQueue.LOCK_TIMEOUT_SECONDS)
+        candidates = BackgroundJob.objects.filter(
+            Q(status='pending', run_after__lte=now) | Q(status='running', locked_at__lt=stale)
+        ).order_by('run_after', 'id').values_list(
+            'id', 'kind', 'payload', 'status', 'locked_at', 'attempts', 'max_attempts'
+        )[:limit]
+
+        claimed = []
+        for job_id, kind, payload, status, locked_at, attempts, max_attempts in candidates:
+            taken = BackgroundJob.objects.filter(id=job_id, status=status, locked_at=locked_at).update(
+                status='running', locked_at=now, attempts=F('attempts') + 1
+            )
+            if taken:
+                claimed.append((job_id, kind, payload, attempts + 1, max_attempts))
+        return claimed
+
+    @staticmethod
+    def run(job_id: int, kind: str, payload: dict, attempts: int, max_attempts: int) -> bool:
+        """
+        تنفيذ مهمة مستلمة في معاملة خاصة بها
+
+        Returns:
+            True إذا نجحت، False إذا فشلت (أُعيدت جدولتها أو فشلت نهائياً)
+        """
+        try:
+            handler = JOB_HANDLERS.get(kind)
+            if handler is None:
+                raise LookupError(f"لا يوجد منفذ لنوع المهمة {kind}")
+            with transaction.atomic():
+                handler(**payload)
+        except Exception as e:
+            updates = {'locked_at': None, 'last_error': f"{type(e).__name__}: {e}"}
+            if attempts >= max_attempts:
+                updates['status'] = 'failed'
+                logger.error(f"فشلت المهمة {kind} #{job_id} نهائياً بعد {attempts} محاولة: {e}")
+            else:
+                delay = min(JobQueue.RETRY_BASE_SECONDS * 2 ** (attempts - 1), JobQueue.RETRY_MAX_SECONDS)
+                updates['status'] = 'pending'
+                updates['run_after'] = timezone.now() + timedelta(seconds=delay)
+                logger.warning(f"فشلت المهمة {kind} #{job_id} (محاولة {attempts}): {e} - إعادة بعد {delay} ثانية")
+            BackgroundJob.objects.filter(id=job_id).update(**updates)
+            return False
+
+        BackgroundJob.objects.filter(id=job_id).update(status='done', locked_at=None, last_error=None)
+        return True
+
+    @staticmethod
+    def run_pending(limit: int = 10) -> tuple:
+        """
+        استلام دفعة من المهام وتنفيذها
+
+        Returns:
+            (عدد المهام الناجحة، عدد المهام الفاشلة)
+        """
+        done = failed = 0
+        for job in JobQueue.claim(limit):
+            if JobQueue.run(*job):
+                done += 1
+            else:
+                failed += 1
+        return done, failed
+
+
+@job_handler('appointment_booked')
+def appointment_booked(appointment_id: int):
+    """
+    أعمال ما بعد الحجز: سجل الطابور وتقدير الانتظار، ثم الإشعارات
+
+    كل خطوة تتخطى ما أُنجز سابقاً، فإعادة المهمة بعد فشل جزئي آمنة.
+    التقدير يقرأ فهرس الطابور وجدول اليوم حسب إصدار اليوم، فيرى حجوزات
+    عمليات الويب التي تمت بعد آخر تحميل لليوم في العامل.
+    الإشعارات الفورية تُرسل كمهام مستقلة حتى يُعاد إرسال كل واحدة وحدها.
+    """
+    from .notifications import NotificationService
+    from .queue_service import QueueService
+
+    appointment = Appointment.objects.select_related('patient', 'service').filter(id=appointment_id).first()
+    if appointment is None:
+        return  # حُذف الموعد قبل تنفيذ المهمة
+
+    if not QueueHistory.objects.filter(appointment_id=appointment_id).exists():
+        if QueueService.create_queue_history(appointment) is None:
+            raise RuntimeError(f"فشل إنشاء سجل الطابور للموعد {appointment.booking_id}")
+
+    if not AppointmentNotification.objects.filter(appointment_id=appointment_id).exists():
+        notifications = NotificationService.create_appointment_notifications(appointment, send_now=False)
+        if notifications is None:
+            raise RuntimeError(f"فشل إنشاء الإشعارات للموعد {appointment.booking_id}")
+        # أوقات الإشعارات بتوقيت محلي بدون منطقة زمنية (كما في NotificationService)
+        now = datetime.now()
+        JobQueue.enqueue_many('send_notification', [
+            {'notification_id': notification.id} for notification in notifications if notification.scheduled_time <= now
+        ])
+
+
+@job_handler('send_notification')
+def send_notification(notification_id: int):
+    """إرسال إشعار واحد بعد استلامه؛ الفشل يرفع استثناء لتُعاد المهمة"""
+    from .notifications import NotificationService
+
+    claimed = NotificationService.claim([notification_id], statuses=('pending', 'failed'))
+    if not claimed:
+        return  # أُرسل، أو يرسله مرسل آخر، أو حُذف
+    notification = claimed[0]
+    if not NotificationService.send_notification(notification):
+        raise RuntimeError(notification.error_message or "فشل إرسال الإشعار")
@@ -0,0 +1,108 @@
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+
+
+def _init_worker():
+    """Each worker process opens its own database connections."""
+    import django
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'future_smile.settings')
+    django.setup()
+    connections.close_all()
+
+
+def _backfill_chunk(start_date, end_date, with_history):
+    from clinic.queue_service import QueueService
+
+    history_rows = QueueService.create_missing_queue_history(start_date, end_date) if with_history else 0
+    statistics_rows = QueueService.rebuild_queue_statistics(start_date, end_date)
+    return start_date.isoformat(), history_rows, statistics_rows
+
+
+class Command(BaseCommand):
+    help = 'Rebuild QueueStatistics and create missing QueueHistory rows over a date range, in parallel date chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='start', required=True, help='First date (YYYY-MM-DD)')
+        parser.add_argument('--to', dest='end', default=None, help='Last date, inclusive (defaults to today)')
+        parser.add_argument('--chunk-days', type=int, default=7, help='Days per aggregation chunk')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Worker processes')
+        parser.add_argument('--skip-history', action='store_true', help='Only rebuild statistics')
+        parser.add_argument('--state-file', default=None, help='Checkpoint file used to resume an interrupted run')
+        parser.add_argument('--restart', action='store_true', help='Ignore an existing checkpoint')
+
+    def handle(self, *args, **options):
+        try:
+            start = date.fromisoformat(options['start'])
+            end = date.fromisoformat(options['end']) if options['end'] else date.today()
+        except ValueError:
+            raise CommandError('Dates must be YYYY-MM-DD')
+        if end < start:
+            raise CommandError('--to must not be before --from')
+
+        chunk_days = max(1, options['chunk_days'])
+        chunks = []
+        chunk_start = start
+        while chunk_start <= end:
+            chunk_end = min(end, chunk_start + timedelta(days=chunk_days - 1))
+            chunks.append((chunk_start, chunk_end))
+            chunk_start = chunk_end + timedelta(days=1)
+
+        state_file = options['state_file'] or os.path.join(
+            tempfile.gettempdir(), f'clinic_backfill_{start}_{end}_{chunk_days}.json'
+        )
+        done = set()
+        if os.path.exists(state_file) and not options['restart']:
+            with open(state_file) as f:
+                done = set(json.load(f))
+            self.stdout.write(self.style.WARNING(f'⏩ Resuming: {len(done)} of {len(chunks)} chunks already done'))
+        pending = [chunk for chunk in chunks if chunk[0].isoformat() not in done]
+
+        workers = max(1, options['workers'])
+        if connection.vendor == 'sqlite' and workers > 1:
+            self.stdout.write(self.style.WARNING('⚠️  SQLite allows a single writer, using 1 worker'))
+            workers = 1
+
+        started = time.perf_counter()
+        history_total = statistics_total = 0
+
+        def record(chunk_key, history_rows, statistics_rows):
+            nonlocal history_total, statistics_total
+            history_total += history_rows
+            statistics_total += statistics_rows
+            done.add(chunk_key)
+            with open(state_file, 'w') as f:
+                json.dump(sorted(done), f)
+            elapsed = time.perf_counter() - started
+            rate = (history_total + statistics_total) / elapsed if elapsed else 0
+            self.stdout.write(
+                f'  {chunk_key}: +{history_rows} history, {statistics_rows} statistics '
+                f'({len(done)}/{len(chunks)} chunks, {rate:.0f} rows/s)'
+            )
+
+        if workers == 1:
+            for chunk_start, chunk_end in pending:
+                record(*_backfill_chunk(chunk_start, chunk_end, not options['skip_history']))
+        else:
+            # Forked workers must not share the parent's connection
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+                futures = [
+                    executor.submit(_backfill_chunk, chunk_start, chunk_end, not options['skip_history'])
+                    for chunk_start, chunk_end in pending
+                ]
+                for future in as_completed(futures):
+                    record(*future.result())
+
+        elapsed = time.perf_counter() - started
+        rows = history_total + statistics_total
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ {history_total} queue history rows created, {statistics_total} statistics rows rebuilt '
+            f'in {elapsed:.2f}s ({rows / elapsed if elapsed else 0:.0f} rows/s)'
+        ))
+        os.remove(state_file)
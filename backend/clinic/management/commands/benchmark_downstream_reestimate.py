@@ -0,0 +1,81 @@
+import time
+from datetime import date, datetime, timedelta
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from clinic.models import Appointment, Patient, QueueHistory, Service
+from clinic.queue_service import QueueService
+
+
+class Command(BaseCommand):
+    help = 'Benchmark downstream re-estimation after an overrun as queue history grows (all writes are rolled back)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--history-days', default='0,100,1000', help='Comma-separated history sizes in days')
+        parser.add_argument('--per-day', type=int, default=30, help='Appointments per day')
+        parser.add_argument('--repeat', type=int, default=20, help='Timed runs per history size')
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['history_days'].split(',')]
+        per_day = options['per_day']
+
+        self.stdout.write('━' * 60)
+        self.stdout.write(f'{"History":>12} {"rows":>9} {"ms/run":>9} {"queries":>8} {"updated":>8}')
+        with transaction.atomic():
+            service = Service.objects.create(
+                name='Benchmark', description='-', price_min=0, price_max=0, duration='20 دقيقة', is_active=False
+            )
+            patient = Patient.objects.create(full_name='Benchmark', phone='0000000000')
+            target_day = date(2099, 6, 1)
+            built = 0
+            for size in sorted(sizes):
+                # السجل يكبر تدريجياً: أيام سابقة ليوم الاختبار
+                self._build_days(patient, service, [target_day - timedelta(days=i + 1) for i in range(built, size)], per_day)
+                built = max(built, size)
+                elapsed, queries, updated = self._run(patient, service, target_day, per_day, options['repeat'])
+                rows = QueueHistory.objects.count()
+                self.stdout.write(f'{size:>9} d {rows:>9} {elapsed * 1e3:>9.2f} {queries:>8} {updated:>8}')
+            transaction.set_rollback(True)
+        self.stdout.write('━' * 60)
+        self.stdout.write(self.style.SUCCESS('✅ Benchmark finished, all changes rolled back'))
+
+    def _run(self, patient, service, target_day, per_day, repeat):
+        """تأخير 45 دقيقة في أول موعد ليوم الاختبار وإعادة تقدير ما بعده"""
+        first = self._build_days(patient, service, [target_day], per_day)[0]
+        scheduled = timezone.make_aware(datetime.combine(target_day, first.appointment_time))
+        total = 0
+        for i in range(repeat):
+            with transaction.atomic():
+                with CaptureQueriesContext(connection) as captured:
+                    started = time.perf_counter()
+                    updated = QueueService.reestimate_downstream(first.id, scheduled + timedelta(minutes=45 + i))
+                    total += time.perf_counter() - started
+                transaction.set_rollback(True)
+        Appointment.objects.filter(appointment_date=target_day).delete()
+        return total / repeat, len(captured), updated
+
+    @staticmethod
+    def _build_days(patient, service, days, per_day):
+        appointments = Appointment.objects.bulk_create([
+            Appointment(
+                patient=patient,
+                service=service,
+                appointment_date=day,
+                appointment_time=(datetime.combine(day, datetime.min.time()) + timedelta(hours=9, minutes=15 * i)).time(),
+                booking_id=f'BENCH-{day:%Y%m%d}-{i:03d}',
+                queue_number=i + 1,
+            )
+            for day in days for i in range(per_day)
+        ], batch_size=1000)
+        QueueHistory.objects.bulk_create([
+            QueueHistory(
+                appointment=appointment,
+                scheduled_start_time=timezone.make_aware(
+                    datetime.combine(appointment.appointment_date, appointment.appointment_time)
+                ),
+                queue_position=appointment.queue_number,
+            )
+            for appointment in appointments
+        ], batch_size=1000)
+        return appointments
@@ -0,0 +1,80 @@
+import time
+from datetime import date, datetime, timedelta
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from clinic.models import Appointment, Patient, QueueHistory, Service
+
+
+class Command(BaseCommand):
+    help = 'Benchmark set-based queue renumbering on a synthetic day (all writes are rolled back)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=500, help='Appointments in the synthetic day')
+
+    def handle(self, *args, **options):
+        size = options['size']
+        with transaction.atomic():
+            day = self._build_day(size)
+
+            # إلغاء أول موعد: إعادة ترقيم جماعية (UPDATE واحد لكل جدول)
+            first = Appointment.objects.filter(appointment_date=day).order_by('appointment_time').first()
+            first.status = 'cancelled'
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                first.save()
+                set_based = time.perf_counter() - started
+            set_based_queries = len(queries)
+
+            # نفس العمل بحلقة على الصفوف (الطريقة التي نتجنبها)
+            later = list(
+                Appointment.objects.filter(appointment_date=day, status='pending').select_related('queue_history')
+            )
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                for appointment in later:
+                    Appointment.objects.filter(id=appointment.id).update(queue_number=appointment.queue_number - 1)
+                    QueueHistory.objects.filter(id=appointment.queue_history.id).update(
+                        queue_position=appointment.queue_history.queue_position - 1
+                    )
+                per_row = time.perf_counter() - started
+            per_row_queries = len(queries)
+
+            transaction.set_rollback(True)
+
+        self.stdout.write('━' * 50)
+        self.stdout.write(f'Day size: {size} appointments ({size - 1} renumbered)')
+        self.stdout.write(f'Set-based: {set_based * 1e3:8.2f} ms  {set_based_queries:5d} queries')
+        self.stdout.write(f'Per-row:   {per_row * 1e3:8.2f} ms  {per_row_queries:5d} queries')
+        self.stdout.write('━' * 50)
+        self.stdout.write(self.style.SUCCESS('✅ Benchmark finished, all changes rolled back'))
+
+    @staticmethod
+    def _build_day(size):
+        day = date(2099, 1, 1)
+        service = Service.objects.create(
+            name='Benchmark', description='-', price_min=0, price_max=0, duration='10 دقيقة', is_active=False
+        )
+        patient = Patient.objects.create(full_name='Benchmark', phone='0000000000')
+        start = datetime.combine(day, datetime.min.time()) + timedelta(hours=8)
+        appointments = Appointment.objects.bulk_create([
+            Appointment(
+                patient=patient,
+                service=service,
+                appointment_date=day,
+                appointment_time=(start + timedelta(minutes=i)).time(),
+                booking_id=f'BENCH-{i:05d}',
+                queue_number=i + 1,
+            )
+            for i in range(size)
+        ])
+        QueueHistory.objects.bulk_create([
+            QueueHistory(
+                appointment=appointment,
+                scheduled_start_time=timezone.make_aware(start + timedelta(minutes=i)),
+                queue_position=i + 1,
+            )
+            for i, appointment in enumerate(appointments)
+        ])
+        return day
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from clinic.importer import AppointmentImporter
+
+
+class Command(BaseCommand):
+    help = 'Bulk-import appointments from a CSV or NDJSON file (streamed in chunks)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or NDJSON file')
+        parser.add_argument('--format', choices=AppointmentImporter.FORMATS, default=None,
+                            help='File format (default: from the file extension)')
+        parser.add_argument('--chunk-size', type=int, default=AppointmentImporter.CHUNK_SIZE, help='Rows per transaction')
+        parser.add_argument('--dry-run', action='store_true', help='Validate and count without saving')
+
+    def handle(self, *args, **options):
+        importer = AppointmentImporter(chunk_size=options['chunk_size'], dry_run=options['dry_run'])
+        file_format = options['format'] or importer.detect_format(options['path'])
+        try:
+            with open(options['path'], encoding='utf-8-sig', newline='') as stream:
+                summary = importer.run(stream, file_format)
+        except OSError as e:
+            raise CommandError(f'Cannot read {options["path"]}: {e}')
+
+        self.stdout.write('━' * 50)
+        self.stdout.write(f'Rows: {summary["rows"]}   imported: {summary["imported"]}   '
+                          f'new patients: {summary["patients_created"]}')
+        self.stdout.write(f'Slot conflicts skipped: {summary["conflicts"]}   invalid: {summary["invalid"]}   '
+                          f'queue numbers written: {summary["renumbered"]}')
+        for error in summary['errors']:
+            self.stdout.write(self.style.WARNING(f'  line {error["line"]}: {error["error"]}'))
+        self.stdout.write(f'Elapsed: {summary["elapsed_seconds"]:.2f} s   ({summary["rows_per_second"]:.0f} rows/s)')
+        self.stdout.write('━' * 50)
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING('⚠️  Dry run, nothing saved'))
+            return
+        self.stdout.write(self.style.SUCCESS('✅ Import finished'))
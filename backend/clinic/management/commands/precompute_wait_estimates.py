@@ -0,0 +1,22 @@
+from datetime import date, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from clinic.queue_service import QueueService
+
+
+class Command(BaseCommand):
+    help = 'Precompute estimated wait times for a day (defaults to tomorrow). Run nightly from cron.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='Date to estimate (YYYY-MM-DD), defaults to tomorrow')
+        parser.add_argument('--days', type=int, default=1, help='Number of consecutive days to estimate')
+
+    def handle(self, *args, **options):
+        try:
+            start = date.fromisoformat(options['date']) if options['date'] else date.today() + timedelta(days=1)
+        except ValueError:
+            raise CommandError('Invalid --date, expected YYYY-MM-DD')
+
+        for offset in range(options['days']):
+            day = start + timedelta(days=offset)
+            estimates = QueueService.estimate_day(day)
+            self.stdout.write(self.style.SUCCESS(f'✅ {day}: {len(estimates)} estimates updated'))
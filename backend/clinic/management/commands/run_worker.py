@@ -0,0 +1,46 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+from clinic.idempotency import purge_expired_keys
+from clinic.jobs import JobQueue
+
+
+class Command(BaseCommand):
+    help = 'Run the background job worker (queue history, notifications) with per-job retry'
+    PURGE_INTERVAL_SECONDS = 600  # expired Idempotency-Key rows are deleted when idle, at most this often
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, default=10, help='Jobs claimed per poll')
+        parser.add_argument('--sleep', type=float, default=1.0, help='Seconds to wait when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='Drain the ready jobs and exit')
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS('✅ Worker started'))
+        total_done = total_failed = 0
+        last_purge = None
+        try:
+            while True:
+                close_old_connections()
+                done, failed = JobQueue.run_pending(options['batch'])
+                total_done += done
+                total_failed += failed
+                if failed:
+                    self.stdout.write(self.style.WARNING(f'⚠️  {failed} job(s) failed, retried later or marked failed'))
+                if done or failed:
+                    continue
+                now = timezone.now()
+                if last_purge is None or (now - last_purge).total_seconds() >= self.PURGE_INTERVAL_SECONDS:
+                    purge_expired_keys()
+                    last_purge = now
+                if options['once']:
+                    break
+                time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            close_old_connections()
+
+        self.stdout.write('━' * 50)
+        self.stdout.write(f'Jobs done: {total_done}   failed attempts: {total_failed}')
+        self.stdout.write(self.style.SUCCESS('✅ Worker stopped'))
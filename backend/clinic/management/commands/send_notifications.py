@@ -0,0 +1,37 @@
+import time
+from django.core.management.base import BaseCommand
+from clinic.notifications import NotificationService
+
+
+class Command(BaseCommand):
+    help = 'Send due pending notifications in batches (one SMTP connection and one status update per batch)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=NotificationService.EMAIL_BATCH_SIZE,
+                            help='Notifications per batch')
+        parser.add_argument('--limit', type=int, default=None, help='Send at most this many notifications')
+
+    def handle(self, *args, **options):
+        self.stdout.write('━' * 50)
+        self.stdout.write(f'{"Batch":>6} {"sent":>6} {"failed":>7} {"seconds":>9} {"msg/s":>9}')
+        total_sent = total_failed = 0
+        started = time.perf_counter()
+        for number, batch in enumerate(
+            NotificationService.dispatch_due_notifications(options['batch_size'], options['limit']), 1
+        ):
+            count = batch['sent'] + batch['failed']
+            rate = count / batch['seconds'] if batch['seconds'] else 0
+            self.stdout.write(
+                f'{number:>6} {batch["sent"]:>6} {batch["failed"]:>7} {batch["seconds"]:>9.3f} {rate:>9.1f}'
+            )
+            total_sent += batch['sent']
+            total_failed += batch['failed']
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write('━' * 50)
+        total = total_sent + total_failed
+        self.stdout.write(f'Sent: {total_sent}   failed: {total_failed}   elapsed: {elapsed:.2f} s'
+                          f'   ({total / elapsed if elapsed else 0:.1f} notifications/s)')
+        if total_failed:
+            self.stdout.write(self.style.WARNING(f'⚠️  {total_failed} notification(s) failed, see error_message'))
+        self.stdout.write(self.style.SUCCESS('✅ Notifications dispatched'))
@@ -0,0 +1,139 @@
+import random
+import threading
+import time
+from collections import Counter
+from datetime import date, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from clinic.booking import SLOT_UNAVAILABLE_CODE, BookingAllocator, SlotUnavailable
+from clinic.models import Appointment, BackgroundJob, BookingDay, Chair, Patient, Service
+from clinic.serializers import AppointmentCreateSerializer
+
+
+class Command(BaseCommand):
+    help = 'Stress-test concurrent bookings through the booking allocator and check for duplicates (data is removed afterwards)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16, help='Concurrent booking threads')
+        parser.add_argument('--bookings', type=int, default=400, help='Booking attempts in total')
+        parser.add_argument('--days', type=int, default=5, help='Synthetic days the bookings are spread over')
+        parser.add_argument('--patients', type=int, default=50, help='Distinct phone numbers (forces patient races)')
+        parser.add_argument('--chairs', type=int, default=0, help='Temporary chairs to book in parallel (0: existing setup)')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic data for inspection')
+
+    def handle(self, *args, **options):
+        days = [date(2099, 3, 1) + timedelta(days=i) for i in range(options['days'])]
+        if Appointment.objects.filter(appointment_date__in=days).exists():
+            raise CommandError(f'Synthetic days {days[0]}..{days[-1]} already have appointments')
+
+        service = Service.objects.create(
+            name='Stress test', description='-', price_min=0, price_max=0, duration='30 دقيقة', is_active=False
+        )
+        chairs = [Chair.objects.create(name=f'Stress test {i + 1}') for i in range(options['chairs'])]
+        phones = [f'099{i:07d}' for i in range(options['patients'])]
+        slots = BookingAllocator.day_slots()
+        rng = random.Random(options['seed'])
+        attempts = [
+            {
+                'patient_name': f'Stress {phone}',
+                'patient_phone': phone,
+                'service': service.id,
+                'appointment_date': day.isoformat(),
+                'appointment_time': slot.strftime('%H:%M'),
+            }
+            for phone, day, slot in (
+                (rng.choice(phones), rng.choice(days), rng.choice(slots)) for _ in range(options['bookings'])
+            )
+        ]
+
+        results = Counter()
+        results_lock = threading.Lock()
+        start_barrier = threading.Barrier(options['threads'])
+
+        def worker(chunk):
+            outcome = Counter()
+            start_barrier.wait()
+            try:
+                for data in chunk:
+                    # Every attempt is counted, whatever fails (a dead thread would hide attempts)
+                    try:
+                        serializer = AppointmentCreateSerializer(data=data)
+                        if not serializer.is_valid():
+                            # The overlap pre-check is a validation error the API answers with 409
+                            codes = serializer.errors.get('appointment_time', [])
+                            slot_taken = any(getattr(error, 'code', None) == SLOT_UNAVAILABLE_CODE for error in codes)
+                            outcome['conflict' if slot_taken else 'invalid'] += 1
+                            continue
+                        serializer.save()
+                        outcome['booked'] += 1
+                    except SlotUnavailable:
+                        outcome['conflict'] += 1
+                    except Exception as e:
+                        outcome[f'error: {type(e).__name__}'] += 1
+            finally:
+                connection.close()
+                with results_lock:
+                    results.update(outcome)
+
+        threads = [
+            threading.Thread(target=worker, args=(attempts[i::options['threads']],))
+            for i in range(options['threads'])
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        problems = self._check(days, phones)
+
+        self.stdout.write('━' * 50)
+        self.stdout.write(f'Threads: {options["threads"]}   attempts: {len(attempts)}   elapsed: {elapsed:.2f} s')
+        for outcome, count in sorted(results.items()):
+            self.stdout.write(f'  {outcome:<20} {count:6d}')
+        self.stdout.write(f'Throughput: {results["booked"] / elapsed:.1f} bookings/s '
+                          f'({len(attempts) / elapsed:.1f} attempts/s)')
+        self.stdout.write('━' * 50)
+
+        if not options['keep']:
+            appointment_ids = list(Appointment.objects.filter(appointment_date__in=days).values_list('id', flat=True))
+            BackgroundJob.objects.filter(kind='appointment_booked', payload__appointment_id__in=appointment_ids).delete()
+            Patient.objects.filter(phone__in=phones).delete()
+            BookingDay.objects.filter(date__in=days).delete()
+            Chair.objects.filter(id__in=[chair.id for chair in chairs]).delete()
+            service.delete()
+
+        errors = sum(count for outcome, count in results.items() if outcome.startswith('error'))
+        recorded = sum(results.values())
+        if recorded != len(attempts):
+            problems.append(f'{len(attempts) - recorded} of {len(attempts)} attempts were not recorded (a worker thread died)')
+        if problems or errors:
+            for problem in problems:
+                self.stdout.write(self.style.ERROR(f'❌ {problem}'))
+            raise CommandError('Stress test failed')
+        self.stdout.write(self.style.SUCCESS('✅ No duplicate slots, queue numbers or patients'))
+
+    @staticmethod
+    def _check(days, phones):
+        problems = []
+        duplicate_phones = [phone for phone, count in Counter(
+            Patient.objects.filter(phone__in=phones).values_list('phone_normalized', flat=True)
+        ).items() if count > 1]
+        if duplicate_phones:
+            problems.append(f'Duplicate patients: {duplicate_phones[:5]}')
+
+        for day in days:
+            appointments = list(
+                Appointment.objects.filter(appointment_date=day)
+                .order_by('appointment_time', 'id')
+                .values_list('appointment_time', 'chair_id', 'queue_number')
+            )
+            slots = [(appointment_time, chair_id) for appointment_time, chair_id, _ in appointments]
+            numbers = [queue_number for _, _, queue_number in appointments]
+            if len(set(slots)) != len(slots):
+                problems.append(f'{day}: duplicate time slots')
+            if numbers != list(range(1, len(numbers) + 1)):
+                problems.append(f'{day}: queue numbers {numbers} are not 1..{len(numbers)}')
+        return problems
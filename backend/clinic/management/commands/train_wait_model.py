@@ -0,0 +1,96 @@
+import random
+import time
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from clinic.models import Service, WaitTimeModel
+from clinic.queue_service import QueueService, WaitTimePredictor, wait_time_predictor
+
+
+class Command(BaseCommand):
+    help = 'Train the wait-time regression model on QueueHistory actuals and benchmark it against the heuristic'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', default=None, help='Only train on appointments from this date (YYYY-MM-DD)')
+        parser.add_argument('--holdout', type=float, default=0.2, help='Fraction of samples kept for evaluation')
+        parser.add_argument('--ridge', type=float, default=WaitTimePredictor.RIDGE_LAMBDA, help='Ridge regularization')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--benchmark-samples', type=int, default=200, help='Rows used for the latency benchmark')
+        parser.add_argument('--dry-run', action='store_true', help='Evaluate without saving the model')
+
+    def handle(self, *args, **options):
+        try:
+            since = date.fromisoformat(options['since']) if options['since'] else None
+        except ValueError:
+            raise CommandError('Invalid --since, expected YYYY-MM-DD')
+
+        rows = WaitTimePredictor.training_rows(since)
+        if len(rows) < 10:
+            raise CommandError(f'Not enough completed visits with actual wait times ({len(rows)})')
+
+        random.Random(options['seed']).shuffle(rows)
+        holdout_size = max(1, int(len(rows) * options['holdout']))
+        test_rows, train_rows = rows[:holdout_size], rows[holdout_size:]
+
+        feature_names, coefficients = WaitTimePredictor.fit(
+            [WaitTimePredictor.features(*row[:5]) for row in train_rows],
+            [row[5] for row in train_rows],
+            options['ridge']
+        )
+
+        predictor = WaitTimePredictor.from_coefficients(feature_names, coefficients)
+
+        # الدقة على بيانات الاختبار
+        model_predictions = predictor.predict_many([row[:5] for row in test_rows])
+        model_mae = sum(abs(p - row[5]) for p, row in zip(model_predictions, test_rows)) / len(test_rows)
+
+        heuristic_error = 0
+        historical_cache = {}
+        durations = {}
+        for service_id, hour, _, queue_depth, _, wait, appointment_date, _ in test_rows:
+            key = (service_id, appointment_date)
+            if key not in historical_cache:
+                historical_cache[key] = QueueService.get_historical_average_wait(service_id, appointment_date)
+            if service_id not in durations:
+                durations[service_id] = self._service_duration(service_id)
+            estimate = QueueService.combine_wait_estimate(queue_depth, durations[service_id], hour, historical_cache[key])
+            heuristic_error += abs(estimate - wait)
+        heuristic_mae = heuristic_error / len(test_rows)
+
+        # زمن التنبؤ
+        sample = test_rows[:options['benchmark_samples']]
+        started = time.perf_counter()
+        for row in sample:
+            predictor.predict(*row[:5])
+        model_latency = (time.perf_counter() - started) / len(sample)
+
+        started = time.perf_counter()
+        for row in sample:
+            QueueService.estimate_wait_time(row[6], row[7], row[0], use_model=False)
+        heuristic_latency = (time.perf_counter() - started) / len(sample)
+
+        self.stdout.write('━' * 50)
+        self.stdout.write(f'Samples: {len(train_rows)} train / {len(test_rows)} test, {len(feature_names)} features')
+        self.stdout.write(f'MAE     model: {model_mae:.1f} min   heuristic: {heuristic_mae:.1f} min')
+        self.stdout.write(
+            f'Latency model: {model_latency * 1e6:.1f} µs   heuristic: {heuristic_latency * 1e3:.2f} ms '
+            f'(per estimate, {len(sample)} samples)'
+        )
+        self.stdout.write('━' * 50)
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING('⚠️  Dry run, model not saved'))
+            return
+
+        WaitTimeModel.objects.create(
+            feature_names=feature_names,
+            coefficients=coefficients,
+            training_samples=len(train_rows),
+            mean_absolute_error=model_mae,
+            heuristic_mean_absolute_error=heuristic_mae,
+        )
+        wait_time_predictor.load(force=True)
+        self.stdout.write(self.style.SUCCESS('✅ Wait-time model saved (running workers pick it up on restart)'))
+
+    @staticmethod
+    def _service_duration(service_id):
+        return Service.objects.filter(id=service_id).values_list('duration_minutes', flat=True).first() or 30
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0008_queuehistory_queuestatistics'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='queuestatistics',
+            name='duration_samples',
+            field=models.IntegerField(default=0, verbose_name='عدد قياسات مدة الخدمة'),
+        ),
+        migrations.AddField(
+            model_name='queuestatistics',
+            name='duration_sum_minutes',
+            field=models.BigIntegerField(default=0, verbose_name='مجموع مدة الخدمة (دقيقة)'),
+        ),
+        migrations.AddField(
+            model_name='queuestatistics',
+            name='duration_sum_squares',
+            field=models.BigIntegerField(default=0, verbose_name='مجموع مربعات مدة الخدمة'),
+        ),
+        migrations.AddField(
+            model_name='queuestatistics',
+            name='max_service_duration_minutes',
+            field=models.IntegerField(default=0, verbose_name='الحد الأقصى لمدة الخدمة (دقيقة)'),
+        ),
+        migrations.AddField(
+            model_name='queuestatistics',
+            name='min_service_duration_minutes',
+            field=models.IntegerField(default=0, verbose_name='الحد الأدنى لمدة الخدمة (دقيقة)'),
+        ),
+        migrations.AddField(
+            model_name='queuestatistics',
+            name='wait_sum_minutes',
+            field=models.BigIntegerField(default=0, verbose_name='مجموع الانتظار (دقيقة)'),
+        ),
+        migrations.AddField(
+            model_name='queuestatistics',
+            name='wait_sum_squares',
+            field=models.BigIntegerField(default=0, verbose_name='مجموع مربعات الانتظار'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0009_queuestatistics_running_aggregates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WaitTimeModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('feature_names', models.JSONField(verbose_name='أسماء الخصائص')),
+                ('coefficients', models.JSONField(verbose_name='المعاملات')),
+                ('training_samples', models.IntegerField(default=0, verbose_name='عدد عينات التدريب')),
+                ('mean_absolute_error', models.FloatField(default=0, verbose_name='متوسط الخطأ المطلق (دقيقة)')),
+                ('heuristic_mean_absolute_error', models.FloatField(default=0, verbose_name='متوسط خطأ الطريقة السابقة (دقيقة)')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'نموذج تنبؤ الانتظار',
+                'verbose_name_plural': 'نماذج تنبؤ الانتظار',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:17
+
+from django.db import migrations, models
+
+
+def backfill_durations(apps, schema_editor):
+    from clinic.durations import parse_duration
+
+    Service = apps.get_model('clinic', 'Service')
+    services = list(Service.objects.all())
+    for service in services:
+        service.duration_minutes, service.duration_min_minutes, service.duration_max_minutes = parse_duration(service.duration)
+    Service.objects.bulk_update(services, ['duration_minutes', 'duration_min_minutes', 'duration_max_minutes'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0010_waittimemodel'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='service',
+            name='duration_max_minutes',
+            field=models.PositiveIntegerField(default=30, editable=False, verbose_name='أقصى مدة (دقيقة)'),
+        ),
+        migrations.AddField(
+            model_name='service',
+            name='duration_min_minutes',
+            field=models.PositiveIntegerField(default=30, editable=False, verbose_name='أدنى مدة (دقيقة)'),
+        ),
+        migrations.AddField(
+            model_name='service',
+            name='duration_minutes',
+            field=models.PositiveIntegerField(default=30, editable=False, verbose_name='مدة الزيارة (دقيقة)'),
+        ),
+        migrations.RunPython(backfill_durations, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0011_service_duration_minutes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookingDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True, verbose_name='التاريخ')),
+                ('bookings_count', models.IntegerField(default=0, verbose_name='عدد عمليات الحجز')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'يوم حجز',
+                'verbose_name_plural': 'أيام الحجز',
+            },
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0013_appointment_active_slot_constraint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Chair',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, verbose_name='اسم الكرسي')),
+                ('is_active', models.BooleanField(default=True, verbose_name='نشط')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'كرسي',
+                'verbose_name_plural': 'الكراسي',
+                'ordering': ['id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Dentist',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('full_name', models.CharField(max_length=200, verbose_name='الاسم الكامل')),
+                ('is_active', models.BooleanField(default=True, verbose_name='نشط')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'طبيب',
+                'verbose_name_plural': 'الأطباء',
+                'ordering': ['full_name'],
+            },
+        ),
+        migrations.RemoveConstraint(
+            model_name='appointment',
+            name='unique_active_appointment_slot',
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='chair',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='appointments', to='clinic.chair', verbose_name='الكرسي'),
+        ),
+        migrations.AddConstraint(
+            model_name='appointment',
+            constraint=models.UniqueConstraint(condition=models.Q(models.Q(('status', 'cancelled'), _negated=True), ('chair__isnull', False)), fields=('appointment_date', 'appointment_time', 'chair'), name='unique_active_chair_slot'),
+        ),
+        migrations.AddConstraint(
+            model_name='appointment',
+            constraint=models.UniqueConstraint(condition=models.Q(models.Q(('status', 'cancelled'), _negated=True), ('chair__isnull', True)), fields=('appointment_date', 'appointment_time'), name='unique_active_appointment_slot'),
+        ),
+        migrations.AddField(
+            model_name='dentist',
+            name='services',
+            field=models.ManyToManyField(blank=True, related_name='dentists', to='clinic.service', verbose_name='الخدمات'),
+        ),
+        migrations.AddField(
+            model_name='chair',
+            name='dentist',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='chairs', to='clinic.dentist', verbose_name='الطبيب'),
+        ),
+    ]
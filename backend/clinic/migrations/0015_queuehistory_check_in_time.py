@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0014_dentist_chair_appointment_chair'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='queuehistory',
+            name='check_in_time',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='وقت الحضور'),
+        ),
+    ]
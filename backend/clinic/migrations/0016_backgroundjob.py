@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:35
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0015_queuehistory_check_in_time'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BackgroundJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=100, verbose_name='نوع المهمة')),
+                ('payload', models.JSONField(default=dict, verbose_name='البيانات')),
+                ('status', models.CharField(choices=[('pending', 'في الانتظار'), ('running', 'قيد التنفيذ'), ('done', 'منتهية'), ('failed', 'فشلت')], default='pending', max_length=20, verbose_name='الحالة')),
+                ('attempts', models.IntegerField(default=0, verbose_name='عدد المحاولات')),
+                ('max_attempts', models.IntegerField(default=5, verbose_name='أقصى عدد للمحاولات')),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now, verbose_name='التنفيذ بعد')),
+                ('locked_at', models.DateTimeField(blank=True, null=True, verbose_name='وقت الاستلام')),
+                ('last_error', models.TextField(blank=True, null=True, verbose_name='آخر خطأ')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'مهمة خلفية',
+                'verbose_name_plural': 'المهام الخلفية',
+                'ordering': ['run_after', 'id'],
+                'indexes': [models.Index(fields=['status', 'run_after'], name='clinic_back_status_587db0_idx')],
+            },
+        ),
+    ]
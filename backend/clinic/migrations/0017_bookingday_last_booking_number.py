@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:37
+
+import re
+from datetime import date
+
+from django.db import migrations, models
+
+BOOKING_ID = re.compile(r'^BK-(\d{4})(\d{2})(\d{2})-(\d+)$')
+
+
+def seed_booking_counters(apps, schema_editor):
+    """بدء عداد كل يوم بعد أكبر لاحقة عشوائية صادرة فيه حتى لا تتكرر المعرفات القديمة"""
+    Appointment = apps.get_model('clinic', 'Appointment')
+    BookingDay = apps.get_model('clinic', 'BookingDay')
+
+    last_numbers = {}
+    for booking_id in Appointment.objects.filter(booking_id__startswith='BK-').values_list('booking_id', flat=True).iterator():
+        match = BOOKING_ID.match(booking_id)
+        if not match:
+            continue
+        year, month, day, number = (int(part) for part in match.groups())
+        try:
+            issued = date(year, month, day)
+        except ValueError:
+            continue
+        last_numbers[issued] = max(last_numbers.get(issued, 0), number)
+
+    for issued, number in last_numbers.items():
+        BookingDay.objects.update_or_create(date=issued, defaults={'last_booking_number': number})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0016_backgroundjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bookingday',
+            name='last_booking_number',
+            field=models.IntegerField(default=0, verbose_name='آخر رقم حجز'),
+        ),
+        migrations.RunPython(seed_booking_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:38
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0017_bookingday_last_booking_number'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotencyKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(max_length=50, verbose_name='النطاق')),
+                ('key', models.CharField(max_length=255, verbose_name='المفتاح')),
+                ('request_hash', models.CharField(max_length=64, verbose_name='بصمة الطلب')),
+                ('status_code', models.IntegerField(blank=True, null=True, verbose_name='رمز الاستجابة')),
+                ('response_body', models.JSONField(blank=True, encoder=django.core.serializers.json.DjangoJSONEncoder, null=True, verbose_name='محتوى الاستجابة')),
+                ('expires_at', models.DateTimeField(db_index=True, verbose_name='ينتهي في')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'مفتاح عدم تكرار',
+                'verbose_name_plural': 'مفاتيح عدم التكرار',
+                'constraints': [models.UniqueConstraint(fields=('scope', 'key'), name='unique_idempotency_key')],
+            },
+        ),
+    ]
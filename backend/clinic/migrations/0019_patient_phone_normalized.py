@@ -0,0 +1,86 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:05
+
+import re
+
+from django.db import migrations, models
+
+PHONE_COUNTRY_CODE = '213'
+PHONE_DIGITS = str.maketrans('٠١٢٣٤٥٦٧٨٩', '0123456789')
+
+
+def normalize_phone(phone):
+    """نسخة ثابتة من clinic.models.normalize_phone كما كانت عند كتابة هذا الترحيل"""
+    phone = str(phone or '').strip().translate(PHONE_DIGITS)
+    digits = re.sub(r'\D', '', phone)
+    if not digits:
+        return ''
+    if phone.startswith('+'):
+        return '+' + digits
+    if digits.startswith('00'):
+        return '+' + digits[2:]
+    if digits.startswith('0') and len(digits) == 10:
+        return '+' + PHONE_COUNTRY_CODE + digits[1:]
+    if len(digits) == 9:
+        return '+' + PHONE_COUNTRY_CODE + digits
+    return '+' + digits
+
+
+def backfill_phone_normalized(apps, schema_editor):
+    """
+    تعبئة الرقم الموحد ودمج المرضى المكررين
+
+    المرضى الذين يتشاركون نفس الرقم الموحد ("+213555..." و "0555...")
+    يُدمجون في أقدمهم: تُنقل إليه مواعيدهم وكل ما يرتبط بهم، ويُكمل
+    بريده إن كان فارغاً، ثم يُحذفون حتى يمكن إنشاء الفهرس الفريد (0020).
+    الأرقام التي لا يمكن توحيدها تبقى NULL ولا تُدمج (لا تعني نفس المريض).
+    """
+    Patient = apps.get_model('clinic', 'Patient')
+
+    keepers = {}  # الرقم الموحد -> (المعرف، البريد)
+    duplicates = {}  # معرف المريض الأقدم -> معرفات المكررين
+    emails = {}  # معرف المريض الأقدم -> بريد من أحد المكررين
+    updated = []
+    for patient_id, phone, email in Patient.objects.order_by('id').values_list('id', 'phone', 'email').iterator():
+        normalized = normalize_phone(phone)
+        if not normalized:
+            continue
+        if normalized in keepers:
+            keeper_id, keeper_email = keepers[normalized]
+            duplicates.setdefault(keeper_id, []).append(patient_id)
+            if email and not keeper_email:
+                emails.setdefault(keeper_id, email)
+            continue
+        keepers[normalized] = (patient_id, email)
+        updated.append(Patient(id=patient_id, phone_normalized=normalized))
+    Patient.objects.bulk_update(updated, ['phone_normalized'], batch_size=500)
+
+    relations = [
+        relation for relation in Patient._meta.related_objects
+        if relation.one_to_many or relation.one_to_one
+    ]
+    for keeper_id, patient_ids in duplicates.items():
+        for relation in relations:
+            relation.related_model.objects.filter(**{f'{relation.field.name}__in': patient_ids}).update(
+                **{relation.field.name: keeper_id}
+            )
+        if keeper_id in emails:
+            Patient.objects.filter(id=keeper_id).update(email=emails[keeper_id])
+        Patient.objects.filter(id__in=patient_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0018_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patient',
+            name='phone_normalized',
+            field=models.CharField(editable=False, max_length=17, null=True, verbose_name='رقم الهاتف الموحد'),
+        ),
+        # الفهرس الفريد في الترحيل التالي: تعديل الجدول بعد حذف صفوف في نفس المعاملة
+        # يفشل على PostgreSQL ("pending trigger events")
+        migrations.RunPython(backfill_phone_normalized, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0019_patient_phone_normalized'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='patient',
+            name='phone_normalized',
+            field=models.CharField(editable=False, max_length=17, null=True, unique=True, verbose_name='رقم الهاتف الموحد'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0020_alter_patient_phone_normalized'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueueDayVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=16, unique=True, verbose_name='اليوم')),
+                ('version', models.BigIntegerField(verbose_name='الإصدار')),
+            ],
+            options={
+                'verbose_name': 'إصدار طابور',
+                'verbose_name_plural': 'إصدارات الطابور',
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:05
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0021_queuedayversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueueEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=32, verbose_name='العملية الناشرة')),
+                ('appointment_date', models.DateField(verbose_name='التاريخ')),
+                ('message', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder, verbose_name='الحدث')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'verbose_name': 'حدث طابور',
+                'verbose_name_plural': 'أحداث الطابور',
+            },
+        ),
+    ]
@@ -0,0 +1,16 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:30
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0022_queueevent'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='QueueEvent',
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0023_delete_queueevent'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='idempotencykey',
+            name='unique_idempotency_key',
+        ),
+        migrations.AddField(
+            model_name='idempotencykey',
+            name='client',
+            field=models.CharField(default='', max_length=64, verbose_name='العميل'),
+        ),
+        migrations.AddConstraint(
+            model_name='idempotencykey',
+            constraint=models.UniqueConstraint(fields=('scope', 'client', 'key'), name='unique_idempotency_client_key'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0024_idempotencykey_client'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='appointmentnotification',
+            name='status',
+            field=models.CharField(choices=[('pending', 'في الانتظار'), ('sending', 'قيد الإرسال'), ('sent', 'تم الإرسال'), ('failed', 'فشل الإرسال')], default='pending', max_length=20, verbose_name='الحالة'),
+        ),
+    ]
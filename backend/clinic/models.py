@@ -1,8 +1,9 @@
-from django.db import models
+import re
+from django.db import models, transaction
+from django.utils import timezone
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import RegexValidator
-from datetime import datetime
-import random
-import string
+from .durations import parse_duration
 
 class Service(models.Model):
     """خدمات العيادة"""
@@ -11,6 +12,10 @@ class Service(models.Model):
     price_min = models.DecimalField(max_digits=10, decimal_places=2, verbose_name='السعر الأدنى')
     price_max = models.DecimalField(max_digits=10, decimal_places=2, verbose_name='السعر الأعلى')
     duration = models.CharField(max_length=100, verbose_name='المدة')
+    # تُحسب تلقائياً من نص المدة عند الحفظ
+    duration_minutes = models.PositiveIntegerField(default=30, editable=False, verbose_name='مدة الزيارة (دقيقة)')
+    duration_min_minutes = models.PositiveIntegerField(default=30, editable=False, verbose_name='أدنى مدة (دقيقة)')
+    duration_max_minutes = models.PositiveIntegerField(default=30, editable=False, verbose_name='أقصى مدة (دقيقة)')
     image = models.ImageField(upload_to='services/', blank=True, null=True)
     is_active = models.BooleanField(default=True, verbose_name='نشط')
     created_at = models.DateTimeField(auto_now_add=True)
@@ -24,6 +29,44 @@ class Service(models.Model):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        self.duration_minutes, self.duration_min_minutes, self.duration_max_minutes = parse_duration(self.duration)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'duration' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'duration_minutes', 'duration_min_minutes', 'duration_max_minutes'}
+        super().save(*args, **kwargs)
+
+
+PHONE_COUNTRY_CODE = '213'  # الجزائر: +213 555 123 456 == 0555 123 456
+PHONE_DIGITS = str.maketrans('٠١٢٣٤٥٦٧٨٩', '0123456789')
+
+
+def normalize_phone(phone) -> str:
+    """
+    توحيد رقم الهاتف بصيغة E.164 (للمقارنة والبحث وعدم تكرار المرضى)
+
+    الأرقام المحلية (0 + 9 أرقام، أو 9 أرقام بدون الصفر) تُعتبر جزائرية.
+
+    Examples:
+        "+213 555-12-34-56" -> "+213555123456"
+        "00213555123456" -> "+213555123456"
+        "0555 12 34 56" -> "+213555123456"
+        "+33 6 12 34 56 78" -> "+33612345678"
+    """
+    phone = str(phone or '').strip().translate(PHONE_DIGITS)
+    digits = re.sub(r'\D', '', phone)
+    if not digits:
+        return ''
+    if phone.startswith('+'):
+        return '+' + digits
+    if digits.startswith('00'):
+        return '+' + digits[2:]
+    if digits.startswith('0') and len(digits) == 10:
+        return '+' + PHONE_COUNTRY_CODE + digits[1:]
+    if len(digits) == 9:
+        return '+' + PHONE_COUNTRY_CODE + digits
+    return '+' + digits
+
 
 class Patient(models.Model):
     """معلومات المرضى"""
@@ -33,6 +76,8 @@ class Patient(models.Model):
         message="رقم الهاتف يجب أن يكون بالصيغة: '+213555123456'"
     )
     phone = models.CharField(validators=[phone_regex], max_length=17, verbose_name='رقم الهاتف')
+    # NULL (وليس '') للأرقام التي لا يمكن توحيدها حتى لا تتصادم في الفهرس الفريد
+    phone_normalized = models.CharField(max_length=17, unique=True, null=True, editable=False, verbose_name='رقم الهاتف الموحد')
     email = models.EmailField(blank=True, null=True, verbose_name='البريد الإلكتروني')
     date_of_birth = models.DateField(blank=True, null=True, verbose_name='تاريخ الميلاد')
     address = models.TextField(blank=True, null=True, verbose_name='العنوان')
@@ -48,6 +93,48 @@ class Patient(models.Model):
     def __str__(self):
         return self.full_name
 
+    def save(self, *args, **kwargs):
+        self.phone_normalized = normalize_phone(self.phone) or None
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'phone' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'phone_normalized'}
+        super().save(*args, **kwargs)
+
+
+class Dentist(models.Model):
+    """أطباء الأسنان والخدمات التي يقدمونها"""
+    full_name = models.CharField(max_length=200, verbose_name='الاسم الكامل')
+    services = models.ManyToManyField(Service, blank=True, related_name='dentists', verbose_name='الخدمات')
+    is_active = models.BooleanField(default=True, verbose_name='نشط')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'طبيب'
+        verbose_name_plural = 'الأطباء'
+        ordering = ['full_name']
+
+    def __str__(self):
+        return self.full_name
+
+
+class Chair(models.Model):
+    """كراسي العلاج - كل كرسي طابور مستقل يخدم موعداً واحداً في نفس الوقت"""
+    name = models.CharField(max_length=100, verbose_name='اسم الكرسي')
+    # الكرسي بدون طبيب يقبل كل الخدمات، وإلا فخدمات طبيبه فقط
+    dentist = models.ForeignKey(
+        Dentist, on_delete=models.SET_NULL, null=True, blank=True, related_name='chairs', verbose_name='الطبيب'
+    )
+    is_active = models.BooleanField(default=True, verbose_name='نشط')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'كرسي'
+        verbose_name_plural = 'الكراسي'
+        ordering = ['id']
+
+    def __str__(self):
+        return self.name
+
 
 class Appointment(models.Model):
     """الحجوزات"""
@@ -62,6 +149,10 @@ class Appointment(models.Model):
     queue_number = models.IntegerField(default=0, verbose_name='رقم الطابور')
     patient = models.ForeignKey(Patient, on_delete=models.CASCADE, verbose_name='المريض')
     service = models.ForeignKey(Service, on_delete=models.SET_NULL, null=True, verbose_name='الخدمة')
+    # الكرسي الذي عليه مواعيد يُعطّل بدلاً من حذفه (الحذف يدمج مواعيده في طابور بلا كرسي)
+    chair = models.ForeignKey(
+        Chair, on_delete=models.PROTECT, null=True, blank=True, related_name='appointments', verbose_name='الكرسي'
+    )
     appointment_date = models.DateField(verbose_name='تاريخ الموعد')
     appointment_time = models.TimeField(verbose_name='وقت الموعد')
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', verbose_name='الحالة')
@@ -73,24 +164,53 @@ class Appointment(models.Model):
         verbose_name = 'حجز'
         verbose_name_plural = 'الحجوزات'
         ordering = ['-appointment_date', '-appointment_time']
-        unique_together = ['appointment_date', 'appointment_time']
+        constraints = [
+            # الموعد الملغى يحرّر وقته لحجز جديد، وكل كرسي يقبل موعداً واحداً في نفس الوقت
+            models.UniqueConstraint(
+                fields=['appointment_date', 'appointment_time', 'chair'],
+                condition=~models.Q(status='cancelled') & models.Q(chair__isnull=False),
+                name='unique_active_chair_slot'
+            ),
+            models.UniqueConstraint(
+                fields=['appointment_date', 'appointment_time'],
+                condition=~models.Q(status='cancelled') & models.Q(chair__isnull=True),
+                name='unique_active_appointment_slot'
+            ),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_queue_slot()
+        return instance
+
+    def _remember_queue_slot(self):
+        """حفظ موقع الموعد كما هو في قاعدة البيانات (التاريخ، الوقت، الحالة)"""
+        loaded = self.__dict__
+        self._loaded_queue_slot = (
+            loaded.get('appointment_date'),
+            loaded.get('appointment_time'),
+            loaded.get('status'),
+        )
+        self._loaded_chair_id = loaded.get('chair_id')
 
     def generate_booking_id(self):
-        """Generate unique booking ID in format: BK-YYYYMMDD-####"""
+        """Generate unique booking ID in format: BK-YYYYMMDD-#### (per-day sequence)"""
         if not self.booking_id:
-            date_str = datetime.now().strftime('%Y%m%d')
-            random_suffix = ''.join(random.choices(string.digits, k=4))
-            self.booking_id = f"BK-{date_str}-{random_suffix}"
+            from .booking import booking_id_sequence
+            self.booking_id = booking_id_sequence.next_id()
 
     def calculate_queue_number(self):
         """حساب رقم الطابور بناءً على عدد المواعيد قبل هذا الموعد في نفس اليوم"""
         if not self.id:  # إذا كان موعد جديد
-            # احسب عدد المواعيد قبل هذا الموعد في نفس اليوم
-            appointments_before = Appointment.objects.filter(
-                appointment_date=self.appointment_date,
-                appointment_time__lt=self.appointment_time,
-                status__in=['pending', 'confirmed', 'completed']  # تجاهل الملغاة
-            ).count()
+            # احسب عدد المواعيد قبل هذا الموعد في نفس اليوم (من فهرس الطابور)
+            from .queue_service import QueueService
+            # المواعيد في نفس الوقت (على كراسي أخرى) تسبقه لأن معرفاتها أصغر
+            appointments_before = QueueService.count_appointments_before(
+                self.appointment_date,
+                self.appointment_time,
+                inclusive=True
+            )
             self.queue_number = appointments_before + 1
         return self.queue_number
 
@@ -103,16 +223,52 @@ class Appointment(models.Model):
             return None
 
     def save(self, *args, **kwargs):
+        from .queue_service import QueueService
+
         if not self.booking_id:
             self.generate_booking_id()
-        if not self.id:  # إذا كان موعد جديد
-            self.calculate_queue_number()
-        super().save(*args, **kwargs)
+        previous_slot = getattr(self, '_loaded_queue_slot', None) if self.id else None
+        with transaction.atomic():
+            if not self.id and not self.queue_number:  # موعد جديد بدون رقم محجوز مسبقاً
+                self.calculate_queue_number()
+            super().save(*args, **kwargs)
+            # إعادة ترقيم المواعيد اللاحقة عند الإلغاء أو تغيير الوقت أو الإضافة
+            QueueService.renumber_after_change(self, previous_slot)
+        self._remember_queue_slot()
 
     def __str__(self):
         return f"{self.patient.full_name} - {self.appointment_date} {self.appointment_time}"
 
 
+class BookingDay(models.Model):
+    """يوم الحجز - صف واحد لكل يوم يُقفل لتسلسل الحجوزات المتزامنة ويحمل عداد معرفات الحجز"""
+    date = models.DateField(unique=True, verbose_name='التاريخ')
+    bookings_count = models.IntegerField(default=0, verbose_name='عدد عمليات الحجز')
+    # آخر رقم محجوز لمعرفات BK-YYYYMMDD-#### الصادرة في هذا اليوم (تاريخ الإنشاء وليس تاريخ الموعد)
+    last_booking_number = models.IntegerField(default=0, verbose_name='آخر رقم حجز')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'يوم حجز'
+        verbose_name_plural = 'أيام الحجز'
+
+    def __str__(self):
+        return str(self.date)
+
+
+class QueueDayVersion(models.Model):
+    """إصدار طابور يوم (أو كل الأيام) - عداد مشترك بين كل العمليات يُزاد بـ F() + 1"""
+    key = models.CharField(max_length=16, unique=True, verbose_name='اليوم')  # YYYY-MM-DD أو all
+    version = models.BigIntegerField(verbose_name='الإصدار')
+
+    class Meta:
+        verbose_name = 'إصدار طابور'
+        verbose_name_plural = 'إصدارات الطابور'
+
+    def __str__(self):
+        return f"{self.key}: {self.version}"
+
+
 class Testimonial(models.Model):
     """آراء العملاء"""
     patient_name = models.CharField(max_length=200, default='', verbose_name='اسم المريض')
@@ -215,6 +371,7 @@ class AppointmentNotification(models.Model):
     
     STATUS_CHOICES = [
         ('pending', 'في الانتظار'),
+        ('sending', 'قيد الإرسال'),
         ('sent', 'تم الإرسال'),
         ('failed', 'فشل الإرسال'),
     ]
@@ -253,6 +410,15 @@ class QueueStatistics(models.Model):
     # الحد الأدنى والأقصى
     min_wait_minutes = models.IntegerField(default=0, verbose_name='الحد الأدنى للانتظار (دقيقة)')
     max_wait_minutes = models.IntegerField(default=0, verbose_name='الحد الأقصى للانتظار (دقيقة)')
+    min_service_duration_minutes = models.IntegerField(default=0, verbose_name='الحد الأدنى لمدة الخدمة (دقيقة)')
+    max_service_duration_minutes = models.IntegerField(default=0, verbose_name='الحد الأقصى لمدة الخدمة (دقيقة)')
+    
+    # مجاميع تراكمية (تُحدّث تدريجياً عند انتهاء كل موعد)
+    wait_sum_minutes = models.BigIntegerField(default=0, verbose_name='مجموع الانتظار (دقيقة)')
+    wait_sum_squares = models.BigIntegerField(default=0, verbose_name='مجموع مربعات الانتظار')
+    duration_samples = models.IntegerField(default=0, verbose_name='عدد قياسات مدة الخدمة')
+    duration_sum_minutes = models.BigIntegerField(default=0, verbose_name='مجموع مدة الخدمة (دقيقة)')
+    duration_sum_squares = models.BigIntegerField(default=0, verbose_name='مجموع مربعات مدة الخدمة')
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -270,6 +436,21 @@ class QueueStatistics(models.Model):
     def __str__(self):
         return f"{self.service.name} - {self.appointment_date}: {self.average_wait_minutes} دقيقة"
 
+    @staticmethod
+    def _stddev(count, total, sum_squares):
+        if count < 2:
+            return 0.0
+        mean = total / count
+        return max(0.0, sum_squares / count - mean * mean) ** 0.5
+
+    def wait_stddev_minutes(self) -> float:
+        """الانحراف المعياري للانتظار من المجاميع التراكمية"""
+        return self._stddev(self.completed_appointments, self.wait_sum_minutes, self.wait_sum_squares)
+
+    def service_duration_stddev_minutes(self) -> float:
+        """الانحراف المعياري لمدة الخدمة من المجاميع التراكمية"""
+        return self._stddev(self.duration_samples, self.duration_sum_minutes, self.duration_sum_squares)
+
 
 class QueueHistory(models.Model):
     """سجل الطابور - تتبع تفصيلي لكل موعد في الطابور"""
@@ -277,6 +458,7 @@ class QueueHistory(models.Model):
     
     # معلومات الوقت
     scheduled_start_time = models.DateTimeField(verbose_name='وقت البدء المجدول')
+    check_in_time = models.DateTimeField(blank=True, null=True, verbose_name='وقت الحضور')
     actual_start_time = models.DateTimeField(blank=True, null=True, verbose_name='وقت البدء الفعلي')
     actual_end_time = models.DateTimeField(blank=True, null=True, verbose_name='وقت الانتهاء الفعلي')
     
@@ -327,3 +509,76 @@ class QueueHistory(models.Model):
             self.calculate_actual_wait_minutes()
             self.calculate_service_duration()
         super().save(*args, **kwargs)
+
+
+class WaitTimeModel(models.Model):
+    """نموذج تنبؤ الانتظار المدرّب (معاملات الانحدار)"""
+    feature_names = models.JSONField(verbose_name='أسماء الخصائص')
+    coefficients = models.JSONField(verbose_name='المعاملات')
+    training_samples = models.IntegerField(default=0, verbose_name='عدد عينات التدريب')
+    mean_absolute_error = models.FloatField(default=0, verbose_name='متوسط الخطأ المطلق (دقيقة)')
+    heuristic_mean_absolute_error = models.FloatField(default=0, verbose_name='متوسط خطأ الطريقة السابقة (دقيقة)')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'نموذج تنبؤ الانتظار'
+        verbose_name_plural = 'نماذج تنبؤ الانتظار'
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.created_at:%Y-%m-%d %H:%M} - MAE {self.mean_absolute_error:.1f}"
+
+
+class BackgroundJob(models.Model):
+    """مهمة خلفية - طابور مهام دائم في قاعدة البيانات يُنفّذه أمر run_worker"""
+    STATUS_CHOICES = [
+        ('pending', 'في الانتظار'),
+        ('running', 'قيد التنفيذ'),
+        ('done', 'منتهية'),
+        ('failed', 'فشلت'),
+    ]
+
+    kind = models.CharField(max_length=100, verbose_name='نوع المهمة')
+    payload = models.JSONField(default=dict, verbose_name='البيانات')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', verbose_name='الحالة')
+    attempts = models.IntegerField(default=0, verbose_name='عدد المحاولات')
+    max_attempts = models.IntegerField(default=5, verbose_name='أقصى عدد للمحاولات')
+    run_after = models.DateTimeField(default=timezone.now, verbose_name='التنفيذ بعد')
+    locked_at = models.DateTimeField(blank=True, null=True, verbose_name='وقت الاستلام')
+    last_error = models.TextField(blank=True, null=True, verbose_name='آخر خطأ')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'مهمة خلفية'
+        verbose_name_plural = 'المهام الخلفية'
+        ordering = ['run_after', 'id']
+        indexes = [
+            models.Index(fields=['status', 'run_after']),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.id} ({self.status})"
+
+
+class IdempotencyKey(models.Model):
+    """مفتاح عدم التكرار - الاستجابة المحفوظة لطلب POST أُرسل مع ترويسة Idempotency-Key"""
+    scope = models.CharField(max_length=50, verbose_name='النطاق')
+    # المستخدم أو عنوان IP: نفس المفتاح من عميلين مختلفين لا يتصادم
+    client = models.CharField(max_length=64, default='', verbose_name='العميل')
+    key = models.CharField(max_length=255, verbose_name='المفتاح')
+    request_hash = models.CharField(max_length=64, verbose_name='بصمة الطلب')
+    status_code = models.IntegerField(blank=True, null=True, verbose_name='رمز الاستجابة')  # فارغ: الطلب قيد التنفيذ
+    response_body = models.JSONField(blank=True, null=True, encoder=DjangoJSONEncoder, verbose_name='محتوى الاستجابة')
+    expires_at = models.DateTimeField(db_index=True, verbose_name='ينتهي في')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'مفتاح عدم تكرار'
+        verbose_name_plural = 'مفاتيح عدم التكرار'
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'client', 'key'], name='unique_idempotency_client_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.scope}:{self.client}:{self.key}"
@@ -3,89 +3,92 @@
 يمكن توسيع هذه الخدمة لاحقاً لتضمين SMS حقيقي وبريد إلكتروني
 """
 
-from django.core.mail import send_mail
+import time
+from django.core.mail import EmailMultiAlternatives, get_connection
 from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
 from datetime import datetime, timedelta
 from .models import Appointment, AppointmentNotification, Patient
 
 
 class NotificationService:
     """خدمة مركزية لإرسال الإشعارات"""
+
+    EMAIL_BATCH_SIZE = 100  # إشعارات لكل دفعة (اتصال SMTP واحد وتحديث جماعي واحد)
+    SENDING_TIMEOUT_SECONDS = 600  # إشعار بقي قيد الإرسال أطول من هذا (توقفت عمليته) يُستلم من جديد
     
     @staticmethod
-    def create_appointment_notifications(appointment):
+    def create_appointment_notifications(appointment, send_now=True):
         """
-        إنشاء إشعارات تلقائية للموعد الجديد
+        إنشاء إشعارات تلقائية للموعد الجديد (bulk_create واحد)
         - إشعار فوري عند الحجز (WhatsApp/Email)
         - تذكير قبل 24 ساعة
+
+        send_now=False: إنشاء السجلات فقط (العامل الخلفي يرسلها كمهام مستقلة)
+
+        Returns:
+            قائمة الإشعارات المُنشأة، أو None عند الفشل
         """
         try:
             patient = appointment.patient
+            now = datetime.now()
             
-            # 1. إشعار فوري عند الحجز
-            if patient.email:
-                NotificationService.create_notification(
-                    appointment=appointment,
-                    notification_type='email',
-                    recipient=patient.email,
-                    scheduled_time=datetime.now(),
-                    message_type='booking_confirmation'
-                )
+            # 1. إشعار فوري عند الحجز، 2. تذكير قبل 24 ساعة
+            schedule = [(now, 'booking_confirmation')]
+            reminder_time = appointment.appointment_datetime() - timedelta(hours=24)
+            if reminder_time > now:
+                schedule.append((reminder_time, 'appointment_reminder'))
             
-            if patient.phone:
-                NotificationService.create_notification(
-                    appointment=appointment,
-                    notification_type='whatsapp',
-                    recipient=patient.phone,
-                    scheduled_time=datetime.now(),
-                    message_type='booking_confirmation'
-                )
+            channels = [
+                (notification_type, recipient)
+                for notification_type, recipient in (('email', patient.email), ('whatsapp', patient.phone))
+                if recipient
+            ]
             
-            # 2. تذكير قبل 24 ساعة
-            reminder_time = appointment.appointment_datetime() - timedelta(hours=24)
-            if reminder_time > datetime.now():
-                if patient.email:
-                    NotificationService.create_notification(
-                        appointment=appointment,
-                        notification_type='email',
-                        recipient=patient.email,
-                        scheduled_time=reminder_time,
-                        message_type='appointment_reminder'
-                    )
-                
-                if patient.phone:
-                    NotificationService.create_notification(
-                        appointment=appointment,
-                        notification_type='whatsapp',
-                        recipient=patient.phone,
-                        scheduled_time=reminder_time,
-                        message_type='appointment_reminder'
+            with transaction.atomic():
+                notifications = AppointmentNotification.objects.bulk_create([
+                    NotificationService.build_notification(
+                        appointment, notification_type, recipient, scheduled_time, message_type
                     )
+                    for scheduled_time, message_type in schedule
+                    for notification_type, recipient in channels
+                ])
             
-            return True
+            if send_now:
+                for notification in notifications:
+                    if notification.scheduled_time <= now:
+                        NotificationService.send_notification(notification)
+            
+            return notifications
         except Exception as e:
             print(f"خطأ في إنشاء الإشعارات: {str(e)}")
-            return False
+            return None
     
     @staticmethod
-    def create_notification(appointment, notification_type, recipient, scheduled_time, message_type='booking_confirmation'):
+    def build_notification(appointment, notification_type, recipient, scheduled_time, message_type='booking_confirmation'):
+        """بناء إشعار بدون حفظه (للإدراج الجماعي)"""
+        return AppointmentNotification(
+            appointment=appointment,
+            notification_type=notification_type,
+            recipient=recipient,
+            scheduled_time=scheduled_time,
+            message=NotificationService.get_message_template(appointment, message_type, notification_type),
+            status='pending'
+        )
+    
+    @staticmethod
+    def create_notification(appointment, notification_type, recipient, scheduled_time, message_type='booking_confirmation', send_now=True):
         """إنشاء تسجيل إشعار جديد"""
         try:
-            message = NotificationService.get_message_template(
-                appointment, message_type, notification_type
-            )
-            
-            notification = AppointmentNotification.objects.create(
-                appointment=appointment,
-                notification_type=notification_type,
-                recipient=recipient,
-                scheduled_time=scheduled_time,
-                message=message,
-                status='pending'
+            notification = NotificationService.build_notification(
+                appointment, notification_type, recipient, scheduled_time, message_type
             )
+            notification.save()
             
             # إرسال فوري إذا كان الوقت الحالي
-            if scheduled_time <= datetime.now():
+            if send_now and scheduled_time <= datetime.now():
                 NotificationService.send_notification(notification)
             
             return notification
@@ -115,21 +118,25 @@ class NotificationService:
             print(f"فشل إرسال الإشعار: {str(e)}")
             return False
     
+    @staticmethod
+    def build_email_message(notification, connection=None):
+        """بناء رسالة البريد لإشعار بدون إرسالها"""
+        appointment = notification.appointment
+        message = EmailMultiAlternatives(
+            f"تأكيد موعد - عيادة Future Smile - {appointment.booking_id}",
+            notification.message,
+            settings.DEFAULT_FROM_EMAIL,
+            [notification.recipient],
+            connection=connection,
+        )
+        message.attach_alternative(f"<div dir='rtl'><pre>{notification.message}</pre></div>", 'text/html')
+        return message
+    
     @staticmethod
     def send_email_notification(notification):
         """إرسال إشعار بريد إلكتروني"""
         try:
-            appointment = notification.appointment
-            subject = f"تأكيد موعد - عيادة Future Smile - {appointment.booking_id}"
-            
-            send_mail(
-                subject,
-                notification.message,
-                settings.DEFAULT_FROM_EMAIL,
-                [notification.recipient],
-                html_message=f"<div dir='rtl'><pre>{notification.message}</pre></div>",
-                fail_silently=False,
-            )
+            NotificationService.build_email_message(notification).send(fail_silently=False)
             return True
         except Exception as e:
             print(f"فشل إرسال البريد الإلكتروني: {str(e)}")
@@ -202,22 +209,142 @@ class NotificationService:
         
         return "إشعار من عيادة Future Smile"
     
+    @staticmethod
+    def claim(notification_ids, statuses=('pending',)) -> list:
+        """
+        استلام إشعارات للإرسال بتحديث شرطي واحد (status='sending')
+
+        الإشعار الذي استلمه مرسل آخر (الأمر الدوري أو مهمة send_notification)
+        لا يطابق الشرط فلا يُرسل مرتين. وقت التحديث يميّز صفوف هذا الاستلام.
+
+        Args:
+            notification_ids: الإشعارات المرشحة
+            statuses: الحالات التي يُستلم منها
+
+        Returns:
+            الإشعارات المستلمة (مع appointment) بترتيب وقتها المجدول
+        """
+        now = timezone.now()
+        stale = now - timedelta(seconds=NotificationService.SENDING_TIMEOUT_SECONDS)
+        claimed = AppointmentNotification.objects.filter(
+            Q(status__in=statuses) | Q(status='sending', updated_at__lt=stale), id__in=notification_ids
+        ).update(status='sending', updated_at=now)
+        if not claimed:
+            return []
+        return list(
+            AppointmentNotification.objects.filter(id__in=notification_ids, status='sending', updated_at=now)
+            .select_related('appointment__patient', 'appointment__service').order_by('scheduled_time', 'id')
+        )
+
+    @staticmethod
+    def send_batch(notifications) -> dict:
+        """
+        إرسال دفعة من الإشعارات وكتابة حالاتها بـ bulk_update واحد
+
+        رسائل البريد تُرسل عبر اتصال SMTP واحد (get_connection) بدل اتصال
+        لكل رسالة. كل رسالة تُمرر لـ send_messages وحدها على نفس الاتصال حتى
+        تُعرف حالة كل إشعار (الاستدعاء الجماعي يتوقف عند أول خطأ).
+
+        Args:
+            notifications: إشعارات مستلمة عبر claim (مع appointment)
+
+        Returns:
+            {'sent', 'failed', 'seconds'}
+        """
+        started = time.perf_counter()
+        sent_time = datetime.now()
+
+        def mark(notification, error=None):
+            notification.status = 'failed' if error else 'sent'
+            notification.sent_time = None if error else sent_time
+            notification.error_message = str(error) if error else None
+
+        emails = [notification for notification in notifications if notification.notification_type == 'email']
+        if emails:
+            connection = get_connection(fail_silently=False)
+            try:
+                connection.open()
+            except Exception as e:
+                print(f"فشل الاتصال بخادم البريد: {str(e)}")
+                for notification in emails:
+                    mark(notification, e)
+            else:
+                try:
+                    for notification in emails:
+                        try:
+                            connection.send_messages([NotificationService.build_email_message(notification, connection)])
+                            mark(notification)
+                        except Exception as e:
+                            mark(notification, e)
+                finally:
+                    connection.close()
+
+        senders = {
+            'sms': NotificationService.send_sms_notification,
+            'whatsapp': NotificationService.send_whatsapp_notification,
+        }
+        for notification in notifications:
+            if notification.notification_type in senders:
+                try:
+                    senders[notification.notification_type](notification)
+                    mark(notification)
+                except Exception as e:
+                    mark(notification, e)
+
+        now = timezone.now()
+        for notification in notifications:
+            notification.updated_at = now
+        AppointmentNotification.objects.bulk_update(
+            notifications, ['status', 'sent_time', 'error_message', 'updated_at']
+        )
+
+        failed = sum(1 for notification in notifications if notification.status == 'failed')
+        return {
+            'sent': len(notifications) - failed,
+            'failed': failed,
+            'seconds': time.perf_counter() - started,
+        }
+    
+    @staticmethod
+    def dispatch_due_notifications(batch_size: int = None, limit: int = None):
+        """
+        إرسال الإشعارات المعلقة التي حان وقتها على دفعات
+
+        Args:
+            batch_size: إشعارات لكل دفعة (EMAIL_BATCH_SIZE افتراضياً)
+            limit: أقصى عدد من الإشعارات (الكل افتراضياً)
+
+        Yields:
+            إحصائيات كل دفعة (انظر send_batch)
+        """
+        batch_size = batch_size or NotificationService.EMAIL_BATCH_SIZE
+        stale = timezone.now() - timedelta(seconds=NotificationService.SENDING_TIMEOUT_SECONDS)
+        due = AppointmentNotification.objects.filter(
+            Q(status='pending') | Q(status='sending', updated_at__lt=stale),
+            scheduled_time__lte=timezone.now()
+        ).order_by('scheduled_time', 'id').values_list('id', flat=True)
+
+        remaining = limit
+        while remaining is None or remaining > 0:
+            size = batch_size if remaining is None else min(batch_size, remaining)
+            # كل دفعة تغير حالة صفوفها، فالاستعلام التالي يبدأ بما بعدها
+            candidates = list(due[:size])
+            if not candidates:
+                break
+            # ما استلمه مرسل آخر بين القراءة والاستلام يُترك له
+            batch = NotificationService.claim(candidates)
+            if batch:
+                yield NotificationService.send_batch(batch)
+            if remaining is not None:
+                remaining -= len(candidates)
+    
     @staticmethod
     def send_pending_notifications():
         """
         إرسال جميع الإشعارات المعلقة التي حان وقتها
-        يمكن استدعاء هذه الدالة من خلال celery task أو cron job
+        يمكن استدعاء هذه الدالة من أمر send_notifications أو cron job
+
+        Returns:
+            عدد الإشعارات المرسلة
         """
-        from django.utils import timezone
-        
-        pending = AppointmentNotification.objects.filter(
-            status='pending',
-            scheduled_time__lte=timezone.now()
-        )
-        
-        count = 0
-        for notification in pending:
-            if NotificationService.send_notification(notification):
-                count += 1
-        
-        return count
+        return sum(batch['sent'] for batch in NotificationService.dispatch_due_notifications())
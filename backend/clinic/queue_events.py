@@ -0,0 +1,188 @@
+"""
+بث أحداث الطابور
+Per-process broadcaster for live queue deltas (Server-Sent Events), relayed through the database.
+
+يعمل بدون Redis: كل عملية (worker) تحتفظ بقائمة المشتركين لديها، وتُنشر
+الأحداث من إشارات الحفظ بعد تأكيد المعاملة، حاملة إصدار اليوم الذي أعادته
+زيادته (بدون استعلام عند النشر). تغييرات العمليات الأخرى (عمليات gunicorn
+الأخرى والعامل الخلفي run_worker) يلتقطها خيط ناقل في كل عملية ويب لديها
+مشتركون: يتابع QueueDayVersion لأيام المشتركين، فإذا تجاوز الإصدار آخر ما
+بُث يُرسل حدث version ليجلب العميل الطابور من جديد.
+المشترك الخامل لا يكلف سوى asyncio.Queue فارغة ومهمة معلّقة.
+"""
+
+import asyncio
+import json
+import logging
+import threading
+import time
+from asgiref.sync import sync_to_async
+from django.db import DatabaseError, close_old_connections, connection
+from django.utils import timezone
+from .models import QueueDayVersion
+
+logger = logging.getLogger(__name__)
+
+
+class QueueBroadcaster:
+    """ناشر محلي لأحداث الطابور حسب اليوم"""
+
+    MAX_PENDING_EVENTS = 100  # الحد الأقصى للأحداث المعلقة لكل مشترك
+    RELAY_INTERVAL_SECONDS = 1.0  # فترة قراءة إصدارات الأيام
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()  # {(loop, queue, appointment_date)}
+        self._last_state = {}  # date -> {booking_id: (event, payload)}
+        self._versions = {}  # date -> آخر إصدار بُث لمشتركي هذه العملية
+        self._relay = None
+
+    def subscribe(self, appointment_date) -> tuple:
+        """تسجيل مشترك جديد (يُستدعى من داخل حلقة asyncio)"""
+        subscriber = (
+            asyncio.get_running_loop(),
+            asyncio.Queue(maxsize=self.MAX_PENDING_EVENTS),
+            appointment_date,
+        )
+        with self._lock:
+            self._subscribers.add(subscriber)
+            if self._relay is None:
+                self._relay = threading.Thread(target=self._relay_loop, name='queue-event-relay', daemon=True)
+                self._relay.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        """إلغاء تسجيل مشترك"""
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return len(self._subscribers)
+
+    @staticmethod
+    def _offer(queue, message):
+        """إضافة حدث للطابور مع إسقاط الأقدم عند الامتلاء"""
+        if queue.full():
+            try:
+                queue.get_nowait()
+            except asyncio.QueueEmpty:
+                pass
+        queue.put_nowait(message)
+
+    def publish(self, appointment_date, booking_id, event: str, payload: dict, version: int = None) -> bool:
+        """
+        نشر حدث للمشتركين في نفس اليوم، فقط إذا تغيّرت حالة الحجز فعلاً
+
+        Args:
+            appointment_date: تاريخ الطابور
+            booking_id: معرف الحجز
+            event: نوع الحدث (position, started, completed, removed)
+            payload: بيانات الحدث
+            version: إصدار اليوم بعد التغيير (كما أعاده QueueVersion.bump)
+
+        Returns:
+            True إذا تم النشر
+        """
+        state = (event, tuple(sorted(payload.items())))
+        with self._lock:
+            # الاحتفاظ بحالة الأيام الحالية والقادمة فقط
+            today = timezone.localdate()
+            for old_date in [d for d in self._last_state if d < today]:
+                del self._last_state[old_date]
+                self._versions.pop(old_date, None)
+
+            day_state = self._last_state.setdefault(appointment_date, {})
+            if day_state.get(booking_id) == state:
+                return False
+            day_state[booking_id] = state
+
+        self._fan_out(appointment_date, {'event': event, 'booking_id': booking_id, **payload, 'version': version})
+        return True
+
+    def _fan_out(self, appointment_date, message: dict):
+        """تسليم حدث لمشتركي هذه العملية في نفس اليوم"""
+        with self._lock:
+            version = message.get('version')
+            if version is not None and version > self._versions.get(appointment_date, 0):
+                self._versions[appointment_date] = version
+            targets = [s for s in self._subscribers if s[2] == appointment_date]
+
+        for subscriber in targets:
+            loop, queue, _ = subscriber
+            try:
+                loop.call_soon_threadsafe(self._offer, queue, message)
+            except RuntimeError:
+                # الحلقة مغلقة - المشترك انقطع
+                logger.debug("إزالة مشترك منقطع من بث الطابور")
+                self.unsubscribe(subscriber)
+
+    def _relay_loop(self):
+        """خيط الناقل: يعمل ما دام في العملية مشتركون، ثم ينتهي ويُعاد تشغيله مع أول مشترك"""
+        try:
+            while True:
+                with self._lock:
+                    if not self._subscribers:
+                        self._relay = None
+                        return
+                    days = {s[2] for s in self._subscribers}
+                try:
+                    close_old_connections()
+                    self._relay_versions(days)
+                except DatabaseError as e:
+                    logger.warning(f"تعذر قراءة إصدارات الطابور: {e}")
+                time.sleep(self.RELAY_INTERVAL_SECONDS)
+        finally:
+            connection.close()
+
+    def _relay_versions(self, days: set):
+        """إرسال حدث version للأيام التي تغيّر إصدارها دون أن يُنشر حدث يغطيه في هذه العملية"""
+        versions = dict(
+            QueueDayVersion.objects.filter(key__in=[str(day) for day in days]).values_list('key', 'version')
+        )
+        for day in days:
+            version = versions.get(str(day))
+            if version is None:
+                continue
+            with self._lock:
+                known = self._versions.get(day)
+                if known is None:
+                    # أول مشترك في اليوم: الإصدار الحالي أُرسل له مع حدث ready
+                    self._versions[day] = version
+                    continue
+            if version > known:
+                self._fan_out(day, {'event': 'version', 'booking_id': None, 'version': version})
+
+
+queue_broadcaster = QueueBroadcaster()
+
+
+def format_sse(event: str, data: dict) -> str:
+    """تنسيق رسالة Server-Sent Events"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str, ensure_ascii=False)}\n\n"
+
+
+async def stream_queue_events(appointment_date, heartbeat_seconds: int = 20):
+    """
+    مولّد غير متزامن لأحداث الطابور ليوم معين
+
+    يرسل تعليق heartbeat عند عدم وجود أحداث لإبقاء الاتصال مفتوحاً عبر الوكلاء.
+    حدث ready يحمل إصدار اليوم الحالي، وكل حدث بعده يحمل الإصدار بعد التغيير.
+    """
+    from .queue_service import QueueVersion
+
+    subscriber = queue_broadcaster.subscribe(appointment_date)
+    queue = subscriber[1]
+    try:
+        version = await sync_to_async(QueueVersion.get)(appointment_date)
+        yield format_sse('ready', {'date': appointment_date, 'version': version})
+        while True:
+            try:
+                message = await asyncio.wait_for(queue.get(), timeout=heartbeat_seconds)
+            except asyncio.TimeoutError:
+                yield ": heartbeat\n\n"
+                continue
+            yield format_sse(message['event'], message)
+    finally:
+        queue_broadcaster.unsubscribe(subscriber)
+
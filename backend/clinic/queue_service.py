@@ -3,14 +3,547 @@
 Advanced Queue Calculator Service with ML-based wait time prediction
 """
 
+import heapq
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from itertools import groupby
 from datetime import datetime, timedelta
-from django.db.models import Avg, Count, Q, F
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Avg, Case, Count, Q, F, Max, Min, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest, Least
 from django.utils import timezone
-from .models import Appointment, QueueStatistics, QueueHistory, Service
+from .durations import DEFAULT_VISIT_MINUTES, parse_duration
+from .models import Appointment, Chair, QueueDayVersion, QueueStatistics, QueueHistory, Service, WaitTimeModel
+from .queue_events import queue_broadcaster
 import logging
+import threading
+import time as time_module
 
 logger = logging.getLogger(__name__)
 
+# الحالات التي تُحتسب في الطابور (الملغاة لا تُحتسب)
+ACTIVE_STATUSES = ['pending', 'confirmed', 'completed']
+# الحالات التي ما زال صاحبها ينتظر دوره (ما لم تبدأ زيارته)
+WAITING_STATUSES = ['pending', 'confirmed']
+
+
+class QueueTransitionError(Exception):
+    """انتقال غير مسموح في مراحل الزيارة (مثل إنهاء زيارة لم تبدأ)"""
+
+
+class VersionedDayIndex:
+    """
+    لقطات أيام في ذاكرة العملية مربوطة بإصدار اليوم
+    Per-process LRU of per-day snapshots, each tagged with the QueueVersion it was built at.
+
+    قبل استخدام لقطة يُقرأ إصدار اليوم من قاعدة البيانات (استعلام مفهرس واحد)،
+    ويُعاد بناؤها إذا تغيّر، فلا تبقى لقطة قديمة بعد كتابة من عملية أخرى (ويب أو
+    العامل الخلفي). إصدار اليوم يُزاد داخل معاملة الكتابة نفسها، لذا يتغيّر ذرياً
+    مع الصفوف. اللقطة المبنية داخل معاملة لا تُحفظ إلا بعد تأكيدها (on_commit)،
+    حتى لا تبقى لقطة فيها صفوف معاملة تراجعت. اللقطات للقراءة فقط.
+    """
+
+    MAX_DAYS = 60  # الحد الأقصى لعدد الأيام المحفوظة في الذاكرة
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._days = OrderedDict()  # date -> (version, snapshot)
+
+    @staticmethod
+    def _coerce(appointment_date, appointment_time=None):
+        """تحويل القيم النصية إلى date/time"""
+        appointment_date = Appointment._meta.get_field('appointment_date').to_python(appointment_date)
+        if appointment_time is not None:
+            appointment_time = Appointment._meta.get_field('appointment_time').to_python(appointment_time)
+        return appointment_date, appointment_time
+
+    def _build(self, appointment_date):
+        """بناء لقطة اليوم من قاعدة البيانات"""
+        raise NotImplementedError
+
+    def snapshot(self, appointment_date):
+        """لقطة اليوم الحالية (من الذاكرة إذا لم يتغيّر إصدار اليوم)"""
+        appointment_date, _ = self._coerce(appointment_date)
+        # الإصدار قبل الصفوف: أي كتابة بعد قراءته تزيده فتُرفض اللقطة لاحقاً
+        version = QueueVersion.get(appointment_date)
+        with self._lock:
+            entry = self._days.get(appointment_date)
+            if entry is not None and entry[0] == version:
+                self._days.move_to_end(appointment_date)
+                return entry[1]
+        snapshot = self._build(appointment_date)
+        # خارج المعاملة تُنفّذ فوراً
+        transaction.on_commit(lambda: self._store(appointment_date, version, snapshot))
+        return snapshot
+
+    def _store(self, appointment_date, version, snapshot):
+        with self._lock:
+            entry = self._days.get(appointment_date)
+            if entry is not None and entry[0] >= version:
+                return
+            self._days[appointment_date] = (version, snapshot)
+            self._days.move_to_end(appointment_date)
+            while len(self._days) > self.MAX_DAYS:
+                self._days.popitem(last=False)
+
+    def invalidate(self, appointment_date=None):
+        """مسح اللقطات ليوم معين أو بالكامل"""
+        with self._lock:
+            if appointment_date is None:
+                self._days.clear()
+                return
+            appointment_date, _ = self._coerce(appointment_date)
+            self._days.pop(appointment_date, None)
+
+
+class DayQueueIndex(VersionedDayIndex):
+    """
+    فهرس الطابور اليومي في الذاكرة
+    In-process index of each day's active appointments, sorted by appointment_time.
+
+    يحتفظ لكل يوم بقائمة مرتبة من (الوقت، معرف الموعد) بحيث يتم حساب
+    الترتيب (rank) في O(log n) بدلاً من استعلام COUNT(*) عند كل حجز، وبقائمة
+    ثانية للمنتظرين فقط (لم تبدأ زيارتهم) لموقع الحجز في صفحة المتابعة.
+    """
+
+    def _build(self, appointment_date):
+        """بناء فهرس اليوم من قاعدة البيانات (استعلام واحد)"""
+        rows = Appointment.objects.filter(
+            appointment_date=appointment_date,
+            status__in=ACTIVE_STATUSES
+        ).values_list('appointment_time', 'id', 'service_id', 'status', 'queue_history__actual_start_time')
+
+        day = []
+        services = {}
+        waiting = []
+        for appointment_time, appointment_id, service_id, status, actual_start_time in rows:
+            day.append((appointment_time, appointment_id))
+            services.setdefault(service_id, []).append((appointment_time, appointment_id))
+            if status in WAITING_STATUSES and actual_start_time is None:
+                waiting.append((appointment_time, appointment_id))
+        day.sort()
+        for items in services.values():
+            items.sort()
+        waiting.sort()
+        return day, services, waiting
+
+    def _get_list(self, appointment_date, service_id=None) -> list:
+        day, services, _ = self.snapshot(appointment_date)
+        if service_id is None:
+            return day
+        return services.get(service_id, [])
+
+    def count_before(
+        self, appointment_date, appointment_time, service_id=None, inclusive=False, appointment_id=None
+    ) -> int:
+        """
+        عدد المواعيد النشطة قبل وقت معين في نفس اليوم
+
+        Args:
+            appointment_date: تاريخ الموعد
+            appointment_time: وقت الموعد
+            service_id: معرف الخدمة (اختياري)
+            inclusive: احتساب المواعيد في نفس الوقت أيضاً
+            appointment_id: العد قبل هذا الموعد بترتيب (الوقت، المعرف)
+
+        Returns:
+            عدد المواعيد
+        """
+        appointment_date, appointment_time = self._coerce(appointment_date, appointment_time)
+        items = self._get_list(appointment_date, service_id)
+        if appointment_id is not None:
+            return bisect_left(items, (appointment_time, appointment_id))
+        if inclusive:
+            return bisect_right(items, (appointment_time, float('inf')))
+        return bisect_left(items, (appointment_time,))
+
+    def day_size(self, appointment_date) -> int:
+        """عدد مواعيد اليوم النشطة"""
+        return len(self._get_list(appointment_date))
+
+    def day_ids(self, appointment_date) -> list:
+        """معرفات مواعيد اليوم النشطة مرتبة حسب الوقت"""
+        return [appointment_id for _, appointment_id in self._get_list(appointment_date)]
+
+    def waiting_rank(self, appointment_date, appointment_time, appointment_id):
+        """
+        ترتيب موعد بين المنتظرين في يومه بترتيب (الوقت، المعرف)
+
+        Returns:
+            (عدد من قبله، عدد من بعده)، أو None إذا لم يعد ينتظر
+        """
+        appointment_date, appointment_time = self._coerce(appointment_date, appointment_time)
+        waiting = self.snapshot(appointment_date)[2]
+        key = (appointment_time, appointment_id)
+        ahead = bisect_left(waiting, key)
+        if ahead == len(waiting) or waiting[ahead] != key:
+            return None
+        return ahead, len(waiting) - ahead - 1
+
+
+day_queue_index = DayQueueIndex()
+
+
+class QueueVersion:
+    """
+    رقم إصدار الطابور لكل يوم
+    Monotonically increasing per-day queue version, stored in QueueDayVersion rows.
+
+    يُزاد عند أي تغيير في Appointment أو QueueHistory لذلك اليوم، ويُستخدم
+    كـ ETag حتى تُجاب طلبات الاستطلاع التي لم يتغيّر فيها شيء بـ 304.
+    الزيادة UPDATE ... SET version = version + 1 ذري في قاعدة البيانات، فلا
+    تضيع زيادات متزامنة من عمليات الويب أو العامل الخلفي (incr في FileBasedCache
+    قراءة ثم كتابة). القيمة الأولية مبنية على الوقت بالملي ثانية، لذا لا يتكرر
+    إصدار قديم حتى لو حُذف الصف.
+    """
+
+    ALL_DAYS = 'all'
+
+    @staticmethod
+    def _seed() -> int:
+        return int(time_module.time() * 1000)
+
+    @staticmethod
+    def get(appointment_date=ALL_DAYS) -> int:
+        """الحصول على الإصدار الحالي لليوم (أو لكل الأيام)"""
+        key = str(appointment_date)
+        version = QueueDayVersion.objects.filter(key=key).values_list('version', flat=True).first()
+        if version is None:
+            QueueDayVersion.objects.bulk_create(
+                [QueueDayVersion(key=key, version=QueueVersion._seed())], ignore_conflicts=True
+            )
+            version = QueueDayVersion.objects.filter(key=key).values_list('version', flat=True).first()
+        return version
+
+    @staticmethod
+    def bump(*appointment_dates, all_days: bool = True) -> dict:
+        """
+        زيادة إصدار الأيام المعطاة وإصدار كل الأيام (تحديث واحد)
+
+        Args:
+            appointment_dates: الأيام التي تغيّرت
+            all_days: زيادة إصدار كل الأيام أيضاً (False عند الزيادة داخل معاملة
+                الكتابة، حتى لا يبقى صف 'all' مقفلاً حتى التأكيد)
+
+        Returns:
+            الإصدارات الجديدة {المفتاح: الإصدار} (من UPDATE ... RETURNING، بدون قراءة ثانية)
+        """
+        keys = {str(appointment_date) for appointment_date in appointment_dates}
+        if all_days:
+            keys.add(QueueVersion.ALL_DAYS)
+        if not keys:
+            return {}
+        quote = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {quote(QueueDayVersion._meta.db_table)} SET {quote("version")} = {quote("version")} + 1 '
+                f'WHERE {quote("key")} IN ({", ".join(["%s"] * len(keys))}) RETURNING {quote("key")}, {quote("version")}',
+                sorted(keys)
+            )
+            versions = dict(cursor.fetchall())
+        missing = keys - versions.keys()
+        if missing:
+            # أيام بدون صف بعد: تبدأ من القيمة الأولية (صف أُدرج بالتوازي يُتجاهل)
+            seed = QueueVersion._seed()
+            QueueDayVersion.objects.bulk_create(
+                [QueueDayVersion(key=key, version=seed) for key in missing], ignore_conflicts=True
+            )
+            versions.update(dict.fromkeys(missing, seed))
+        return versions
+
+    @staticmethod
+    def bump_all_days() -> None:
+        """زيادة إصدار كل الأيام (تغيير يمس كل الأيام، مثل مدة خدمة)"""
+        QueueDayVersion.objects.update(version=F('version') + 1)
+
+
+class ReadThroughCache:
+    """
+    كاش قراءة لكل عملية (LRU محدود مع مدة صلاحية) مع طبقة مشتركة اختيارية
+    Per-process bounded LRU with TTL, optionally backed by the shared Django cache.
+
+    المفاتيح صفوف يكون عنصرها الأول معرف الخدمة، حتى يمكن إبطال كل
+    مدخلات خدمة معينة عند حفظ Service أو QueueStatistics الخاصة بها.
+    الطبقة المشتركة تُفعّل بـ QUEUE_SHARED_CACHE = True في الإعدادات، وتُبطل
+    عبر رقم جيل لكل خدمة؛ الطبقة المحلية في العمليات الأخرى تنتهي بانتهاء TTL.
+    """
+
+    def __init__(self, name: str, maxsize: int = 1024, ttl: int = 300):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def shared_enabled() -> bool:
+        return getattr(settings, 'QUEUE_SHARED_CACHE', False)
+
+    def _shared_key(self, key) -> str:
+        generation = cache.get_or_set(f"clinic:{self.name}:gen:{key[0]}", 0, None)
+        return f"clinic:{self.name}:{generation}:" + ':'.join(str(part) for part in key)
+
+    def get_or_load(self, key, loader):
+        """إرجاع القيمة من الكاش أو تحميلها عبر loader وتخزينها"""
+        now = time_module.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+        value = None
+        shared_key = self._shared_key(key) if self.shared_enabled() else None
+        if shared_key is not None:
+            value = cache.get(shared_key)
+        if value is not None:
+            with self._lock:
+                self.shared_hits += 1
+        else:
+            value = loader()
+            with self._lock:
+                self.misses += 1
+            if shared_key is not None:
+                cache.set(shared_key, value, self.ttl)
+
+        with self._lock:
+            self._entries[key] = (now + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, service_id=None):
+        """إبطال مدخلات خدمة معينة (أو الكل)"""
+        with self._lock:
+            if service_id is None:
+                self._entries.clear()
+            else:
+                for key in [k for k in self._entries if k[0] == service_id]:
+                    del self._entries[key]
+        if self.shared_enabled():
+            service_ids = [service_id] if service_id is not None else [
+                *Service.objects.values_list('id', flat=True), None
+            ]
+            for sid in service_ids:
+                generation_key = f"clinic:{self.name}:gen:{sid}"
+                if not cache.add(generation_key, 1, None):
+                    try:
+                        cache.incr(generation_key)
+                    except ValueError:
+                        cache.add(generation_key, 1, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                'name': self.name,
+                'size': len(self._entries),
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'hit_rate': round((self.hits + self.shared_hits) / lookups, 3) if lookups else 0.0,
+            }
+
+
+historical_average_cache = ReadThroughCache('historical_average')
+service_duration_cache = ReadThroughCache('service_duration', maxsize=256)
+chair_pool_cache = ReadThroughCache('chair_pool', maxsize=256)
+day_schedule_cache = ReadThroughCache('day_schedule', maxsize=64)
+
+
+class WaitTimePredictor:
+    """
+    متنبئ وقت الانتظار بالانحدار الخطي
+    Linear wait-time model trained offline by the train_wait_model command.
+
+    تُحمّل المعاملات من WaitTimeModel مرة واحدة لكل عملية (ويُعاد المحاولة
+    بعد RETRY_SECONDS إذا فشل التحميل)، والتنبؤ مجرد ضرب نقطي على الخصائص
+    بدون أي استعلام لقاعدة البيانات.
+    """
+
+    RIDGE_LAMBDA = 1.0  # معامل التنظيم لتفادي المصفوفات المنفردة
+    RETRY_SECONDS = 60  # إعادة محاولة التحميل بعد فشله (قاعدة البيانات غير متاحة مثلاً)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._failed_at = None  # وقت آخر فشل في التحميل (monotonic)
+        self._index = None  # feature name -> position
+        self._coefficients = None
+
+    @classmethod
+    def from_coefficients(cls, feature_names, coefficients) -> 'WaitTimePredictor':
+        """إنشاء متنبئ من معاملات جاهزة (بدون قاعدة البيانات)"""
+        predictor = cls()
+        predictor._loaded = True
+        predictor._index = {name: i for i, name in enumerate(feature_names)}
+        predictor._coefficients = list(coefficients)
+        return predictor
+
+    @staticmethod
+    def features(service_id, appointment_hour: int, weekday: int, queue_depth: int, lead_days: int) -> dict:
+        """
+        خصائص الموعد: الخدمة، الساعة، يوم الأسبوع، عمق الطابور، مدة الحجز المسبق
+        (الخصائص الفئوية بترميز one-hot)
+        """
+        return {
+            'bias': 1.0,
+            'queue_depth': float(queue_depth),
+            'lead_days': float(max(0, lead_days)),
+            f'service_{service_id}': 1.0,
+            f'hour_{appointment_hour}': 1.0,
+            f'weekday_{weekday}': 1.0,
+        }
+
+    @staticmethod
+    def queue_depths(service_ids) -> list:
+        """
+        خاصية عمق الطابور لمواعيد يوم واحد مرتبة بـ (الوقت، المعرف)
+
+        عمق كل موعد = عدد مواعيد نفس الخدمة النشطة قبله. التعريف نفسه في
+        التدريب (training_rows) والتقدير (estimate_day و QueueService.queue_depth).
+
+        Args:
+            service_ids: معرفات خدمات المواعيد بالترتيب
+
+        Returns:
+            قائمة الأعماق بنفس الترتيب
+        """
+        seen_per_service = {}
+        depths = []
+        for service_id in service_ids:
+            depth = seen_per_service.get(service_id, 0)
+            seen_per_service[service_id] = depth + 1
+            depths.append(depth)
+        return depths
+
+    def load(self, force: bool = False):
+        """تحميل أحدث نموذج مدرّب (مرة واحدة لكل عملية، أو بعد RETRY_SECONDS من فشل)"""
+        with self._lock:
+            if self._loaded and not force and (
+                self._failed_at is None or time_module.monotonic() - self._failed_at < self.RETRY_SECONDS
+            ):
+                return
+            self._loaded = True
+            self._failed_at = None
+            self._index = None
+            self._coefficients = None
+            try:
+                model = WaitTimeModel.objects.only('feature_names', 'coefficients').first()
+            except Exception as e:
+                logger.warning(f"تعذر تحميل نموذج الانتظار: {str(e)}")
+                self._failed_at = time_module.monotonic()
+                return
+            if model is not None:
+                self._index = {name: i for i, name in enumerate(model.feature_names)}
+                self._coefficients = list(model.coefficients)
+
+    def is_available(self) -> bool:
+        self.load()
+        return self._coefficients is not None
+
+    def predict(self, service_id, appointment_hour: int, weekday: int, queue_depth: int, lead_days: int) -> int:
+        """التنبؤ بوقت الانتظار (ضرب نقطي على الخصائص غير الصفرية)"""
+        features = self.features(service_id, appointment_hour, weekday, queue_depth, lead_days)
+        index, coefficients = self._index, self._coefficients
+        value = sum(
+            coefficients[index[name]] * x for name, x in features.items() if name in index
+        )
+        return max(0, int(round(value)))
+
+    def predict_many(self, rows) -> list:
+        """التنبؤ لمجموعة مواعيد دفعة واحدة (ضرب مصفوفات)"""
+        import numpy as np
+
+        matrix = self.design_matrix([self.features(*row) for row in rows], self._index)
+        predictions = matrix @ np.asarray(self._coefficients)
+        return [max(0, int(round(value))) for value in predictions]
+
+    @staticmethod
+    def design_matrix(samples, index):
+        """تحويل قوائم الخصائص إلى مصفوفة"""
+        import numpy as np
+
+        matrix = np.zeros((len(samples), len(index)))
+        for row, features in enumerate(samples):
+            for name, value in features.items():
+                column = index.get(name)
+                if column is not None:
+                    matrix[row, column] = value
+        return matrix
+
+    @staticmethod
+    def fit(samples, targets, ridge_lambda: float = RIDGE_LAMBDA):
+        """
+        تدريب النموذج بالمربعات الصغرى مع تنظيم ridge
+
+        Args:
+            samples: قائمة قواميس الخصائص
+            targets: أوقات الانتظار الفعلية
+
+        Returns:
+            (feature_names, coefficients)
+        """
+        import numpy as np
+
+        feature_names = sorted({name for features in samples for name in features})
+        index = {name: i for i, name in enumerate(feature_names)}
+        x = WaitTimePredictor.design_matrix(samples, index)
+        y = np.asarray(targets, dtype=float)
+        regularizer = ridge_lambda * np.eye(len(feature_names))
+        regularizer[index['bias'], index['bias']] = 0  # لا تنظيم للثابت
+        coefficients = np.linalg.solve(x.T @ x + regularizer, x.T @ y)
+        return feature_names, coefficients.tolist()
+
+    @staticmethod
+    def training_rows(start_date=None):
+        """
+        بيانات التدريب من سجلات الطابور المكتملة
+
+        Returns:
+            قائمة (service_id, hour, weekday, queue_depth, lead_days, actual_wait_minutes,
+                   appointment_date, appointment_time)
+        """
+        query = QueueHistory.objects.filter(actual_wait_minutes__isnull=False)
+        if start_date:
+            query = query.filter(appointment__appointment_date__gte=start_date)
+        samples = list(query.values_list(
+            'appointment_id', 'appointment__service_id', 'appointment__appointment_date',
+            'appointment__appointment_time', 'appointment__created_at', 'actual_wait_minutes'
+        ))
+
+        # عمق الطابور من مواعيد كل يوم النشطة، كما في estimate_day (استعلام واحد)
+        day_appointments = Appointment.objects.filter(
+            appointment_date__in={sample[2] for sample in samples},
+            status__in=ACTIVE_STATUSES
+        ).order_by('appointment_date', 'appointment_time', 'id').values_list('id', 'appointment_date', 'service_id')
+        queue_depths = {}
+        for appointment_date, day in groupby(day_appointments.iterator(), key=lambda row: row[1]):
+            day = list(day)
+            queue_depths.update(zip(
+                (row[0] for row in day), WaitTimePredictor.queue_depths(row[2] for row in day)
+            ))
+
+        rows = []
+        for appointment_id, service_id, appointment_date, appointment_time, created_at, wait in samples:
+            lead_days = (appointment_date - timezone.localtime(created_at).date()).days
+            rows.append((
+                service_id, appointment_time.hour, appointment_date.weekday(),
+                queue_depths.get(appointment_id, 0), lead_days, wait,
+                appointment_date, appointment_time
+            ))
+        return rows
+
+
+wait_time_predictor = WaitTimePredictor()
+
 
 class QueueService:
     """خدمة متقدمة لحساب أرقام الطابور ووقت الانتظار المتوقع"""
@@ -18,6 +551,7 @@ class QueueService:
     PEAK_HOURS = [(12, 14), (18, 20)]  # ساعات الذروة (الظهيرة والمساء)
     BASE_BUFFER_MINUTES = 5  # وقت انتظار أساسي بين الموعد والآخر (دقائق)
     PEAK_HOUR_MULTIPLIER = 1.5  # مضاعف الانتظار في ساعات الذروة
+    OFF_SCHEDULE_MINUTES = 5  # فرق البدء/المدة الذي يستدعي إعادة تقدير المواعيد اللاحقة
     
     @staticmethod
     def is_peak_hour(appointment_hour: int) -> bool:
@@ -44,29 +578,296 @@ class QueueService:
             if appointment_date is None:
                 appointment_date = timezone.now().date()
             
-            # حساب النطاق الزمني
-            start_date = appointment_date - timedelta(days=lookback_days)
+            def load():
+                # حساب النطاق الزمني
+                start_date = appointment_date - timedelta(days=lookback_days)
+                
+                # البحث عن الإحصائيات التاريخية
+                stats = QueueStatistics.objects.filter(
+                    service_id=service_id,
+                    appointment_date__gte=start_date,
+                    appointment_date__lte=appointment_date,
+                    completed_appointments__gt=0
+                ).aggregate(
+                    avg_wait=Avg('average_wait_minutes'),
+                    count=Count('id')
+                )
+                
+                average_wait = stats.get('avg_wait', 0)
+                if average_wait is None:
+                    average_wait = 0
+                
+                return int(average_wait)
             
-            # البحث عن الإحصائيات التاريخية
-            stats = QueueStatistics.objects.filter(
-                service_id=service_id,
-                appointment_date__gte=start_date,
-                appointment_date__lte=appointment_date,
-                completed_appointments__gt=0
-            ).aggregate(
-                avg_wait=Avg('average_wait_minutes'),
-                count=Count('id')
+            return historical_average_cache.get_or_load(
+                (service_id, str(appointment_date), lookback_days), load
             )
-            
-            average_wait = stats.get('avg_wait', 0)
-            if average_wait is None:
-                average_wait = 0
-            
-            return int(average_wait)
         except Exception as e:
             logger.error(f"خطأ في حساب متوسط الانتظار التاريخي: {str(e)}")
             return 0
     
+    @staticmethod
+    def get_service_duration(service_id: int) -> int:
+        """مدة زيارة الخدمة بالدقائق (عبر الكاش)"""
+        return service_duration_cache.get_or_load(
+            (service_id,),
+            lambda: Service.objects.filter(id=service_id).values_list(
+                'duration_minutes', flat=True
+            ).first() or DEFAULT_VISIT_MINUTES  # قيمة افتراضية
+        )
+
+    @staticmethod
+    def get_chair_pool(service_id: int = None) -> list:
+        """
+        الكراسي النشطة التي تقدّم الخدمة (عبر الكاش)
+
+        الكرسي بدون طبيب يقبل كل الخدمات. قائمة فارغة تعني أن العيادة
+        لم تُعرّف كراسي بعد فتُعامل كطابور واحد.
+
+        Args:
+            service_id: معرف الخدمة (None لكل الكراسي النشطة)
+
+        Returns:
+            معرفات الكراسي مرتبة
+        """
+        def load():
+            chairs = Chair.objects.filter(is_active=True)
+            if service_id is not None:
+                chairs = chairs.filter(
+                    Q(dentist__isnull=True) | Q(dentist__is_active=True, dentist__services=service_id)
+                )
+            return list(chairs.order_by('id').values_list('id', flat=True).distinct())
+
+        return chair_pool_cache.get_or_load((service_id,), load)
+
+    @staticmethod
+    def uses_wait_model(chair_ids) -> bool:
+        """
+        هل يُقدّر الانتظار بالنموذج المدرّب بدل محاكاة الكراسي؟
+
+        النموذج لا يعرف الكراسي (خصائصه الخدمة والساعة والعمق)، لذا إذا وُجدت
+        مجموعة كراسي فالمحاكاة هي التي تُستخدم، إلا إذا فُعّل WAIT_MODEL_WITH_CHAIRS.
+        بدون كراسي يُستخدم النموذج متى كان متاحاً.
+
+        Args:
+            chair_ids: مجموعة الكراسي (get_chair_pool)
+
+        Returns:
+            True لاستخدام النموذج
+        """
+        if chair_ids and not getattr(settings, 'WAIT_MODEL_WITH_CHAIRS', False):
+            return False
+        return wait_time_predictor.is_available()
+
+    @staticmethod
+    def get_day_schedule(appointment_date) -> list:
+        """
+        مواعيد اليوم النشطة كـ (المعرف، البداية بالدقائق، المدة، الكرسي، الخدمة) مرتبة حسب الوقت
+
+        مخزنة حسب إصدار الطابور لليوم، فأي تغيير في مواعيد اليوم يعني مفتاحاً جديداً.
+        """
+        appointment_date = Appointment._meta.get_field('appointment_date').to_python(appointment_date)
+
+        def load():
+            rows = Appointment.objects.filter(
+                appointment_date=appointment_date,
+                status__in=ACTIVE_STATUSES
+            ).order_by('appointment_time', 'id').values_list(
+                'id', 'appointment_time', 'service__duration_minutes', 'chair_id', 'service_id'
+            )
+            return [
+                (appointment_id, t.hour * 60 + t.minute, duration or DEFAULT_VISIT_MINUTES, chair_id, service_id)
+                for appointment_id, t, duration, chair_id, service_id in rows
+            ]
+
+        return day_schedule_cache.get_or_load(
+            ('day', appointment_date, QueueVersion.get(appointment_date)), load
+        )
+
+    @staticmethod
+    def simulate_chairs(schedule, chair_ids) -> dict:
+        """
+        محاكاة طابور متعدد الكراسي لليوم في مرور واحد
+
+        الموعد المخصص لكرسي ينتظر تحرر كرسيه فقط؛ الموعد غير المخصص يأخذ
+        أول كرسي يتحرر من المجموعة (كومة بأوقات التحرر). الكومة تحتفظ بمدخلات
+        قديمة لكل كرسي وتُتجاهل عند السحب إذا لم تطابق وقت تحرره الحالي.
+
+        Args:
+            schedule: [(المفتاح، البداية بالدقائق، المدة، الكرسي، ...)] مرتبة حسب البداية
+            chair_ids: كراسي المجموعة للمواعيد غير المخصصة
+
+        Returns:
+            {المفتاح: الانتظار بالدقائق}
+        """
+        free_at = {chair_id: 0 for chair_id in chair_ids}
+        heap = [(0, chair_id) for chair_id in chair_ids]
+        heapq.heapify(heap)
+        waits = {}
+        for key, start, duration, chair_id, *_ in schedule:
+            if chair_id is None:
+                if not heap:
+                    waits[key] = 0
+                    continue
+                while True:
+                    free, chair_id = heapq.heappop(heap)
+                    if free == free_at[chair_id]:
+                        break
+            begin = max(start, free_at.get(chair_id, 0))
+            waits[key] = begin - start
+            free_at[chair_id] = begin + duration + QueueService.BASE_BUFFER_MINUTES
+            if chair_id in chair_ids:
+                heapq.heappush(heap, (free_at[chair_id], chair_id))
+        return waits
+
+    @staticmethod
+    def simulated_wait(
+        appointment_date,
+        appointment_time,
+        service_id: int,
+        appointment_id: int = None,
+        booked: bool = True
+    ) -> int:
+        """
+        الانتظار الأساسي لموعد من محاكاة الكراسي (قبل تعديل الذروة والبيانات التاريخية)
+
+        Args:
+            appointment_date: تاريخ الموعد
+            appointment_time: وقت الموعد
+            service_id: معرف الخدمة
+            appointment_id: معرف الموعد إن كان محجوزاً
+            booked: الموعد موجود في جدول اليوم (يُبحث عنه بالوقت والخدمة إن لم يُعط المعرف)
+
+        Returns:
+            الانتظار بالدقائق
+        """
+        schedule = QueueService.get_day_schedule(appointment_date)
+        chair_ids = QueueService.get_chair_pool()
+        start = appointment_time.hour * 60 + appointment_time.minute
+
+        if appointment_id is None and booked:
+            appointment_id = next(
+                (row[0] for row in schedule if row[1] == start and row[4] == service_id), None
+            )
+        if appointment_id is None:
+            # موعد افتراضي بعد كل المواعيد التي تبدأ في نفس الوقت أو قبله
+            position = bisect_right([row[1] for row in schedule], start)
+            extra = (None, start, QueueService.get_service_duration(service_id), None)
+            schedule = schedule[:position] + [extra] + schedule[position:]
+        return QueueService.simulate_chairs(schedule, chair_ids).get(appointment_id, 0)
+
+    @staticmethod
+    def estimate_open_slots(appointment_date, slots, service_id: int = None) -> list:
+        """
+        estimate_wait_time(booked=False) لكل الفترات الحرة في يوم، من لقطة واحدة لليوم
+
+        لقطة فهرس الطابور وجدول اليوم ومدة الخدمة والمتوسط التاريخي تُقرأ مرة
+        واحدة، ثم يُحسب كل تقدير في الذاكرة (بدون استعلامات لكل فترة).
+
+        Args:
+            appointment_date: التاريخ
+            slots: أوقات الفترات الحرة
+            service_id: معرف الخدمة (اختياري)
+
+        Returns:
+            وقت الانتظار المتوقع لكل فترة بنفس الترتيب
+        """
+        if not slots:
+            return []
+        appointment_date = Appointment._meta.get_field('appointment_date').to_python(appointment_date)
+        try:
+            day, services, _ = day_queue_index.snapshot(appointment_date)
+            items = services.get(service_id, []) if service_id else day
+            # عمق الطابور لفترة حرة: كل المواعيد حتى وقتها (تأتي بعد مواعيد نفس الوقت)
+            depths = [bisect_right(items, (slot, float('inf'))) for slot in slots]
+
+            chair_ids = QueueService.get_chair_pool()
+            if QueueService.uses_wait_model(chair_ids):
+                lead_days = (appointment_date - timezone.localdate()).days
+                return [
+                    wait_time_predictor.predict(service_id, slot.hour, appointment_date.weekday(), depth, lead_days)
+                    for slot, depth in zip(slots, depths)
+                ]
+
+            service_duration = QueueService.get_service_duration(service_id)
+            historical_average = QueueService.get_historical_average_wait(service_id, appointment_date)
+            if not chair_ids:
+                return [
+                    QueueService.combine_wait_estimate(depth, service_duration, slot.hour, historical_average)
+                    for slot, depth in zip(slots, depths)
+                ]
+
+            schedule = QueueService.get_day_schedule(appointment_date)
+            starts = [row[1] for row in schedule]
+            estimates = []
+            for slot in slots:
+                # موعد افتراضي بعد كل المواعيد التي تبدأ في نفس الوقت أو قبله (كما في simulated_wait)
+                start = slot.hour * 60 + slot.minute
+                position = bisect_right(starts, start)
+                extended = schedule[:position] + [(None, start, service_duration, None)] + schedule[position:]
+                estimates.append(QueueService.adjust_wait_estimate(
+                    QueueService.simulate_chairs(extended, chair_ids).get(None, 0), slot.hour, historical_average
+                ))
+            return estimates
+        except Exception as e:
+            logger.error(f"خطأ في تقدير انتظار الفترات الحرة: {str(e)}")
+            return [0] * len(slots)
+
+    @staticmethod
+    def cache_stats() -> list:
+        """عدادات الإصابة/الإخفاق لكاش الطابور في هذه العملية"""
+        return [
+            historical_average_cache.stats(),
+            service_duration_cache.stats(),
+            chair_pool_cache.stats(),
+            day_schedule_cache.stats(),
+        ]
+
+    @staticmethod
+    def count_appointments_before(
+        appointment_date,
+        appointment_time,
+        service_id: int = None,
+        inclusive: bool = False,
+        appointment_id: int = None
+    ) -> int:
+        """
+        عدد المواعيد النشطة قبل وقت معين، من الفهرس اليومي مع الرجوع لقاعدة البيانات
+
+        Args:
+            appointment_date: تاريخ الموعد
+            appointment_time: وقت الموعد
+            service_id: معرف الخدمة (اختياري)
+            inclusive: احتساب المواعيد في نفس الوقت أيضاً
+            appointment_id: العد قبل هذا الموعد بترتيب (الوقت، المعرف)
+
+        Returns:
+            عدد المواعيد
+        """
+        try:
+            return day_queue_index.count_before(
+                appointment_date, appointment_time, service_id, inclusive, appointment_id
+            )
+        except Exception as e:
+            logger.warning(f"فهرس الطابور غير متاح، الرجوع لقاعدة البيانات: {str(e)}")
+
+        if appointment_id is not None:
+            time_filter = Q(appointment_time__lt=appointment_time) | Q(
+                appointment_time=appointment_time, id__lt=appointment_id
+            )
+        elif inclusive:
+            time_filter = Q(appointment_time__lte=appointment_time)
+        else:
+            time_filter = Q(appointment_time__lt=appointment_time)
+        query = Appointment.objects.filter(
+            time_filter,
+            appointment_date=appointment_date,
+            status__in=ACTIVE_STATUSES
+        )
+        if service_id:
+            query = query.filter(service_id=service_id)
+        return query.count()
+
     @staticmethod
     def get_queue_count_for_time_slot(
         appointment_date,
@@ -85,25 +886,52 @@ class QueueService:
             عدد المواعيد قبل هذا الموعد في نفس الفترة
         """
         try:
-            query = Appointment.objects.filter(
-                appointment_date=appointment_date,
-                appointment_time__lte=appointment_time,
-                status__in=['pending', 'confirmed', 'completed']
+            return QueueService.count_appointments_before(
+                appointment_date,
+                appointment_time,
+                service_id or None,
+                inclusive=True
             )
-            
-            if service_id:
-                query = query.filter(service_id=service_id)
-            
-            return query.count()
         except Exception as e:
             logger.error(f"خطأ في حساب عدد المواعيد: {str(e)}")
             return 1
+
+    @staticmethod
+    def queue_depth(
+        appointment_date,
+        appointment_time,
+        service_id: int,
+        appointment_id: int = None,
+        booked: bool = True
+    ) -> int:
+        """
+        عمق الطابور لموعد واحد - نفس تعريف WaitTimePredictor.queue_depths
+
+        Args:
+            appointment_date: تاريخ الموعد
+            appointment_time: وقت الموعد
+            service_id: معرف الخدمة
+            appointment_id: معرف الموعد المحجوز (يحدد موضعه بين مواعيد نفس الوقت)
+            booked: الموعد محجوز فعلاً (False لفترة حرة: يأتي بعد كل مواعيد نفس الوقت)
+
+        Returns:
+            عدد مواعيد نفس الخدمة قبل الموعد بترتيب (الوقت، المعرف)
+        """
+        if appointment_id is not None:
+            return QueueService.count_appointments_before(
+                appointment_date, appointment_time, service_id or None, appointment_id=appointment_id
+            )
+        queue_count = QueueService.get_queue_count_for_time_slot(appointment_date, appointment_time, service_id)
+        return max(0, queue_count - (1 if booked else 0))  # طرح هذا الموعد
     
     @staticmethod
     def estimate_wait_time(
         appointment_date,
         appointment_time,
-        service_id: int
+        service_id: int,
+        use_model: bool = True,
+        booked: bool = True,
+        appointment_id: int = None
     ) -> int:
         """
         حساب وقت الانتظار المتوقع بناءً على:
@@ -116,46 +944,52 @@ class QueueService:
             appointment_date: تاريخ الموعد
             appointment_time: وقت الموعد
             service_id: معرف الخدمة
+            use_model: استخدام النموذج المدرّب إن وُجد
+            booked: الموعد محجوز فعلاً (False لتقدير فترة حرة قبل الحجز)
+            appointment_id: معرف الموعد المحجوز (لمحاكاة الكراسي)
         
         Returns:
             وقت الانتظار المتوقع بالدقائق
         """
         try:
-            # 1. حساب عدد المواعيد قبل هذا الموعد
-            queue_count = QueueService.get_queue_count_for_time_slot(
-                appointment_date,
-                appointment_time,
-                service_id
-            ) - 1  # طرح هذا الموعد
-            queue_count = max(0, queue_count)  # التأكد من أنه لا يكون سالب
+            # 1. حساب عدد المواعيد قبل هذا الموعد (خاصية عمق الطابور نفسها في التدريب)
+            queue_count = QueueService.queue_depth(
+                appointment_date, appointment_time, service_id, appointment_id, booked
+            )
+            
+            # النموذج المدرّب (انظر uses_wait_model): ضرب نقطي بدون استعلامات إضافية
+            chair_ids = QueueService.get_chair_pool()
+            if use_model and QueueService.uses_wait_model(chair_ids):
+                appointment_date = Appointment._meta.get_field('appointment_date').to_python(appointment_date)
+                return wait_time_predictor.predict(
+                    service_id,
+                    appointment_time.hour,
+                    appointment_date.weekday(),
+                    queue_count,
+                    (appointment_date - timezone.localdate()).days
+                )
             
             # 2. الحصول على معلومات الخدمة
-            try:
-                service = Service.objects.get(id=service_id)
-                # محاولة استخلاص الدقائق من مدة الخدمة
-                service_duration = QueueService.extract_duration_minutes(service.duration)
-            except Service.DoesNotExist:
-                service_duration = 30  # قيمة افتراضية
+            service_duration = QueueService.get_service_duration(service_id)
             
             # 3. الحصول على متوسط الانتظار التاريخي
             historical_average = QueueService.get_historical_average_wait(service_id, appointment_date)
             
-            # 4. حساب وقت الانتظار الأساسي
-            base_wait = queue_count * (service_duration + QueueService.BASE_BUFFER_MINUTES)
-            
-            # 5. التحقق من ساعات الذروة
-            appointment_hour = appointment_time.hour
-            if QueueService.is_peak_hour(appointment_hour):
-                base_wait = int(base_wait * QueueService.PEAK_HOUR_MULTIPLIER)
-            
-            # 6. الجمع بين الحسابات (75% من الحساب + 25% من البيانات التاريخية)
-            if historical_average > 0:
-                estimated_wait = int(base_wait * 0.75 + historical_average * 0.25)
+            # 4-6. حساب وقت الانتظار (الطابور + الذروة + البيانات التاريخية)
+            if chair_ids:
+                # عدة كراسي تعمل بالتوازي: الانتظار الأساسي من محاكاة اليوم
+                estimated_wait = QueueService.adjust_wait_estimate(
+                    QueueService.simulated_wait(appointment_date, appointment_time, service_id, appointment_id, booked),
+                    appointment_time.hour,
+                    historical_average
+                )
             else:
-                estimated_wait = base_wait
-            
-            # التأكد من أن الحد الأدنى هو 0
-            estimated_wait = max(0, estimated_wait)
+                estimated_wait = QueueService.combine_wait_estimate(
+                    queue_count,
+                    service_duration,
+                    appointment_time.hour,
+                    historical_average
+                )
             
             logger.info(
                 f"Estimated wait for service {service_id} on {appointment_date} at {appointment_time}: "
@@ -168,16 +1002,198 @@ class QueueService:
             logger.error(f"خطأ في حساب وقت الانتظار المتوقع: {str(e)}")
             return 0
     
+    @staticmethod
+    def combine_wait_estimate(queue_count: int, service_duration: int, appointment_hour: int, historical_average: int) -> int:
+        """
+        دمج عناصر التقدير في وقت انتظار واحد
+
+        Args:
+            queue_count: عدد المواعيد قبل هذا الموعد
+            service_duration: مدة الخدمة بالدقائق
+            appointment_hour: ساعة الموعد
+            historical_average: متوسط الانتظار التاريخي
+
+        Returns:
+            وقت الانتظار المتوقع بالدقائق
+        """
+        # حساب وقت الانتظار الأساسي
+        base_wait = queue_count * (service_duration + QueueService.BASE_BUFFER_MINUTES)
+        return QueueService.adjust_wait_estimate(base_wait, appointment_hour, historical_average)
+
+    @staticmethod
+    def adjust_wait_estimate(base_wait: int, appointment_hour: int, historical_average: int) -> int:
+        """
+        تطبيق مضاعف الذروة ودمج البيانات التاريخية على الانتظار الأساسي
+
+        Args:
+            base_wait: الانتظار الأساسي (من عدد المواعيد أو من محاكاة الكراسي)
+            appointment_hour: ساعة الموعد
+            historical_average: متوسط الانتظار التاريخي
+
+        Returns:
+            وقت الانتظار المتوقع بالدقائق
+        """
+        # التحقق من ساعات الذروة
+        if QueueService.is_peak_hour(appointment_hour):
+            base_wait = int(base_wait * QueueService.PEAK_HOUR_MULTIPLIER)
+
+        # الجمع بين الحسابات (75% من الحساب + 25% من البيانات التاريخية)
+        if historical_average > 0:
+            estimated_wait = int(base_wait * 0.75 + historical_average * 0.25)
+        else:
+            estimated_wait = base_wait
+
+        # التأكد من أن الحد الأدنى هو 0
+        return max(0, estimated_wait)
+
+    @staticmethod
+    def adjust_wait_estimates(base_waits, appointment_hours, historical_averages) -> list:
+        """
+        adjust_wait_estimate لمواعيد يوم كامل دفعة واحدة (عمليات numpy على المصفوفات)
+
+        Args:
+            base_waits: الانتظار الأساسي لكل موعد
+            appointment_hours: ساعة كل موعد
+            historical_averages: متوسط الانتظار التاريخي لخدمة كل موعد
+
+        Returns:
+            قائمة أوقات الانتظار المتوقعة بنفس الترتيب
+        """
+        import numpy as np
+
+        base = np.asarray(base_waits, dtype=float)
+        hours = np.asarray(appointment_hours)
+        historical = np.asarray(historical_averages, dtype=float)
+
+        peak = np.zeros(len(hours), dtype=bool)
+        for start, end in QueueService.PEAK_HOURS:
+            peak |= (hours >= start) & (hours < end)
+        base = np.where(peak, np.trunc(base * QueueService.PEAK_HOUR_MULTIPLIER), base)
+        # نفس التقريب (int) والدمج (75% / 25%) في adjust_wait_estimate
+        blended = np.where(historical > 0, np.trunc(base * 0.75 + historical * 0.25), base)
+        return np.maximum(blended, 0).astype(int).tolist()
+
+    @staticmethod
+    def estimate_day(appointment_date, lookback_days: int = 30, save: bool = True) -> dict:
+        """
+        تقدير أوقات الانتظار لكل مواعيد اليوم دفعة واحدة
+
+        عدد ثابت من الاستعلامات (المواعيد، مدد الخدمات، المتوسطات التاريخية)
+        ثم حساب التقديرات على مصفوفات اليوم (numpy) دفعة واحدة، والحفظ عبر
+        bulk_update. محاكاة الكراسي وحدها تمر على المواعيد بالترتيب لأن كل
+        موعد يعتمد على وقت تحرر الكرسي بعد ما قبله.
+
+        Args:
+            appointment_date: تاريخ اليوم
+            lookback_days: عدد الأيام السابقة للبيانات التاريخية
+            save: حفظ التقديرات في QueueHistory.estimated_wait_minutes
+
+        Returns:
+            قاموس {appointment_id: estimated_wait_minutes}
+        """
+        appointments = list(
+            Appointment.objects.filter(
+                appointment_date=appointment_date,
+                status__in=ACTIVE_STATUSES
+            ).order_by('appointment_time', 'id').values_list(
+                'id', 'appointment_time', 'service_id', 'queue_history__id', 'created_at', 'chair_id'
+            )
+        )
+        if not appointments:
+            return {}
+
+        chair_ids = QueueService.get_chair_pool()
+        if QueueService.uses_wait_model(chair_ids):
+            return QueueService._predict_day(appointment_date, appointments, save)
+
+        service_ids = {row[2] for row in appointments if row[2]}
+        durations = dict(Service.objects.filter(id__in=service_ids).values_list('id', 'duration_minutes'))
+
+        start_date = appointment_date - timedelta(days=lookback_days)
+        historical = {
+            row['service_id']: int(row['avg_wait'] or 0)
+            for row in QueueStatistics.objects.filter(
+                service_id__in=service_ids,
+                appointment_date__gte=start_date,
+                appointment_date__lte=appointment_date,
+                completed_appointments__gt=0
+            ).values('service_id').annotate(avg_wait=Avg('average_wait_minutes'))
+        }
+
+        # عدة كراسي: محاكاة اليوم كله في مرور واحد
+        simulated = QueueService.simulate_chairs([
+            (
+                appointment_id,
+                appointment_time.hour * 60 + appointment_time.minute,
+                durations.get(service_id) or DEFAULT_VISIT_MINUTES,
+                chair_id,
+            )
+            for appointment_id, appointment_time, service_id, _, _, chair_id in appointments
+        ], chair_ids) if chair_ids else None
+
+        # الانتظار الأساسي لكل المواعيد (محاكاة الكراسي، أو عمق الطابور × مدة الزيارة)
+        # ثم الذروة والبيانات التاريخية على مصفوفات اليوم دفعة واحدة
+        if simulated is not None:
+            base_waits = [simulated[row[0]] for row in appointments]
+        else:
+            import numpy as np
+
+            queue_depths = np.asarray(WaitTimePredictor.queue_depths(row[2] for row in appointments))
+            visit_minutes = np.asarray([durations.get(row[2]) or DEFAULT_VISIT_MINUTES for row in appointments])
+            base_waits = queue_depths * (visit_minutes + QueueService.BASE_BUFFER_MINUTES)
+        waits = QueueService.adjust_wait_estimates(
+            base_waits,
+            [row[1].hour for row in appointments],
+            [historical.get(row[2], 0) for row in appointments]
+        )
+
+        estimates = {row[0]: wait for row, wait in zip(appointments, waits)}
+        queue_rows = [
+            QueueHistory(id=row[3], estimated_wait_minutes=wait)
+            for row, wait in zip(appointments, waits) if row[3]
+        ]
+
+        if save:
+            QueueService._save_estimates(appointment_date, queue_rows)
+
+        logger.info(f"تم تقدير الانتظار لـ {len(estimates)} موعد بتاريخ {appointment_date}")
+        return estimates
+
+    @staticmethod
+    def _predict_day(appointment_date, appointments, save: bool) -> dict:
+        """تقدير اليوم بالنموذج المدرّب (ضرب مصفوفات واحد)"""
+        queue_depths = WaitTimePredictor.queue_depths(row[2] for row in appointments)
+        rows = []
+        for (_, appointment_time, service_id, _, created_at, _), queue_depth in zip(appointments, queue_depths):
+            lead_days = (appointment_date - timezone.localtime(created_at).date()).days
+            rows.append((service_id, appointment_time.hour, appointment_date.weekday(), queue_depth, lead_days))
+
+        predictions = wait_time_predictor.predict_many(rows)
+        estimates = {row[0]: wait for row, wait in zip(appointments, predictions)}
+        if save:
+            QueueService._save_estimates(appointment_date, [
+                QueueHistory(id=row[3], estimated_wait_minutes=wait)
+                for row, wait in zip(appointments, predictions) if row[3]
+            ])
+        return estimates
+
+    @staticmethod
+    def _save_estimates(appointment_date, queue_rows):
+        if queue_rows:
+            QueueHistory.objects.bulk_update(queue_rows, ['estimated_wait_minutes'], batch_size=500)
+            QueueVersion.bump(appointment_date)
+
     @staticmethod
     def extract_duration_minutes(duration_str: str) -> int:
         """
-        استخلاص الدقائق من نص مدة الخدمة
+        استخلاص مدة الزيارة بالدقائق من نص مدة الخدمة
+        (مسار الطابور يقرأ Service.duration_minutes مباشرة؛ هذه للنصوص الحرة فقط)
         
         Examples:
             "30 minutes" -> 30
-            "1 hour" -> 60
-            "1.5 hours" -> 90
-            "2 ساعات" -> 120
+            "1-2 ساعة" -> 90
+            "ساعة ونصف" -> 90
+            "12-24 شهر" -> 30 (علاج طويل: مدة زيارة افتراضية)
         
         Args:
             duration_str: نص مدة الخدمة
@@ -185,30 +1201,7 @@ class QueueService:
         Returns:
             عدد الدقائق
         """
-        try:
-            # تنسيق النص
-            duration_str = str(duration_str).lower().strip()
-            
-            # البحث عن الأرقام
-            import re
-            numbers = re.findall(r'[\d.]+', duration_str)
-            if not numbers:
-                return 30  # قيمة افتراضية
-            
-            duration_value = float(numbers[0])
-            
-            # التحقق من الوحدة
-            if 'hour' in duration_str or 'ساع' in duration_str:
-                return int(duration_value * 60)
-            elif 'min' in duration_str or 'دقيق' in duration_str:
-                return int(duration_value)
-            else:
-                # بافتراض أنها دقائق إذا لم تُحدد الوحدة
-                return int(duration_value)
-        
-        except Exception as e:
-            logger.error(f"خطأ في استخلاص المدة: {str(e)}")
-            return 30  # قيمة افتراضية
+        return parse_duration(duration_str).visit_minutes
     
     @staticmethod
     def create_queue_history(appointment) -> 'QueueHistory':
@@ -225,7 +1218,8 @@ class QueueService:
             estimated_wait = QueueService.estimate_wait_time(
                 appointment.appointment_date,
                 appointment.appointment_time,
-                appointment.service_id
+                appointment.service_id,
+                appointment_id=appointment.id
             )
             
             from datetime import datetime as dt, time
@@ -320,6 +1314,13 @@ class QueueService:
                         'average_service_duration_minutes': avg_duration,
                         'min_wait_minutes': min(stats['wait_times']) if stats['wait_times'] else 0,
                         'max_wait_minutes': max(stats['wait_times']) if stats['wait_times'] else 0,
+                        'min_service_duration_minutes': min(stats['service_durations']) if stats['service_durations'] else 0,
+                        'max_service_duration_minutes': max(stats['service_durations']) if stats['service_durations'] else 0,
+                        'wait_sum_minutes': sum(stats['wait_times']),
+                        'wait_sum_squares': sum(w * w for w in stats['wait_times']),
+                        'duration_samples': len(stats['service_durations']),
+                        'duration_sum_minutes': sum(stats['service_durations']),
+                        'duration_sum_squares': sum(d * d for d in stats['service_durations']),
                     }
                 )
             
@@ -328,6 +1329,511 @@ class QueueService:
         except Exception as e:
             logger.error(f"خطأ في تحديث إحصائيات الطابور: {str(e)}")
     
+    @staticmethod
+    def record_completion(appointment_date, service_id: int, wait_minutes: int = None, duration_minutes: int = None):
+        """
+        تحديث إحصائيات الطابور تدريجياً عند انتهاء موعد
+        O(1) لكل موعد: تحديث واحد بتعابير F() بدلاً من إعادة فحص اليوم كاملاً
+
+        Args:
+            appointment_date: تاريخ الموعد
+            service_id: معرف الخدمة
+            wait_minutes: الانتظار الفعلي (اختياري)
+            duration_minutes: مدة الخدمة الفعلية (اختياري)
+        """
+        if not service_id:
+            return
+
+        try:
+            QueueStatistics.objects.get_or_create(service_id=service_id, appointment_date=appointment_date)
+        except IntegrityError:
+            # تم إنشاؤه من طلب متزامن
+            pass
+
+        updates = {'total_appointments': F('total_appointments') + 1}
+
+        if wait_minutes is not None:
+            updates.update(
+                completed_appointments=F('completed_appointments') + 1,
+                wait_sum_minutes=F('wait_sum_minutes') + wait_minutes,
+                wait_sum_squares=F('wait_sum_squares') + wait_minutes * wait_minutes,
+                average_wait_minutes=(F('wait_sum_minutes') + wait_minutes) / (F('completed_appointments') + 1),
+                min_wait_minutes=Case(
+                    When(completed_appointments=0, then=Value(wait_minutes)),
+                    default=Least(F('min_wait_minutes'), Value(wait_minutes))
+                ),
+                max_wait_minutes=Greatest(F('max_wait_minutes'), Value(wait_minutes)),
+            )
+
+        if duration_minutes is not None:
+            updates.update(
+                duration_samples=F('duration_samples') + 1,
+                duration_sum_minutes=F('duration_sum_minutes') + duration_minutes,
+                duration_sum_squares=F('duration_sum_squares') + duration_minutes * duration_minutes,
+                average_service_duration_minutes=(
+                    (F('duration_sum_minutes') + duration_minutes) / (F('duration_samples') + 1)
+                ),
+                min_service_duration_minutes=Case(
+                    When(duration_samples=0, then=Value(duration_minutes)),
+                    default=Least(F('min_service_duration_minutes'), Value(duration_minutes))
+                ),
+                max_service_duration_minutes=Greatest(F('max_service_duration_minutes'), Value(duration_minutes)),
+            )
+
+        QueueStatistics.objects.filter(
+            service_id=service_id,
+            appointment_date=appointment_date
+        ).update(**updates)
+        transaction.on_commit(lambda: historical_average_cache.invalidate(service_id))
+
+    @staticmethod
+    def _visit_row(appointment_id: int):
+        """قراءة حالة الموعد وسجل طابوره (استعلام واحد)، مع إنشاء السجل إن لم يوجد"""
+        fields = [
+            'booking_id', 'status', 'appointment_date', 'service_id',
+            'queue_history__id', 'queue_history__scheduled_start_time', 'queue_history__check_in_time',
+            'queue_history__actual_start_time', 'queue_history__actual_end_time',
+        ]
+        row = Appointment.objects.filter(id=appointment_id).values(*fields).first()
+        if row is None:
+            raise Appointment.DoesNotExist(f"الموعد {appointment_id} غير موجود")
+        if row['queue_history__id'] is None:
+            QueueService.create_queue_history(Appointment.objects.get(id=appointment_id))
+            row = Appointment.objects.filter(id=appointment_id).values(*fields).first()
+        if row['status'] == 'cancelled':
+            raise QueueTransitionError("الموعد ملغى")
+        return row
+
+    @staticmethod
+    def _publish_visit_event(row, event: str, payload: dict):
+        """زيادة إصدار اليوم ونشر الحدث بعد تأكيد المعاملة"""
+        appointment_date = row['appointment_date']
+        booking_id = row['booking_id']
+
+        def on_commit():
+            version = QueueVersion.bump(appointment_date)[str(appointment_date)]
+            queue_broadcaster.publish(appointment_date, booking_id, event, payload, version)
+
+        transaction.on_commit(on_commit)
+
+    @staticmethod
+    def reestimate_downstream(appointment_id: int, chair_free_at) -> int:
+        """
+        إعادة تقدير الانتظار للمواعيد اللاحقة على نفس الكرسي بعد بدء/انتهاء زيارة خارج الموعد
+
+        يمر على مواعيد اليوم التي لم تبدأ بعد على نفس الكرسي بالترتيب (الوقت، المعرف)
+        ويُسقط التأخير: البداية المتوقعة = max(الموعد المجدول، وقت تحرر الكرسي).
+        يتوقف بعد أول موعد يمتص التأخير (بدايته المتوقعة هي موعده): انتظاره يُصحح
+        إلى 0 (قد يكون مرفوعاً من تأخير سابق إذا انتهت الزيارة مبكراً)، ولا تُلمس
+        المواعيد التي بعده. لا تُكتب إلا الصفوف التي تغيّر تقديرها (bulk_update واحد).
+        التكلفة محصورة في مواعيد يوم واحد وكرسي واحد مهما كبر السجل.
+
+        Args:
+            appointment_id: الموعد الذي بدأ أو انتهى
+            chair_free_at: الوقت المتوقع لتحرر الكرسي (datetime)
+
+        Returns:
+            عدد السجلات المحدّثة
+        """
+        appointment = Appointment.objects.filter(id=appointment_id).values(
+            'appointment_date', 'appointment_time', 'chair_id'
+        ).first()
+        if appointment is None:
+            return 0
+
+        later = QueueHistory.objects.filter(
+            Q(appointment__appointment_time__gt=appointment['appointment_time']) |
+            Q(appointment__appointment_time=appointment['appointment_time'], appointment__id__gt=appointment_id),
+            appointment__appointment_date=appointment['appointment_date'],
+            appointment__chair_id=appointment['chair_id'],
+            appointment__status__in=['pending', 'confirmed'],
+            actual_start_time__isnull=True,
+        ).order_by('appointment__appointment_time', 'appointment__id').values_list(
+            'id', 'scheduled_start_time', 'estimated_wait_minutes',
+            'appointment__service__duration_minutes', 'appointment__booking_id'
+        )
+
+        buffer = timedelta(minutes=QueueService.BASE_BUFFER_MINUTES)
+        free_at = chair_free_at
+        changed = []
+        events = []
+        for queue_history_id, scheduled, estimated_wait, duration, booking_id in later.iterator():
+            wait = max(0, int((free_at - scheduled).total_seconds() // 60))
+            if wait != estimated_wait:
+                changed.append(QueueHistory(id=queue_history_id, estimated_wait_minutes=wait))
+                events.append((booking_id, wait))
+            if free_at <= scheduled:
+                break  # التأخير امتُص: المواعيد التالية لا تتأثر
+            free_at += timedelta(minutes=duration or DEFAULT_VISIT_MINUTES) + buffer
+
+        if not changed:
+            return 0
+        QueueHistory.objects.bulk_update(changed, ['estimated_wait_minutes'], batch_size=500)
+
+        appointment_date = appointment['appointment_date']
+
+        def on_commit():
+            version = QueueVersion.bump(appointment_date)[str(appointment_date)]
+            for booking_id, wait in events:
+                queue_broadcaster.publish(
+                    appointment_date, booking_id, 'position', {'estimated_wait_minutes': wait}, version
+                )
+
+        transaction.on_commit(on_commit)
+        logger.info(f"إعادة تقدير {len(changed)} موعد بعد الموعد {appointment_id}")
+        return len(changed)
+
+    @staticmethod
+    def check_in(appointment_id: int) -> dict:
+        """
+        تسجيل حضور المريض: تأكيد الموعد وختم وقت الحضور
+
+        Args:
+            appointment_id: معرف الموعد
+
+        Returns:
+            الحقول المحدّثة
+        """
+        with transaction.atomic():
+            row = QueueService._visit_row(appointment_id)
+            if row['queue_history__actual_start_time']:
+                raise QueueTransitionError("الزيارة بدأت بالفعل")
+            now = timezone.now()
+            Appointment.objects.filter(id=appointment_id, status='pending').update(status='confirmed', updated_at=now)
+            QueueHistory.objects.filter(id=row['queue_history__id'], check_in_time__isnull=True).update(
+                check_in_time=now, updated_at=now
+            )
+            result = {
+                'status': 'confirmed',
+                'check_in_time': row['queue_history__check_in_time'] or now,
+            }
+            QueueService._publish_visit_event(row, 'checked_in', {'status': 'confirmed'})
+        return result
+
+    @staticmethod
+    def start_visit(appointment_id: int) -> dict:
+        """
+        بدء الزيارة: ختم وقت البدء الفعلي وحساب الانتظار الفعلي
+
+        Args:
+            appointment_id: معرف الموعد
+
+        Returns:
+            الحقول المحدّثة
+        """
+        with transaction.atomic():
+            row = QueueService._visit_row(appointment_id)
+            if row['queue_history__actual_start_time']:
+                raise QueueTransitionError("الزيارة بدأت بالفعل")
+            now = timezone.now()
+            wait_minutes = max(0, int((now - row['queue_history__scheduled_start_time']).total_seconds() / 60))
+            Appointment.objects.filter(id=appointment_id, status='pending').update(status='confirmed', updated_at=now)
+            QueueHistory.objects.filter(id=row['queue_history__id']).update(
+                check_in_time=Coalesce('check_in_time', Value(now)),
+                actual_start_time=now,
+                actual_wait_minutes=wait_minutes,
+                updated_at=now
+            )
+            result = {'actual_start_time': now, 'actual_wait_minutes': wait_minutes}
+            QueueService._publish_visit_event(row, 'started', {'actual_wait_minutes': wait_minutes})
+            if wait_minutes > QueueService.OFF_SCHEDULE_MINUTES:
+                # بدء متأخر: الكرسي يتحرر بعد المدة المتوقعة من الآن
+                expected = QueueService.get_service_duration(row['service_id']) if row['service_id'] else DEFAULT_VISIT_MINUTES
+                result['reestimated'] = QueueService.reestimate_downstream(
+                    appointment_id,
+                    now + timedelta(minutes=expected + QueueService.BASE_BUFFER_MINUTES)
+                )
+        return result
+
+    @staticmethod
+    def finish_visit(appointment_id: int) -> dict:
+        """
+        إنهاء الزيارة: ختم وقت الانتهاء، إكمال الموعد وتحديث الإحصائيات
+
+        Args:
+            appointment_id: معرف الموعد
+
+        Returns:
+            الحقول المحدّثة
+        """
+        with transaction.atomic():
+            row = QueueService._visit_row(appointment_id)
+            started = row['queue_history__actual_start_time']
+            if not started:
+                raise QueueTransitionError("الزيارة لم تبدأ بعد")
+            if row['queue_history__actual_end_time']:
+                raise QueueTransitionError("الزيارة انتهت بالفعل")
+            now = timezone.now()
+            duration_minutes = max(0, int((now - started).total_seconds() / 60))
+            wait_minutes = max(0, int((started - row['queue_history__scheduled_start_time']).total_seconds() / 60))
+            Appointment.objects.filter(id=appointment_id).update(status='completed', updated_at=now)
+            QueueHistory.objects.filter(id=row['queue_history__id']).update(
+                actual_end_time=now,
+                service_duration_minutes=duration_minutes,
+                updated_at=now
+            )
+            # update() لا يرسل إشارات الحفظ، لذا تُحدّث الإحصائيات هنا
+            QueueService.record_completion(row['appointment_date'], row['service_id'], wait_minutes, duration_minutes)
+            result = {'status': 'completed', 'actual_end_time': now, 'service_duration_minutes': duration_minutes}
+            QueueService._publish_visit_event(row, 'completed', {
+                'status': 'completed',
+                'service_duration_minutes': duration_minutes,
+            })
+            expected = QueueService.get_service_duration(row['service_id']) if row['service_id'] else DEFAULT_VISIT_MINUTES
+            if abs(duration_minutes - expected) > QueueService.OFF_SCHEDULE_MINUTES:
+                # زيارة أطول أو أقصر من المتوقع: الكرسي يتحرر الآن
+                result['reestimated'] = QueueService.reestimate_downstream(
+                    appointment_id,
+                    now + timedelta(minutes=QueueService.BASE_BUFFER_MINUTES)
+                )
+        return result
+
+    @staticmethod
+    def shift_queue(appointment_date, after_time, delta: int, exclude_id: int = None, after_id: int = None) -> int:
+        """
+        إزاحة أرقام الطابور لكل المواعيد النشطة بعد وقت معين في نفس اليوم
+        تحديث جماعي واحد (UPDATE ... SET queue_number = queue_number + delta)
+        مع نفس الإزاحة في QueueHistory.queue_position، بدون حلقة على الصفوف
+
+        Args:
+            appointment_date: تاريخ اليوم
+            after_time: المواعيد بعد هذا الوقت فقط
+            delta: مقدار الإزاحة (-1 عند الإلغاء، +1 عند الإضافة)
+            exclude_id: موعد يُستثنى (الموعد المُعدّل نفسه)
+            after_id: احتساب المواعيد في نفس الوقت ذات المعرف الأكبر أيضاً
+                (ترتيب الطابور هو (الوقت، المعرف) عند وجود عدة كراسي)
+
+        Returns:
+            عدد المواعيد المُزاحة
+        """
+        after = Q(appointment_time__gt=after_time)
+        if after_id:
+            after |= Q(appointment_time=after_time, id__gt=after_id)
+        later = Appointment.objects.filter(
+            after,
+            appointment_date=appointment_date,
+            status__in=ACTIVE_STATUSES
+        )
+        if exclude_id:
+            later = later.exclude(id=exclude_id)
+
+        with transaction.atomic():
+            shifted = later.update(queue_number=F('queue_number') + delta)
+            if shifted:
+                QueueHistory.objects.filter(appointment__in=later.values('id')).update(
+                    queue_position=F('queue_position') + delta
+                )
+        if shifted:
+            transaction.on_commit(lambda: QueueVersion.bump(appointment_date))
+        return shifted
+
+    @staticmethod
+    def renumber_after_change(appointment, previous_slot=None):
+        """
+        إعادة ترقيم الطابور بعد حفظ موعد (يُستدعى داخل معاملة الحفظ)
+
+        - موعد جديد: إزاحة المواعيد اللاحقة +1
+        - إلغاء: إزاحة المواعيد اللاحقة -1
+        - تغيير التاريخ/الوقت أو إعادة التفعيل: إزاحة -1 في الموقع القديم،
+          +1 في الموقع الجديد، وإعادة حساب رقم الموعد نفسه
+
+        Args:
+            appointment: الموعد بعد الحفظ
+            previous_slot: (التاريخ، الوقت، الحالة) قبل التعديل، أو None لموعد جديد
+        """
+        field = Appointment._meta.get_field
+        appointment_date = field('appointment_date').to_python(appointment.appointment_date)
+        appointment_time = field('appointment_time').to_python(appointment.appointment_time)
+        is_active = appointment.status in ACTIVE_STATUSES
+
+        if previous_slot is None:
+            if is_active:
+                QueueService.shift_queue(
+                    appointment_date, appointment_time, 1, exclude_id=appointment.id, after_id=appointment.id
+                )
+            return
+
+        previous_date, previous_time, previous_status = previous_slot
+        was_active = previous_status in ACTIVE_STATUSES
+        if was_active == is_active and (previous_date, previous_time) == (appointment_date, appointment_time):
+            return
+
+        if was_active:
+            QueueService.shift_queue(
+                previous_date, previous_time, -1, exclude_id=appointment.id, after_id=appointment.id
+            )
+        if is_active:
+            QueueService.shift_queue(
+                appointment_date, appointment_time, 1, exclude_id=appointment.id, after_id=appointment.id
+            )
+            appointment.queue_number = Appointment.objects.filter(
+                Q(appointment_time__lt=appointment_time) | Q(appointment_time=appointment_time, id__lt=appointment.id),
+                appointment_date=appointment_date,
+                status__in=ACTIVE_STATUSES
+            ).count() + 1
+            Appointment.objects.filter(id=appointment.id).update(queue_number=appointment.queue_number)
+            QueueHistory.objects.filter(appointment_id=appointment.id).update(queue_position=appointment.queue_number)
+
+    @staticmethod
+    def get_queue_position(booking_id: str) -> dict:
+        """
+        موقع حجز معين بين المنتظرين في طابور يومه (الحجز وإصدار اليوم: استعلامان مفهرسان)
+
+        يُحتسب فقط من ينتظر فعلاً: الحالة pending أو confirmed ولم تبدأ زيارته،
+        بترتيب (الوقت، المعرف) حتى لا يتشارك موعدان في نفس الوقت نفس الموقع.
+
+        Args:
+            booking_id: معرف الحجز
+
+        Returns:
+            قاموس صغير بالموقع والانتظار المتوقع، أو None إذا لم يوجد الحجز
+        """
+        appointment = Appointment.objects.filter(booking_id=booking_id).values(
+            'id', 'appointment_date', 'appointment_time', 'status', 'queue_history__estimated_wait_minutes'
+        ).first()
+        if appointment is None:
+            return None
+
+        position = None
+        people_ahead = None
+        next_position = None
+        # من لقطة المنتظرين في فهرس اليوم (تُعاد فقط عند تغيّر إصدار اليوم)
+        rank = day_queue_index.waiting_rank(
+            appointment['appointment_date'], appointment['appointment_time'], appointment['id']
+        )
+        if rank is not None:
+            people_ahead, behind = rank
+            position = people_ahead + 1
+            if behind:
+                next_position = position + 1
+
+        return {
+            'booking_id': booking_id,
+            'status': appointment['status'],
+            'position': position,
+            'people_ahead': people_ahead,
+            'next_position': next_position,
+            'estimated_wait_minutes': appointment['queue_history__estimated_wait_minutes'],
+        }
+
+    @staticmethod
+    def create_missing_queue_history(start_date, end_date) -> int:
+        """
+        إنشاء سجلات الطابور الناقصة للمواعيد القديمة في نطاق تاريخ (bulk_create)
+
+        Args:
+            start_date: بداية النطاق
+            end_date: نهاية النطاق (شاملة)
+
+        Returns:
+            عدد السجلات المُنشأة
+        """
+        from datetime import datetime as dt
+
+        missing = list(
+            Appointment.objects.filter(
+                appointment_date__range=(start_date, end_date),
+                queue_history__isnull=True
+            ).values_list('id', 'appointment_date', 'appointment_time', 'queue_number')
+        )
+        if not missing:
+            return 0
+
+        estimates = {}
+        for appointment_date in {row[1] for row in missing}:
+            estimates.update(QueueService.estimate_day(appointment_date, save=False))
+
+        QueueHistory.objects.bulk_create(
+            [
+                QueueHistory(
+                    appointment_id=appointment_id,
+                    scheduled_start_time=timezone.make_aware(dt.combine(appointment_date, appointment_time)),
+                    estimated_wait_minutes=estimates.get(appointment_id, 0),
+                    queue_position=queue_number
+                )
+                for appointment_id, appointment_date, appointment_time, queue_number in missing
+            ],
+            batch_size=500,
+            ignore_conflicts=True
+        )
+        return len(missing)
+
+    @staticmethod
+    def rebuild_queue_statistics(start_date, end_date) -> int:
+        """
+        إعادة حساب إحصائيات الطابور لنطاق تاريخ باستعلام تجميعي واحد
+        بدلاً من الحلقة على كل موعد في update_queue_statistics
+
+        Args:
+            start_date: بداية النطاق
+            end_date: نهاية النطاق (شاملة)
+
+        Returns:
+            عدد صفوف الإحصائيات المكتوبة
+        """
+        wait = 'queue_history__actual_wait_minutes'
+        duration = 'queue_history__service_duration_minutes'
+        has_wait = Q(**{f'{wait}__isnull': False})
+        has_duration = Q(**{f'{duration}__isnull': False})
+
+        rows = Appointment.objects.filter(
+            appointment_date__range=(start_date, end_date),
+            status='completed',
+            service__isnull=False
+        ).values('appointment_date', 'service_id').annotate(
+            total=Count('id'),
+            completed=Count('id', filter=has_wait),
+            wait_sum=Sum(wait, filter=has_wait),
+            wait_squares=Sum(F(wait) * F(wait), filter=has_wait),
+            wait_min=Min(wait, filter=has_wait),
+            wait_max=Max(wait, filter=has_wait),
+            duration_samples=Count('id', filter=has_duration),
+            duration_sum=Sum(duration, filter=has_duration),
+            duration_squares=Sum(F(duration) * F(duration), filter=has_duration),
+            duration_min=Min(duration, filter=has_duration),
+            duration_max=Max(duration, filter=has_duration),
+        ).order_by()
+
+        statistics = []
+        for row in rows:
+            wait_sum = row['wait_sum'] or 0
+            duration_sum = row['duration_sum'] or 0
+            statistics.append(QueueStatistics(
+                service_id=row['service_id'],
+                appointment_date=row['appointment_date'],
+                total_appointments=row['total'],
+                completed_appointments=row['completed'],
+                average_wait_minutes=wait_sum // row['completed'] if row['completed'] else 0,
+                average_service_duration_minutes=(
+                    duration_sum // row['duration_samples'] if row['duration_samples'] else 30
+                ),
+                min_wait_minutes=row['wait_min'] or 0,
+                max_wait_minutes=row['wait_max'] or 0,
+                min_service_duration_minutes=row['duration_min'] or 0,
+                max_service_duration_minutes=row['duration_max'] or 0,
+                wait_sum_minutes=wait_sum,
+                wait_sum_squares=row['wait_squares'] or 0,
+                duration_samples=row['duration_samples'],
+                duration_sum_minutes=duration_sum,
+                duration_sum_squares=row['duration_squares'] or 0,
+            ))
+
+        QueueStatistics.objects.bulk_create(
+            statistics,
+            batch_size=500,
+            update_conflicts=True,
+            unique_fields=['service', 'appointment_date'],
+            update_fields=[
+                'total_appointments', 'completed_appointments', 'average_wait_minutes',
+                'average_service_duration_minutes', 'min_wait_minutes', 'max_wait_minutes',
+                'min_service_duration_minutes', 'max_service_duration_minutes', 'wait_sum_minutes',
+                'wait_sum_squares', 'duration_samples', 'duration_sum_minutes', 'duration_sum_squares',
+                'updated_at',
+            ]
+        )
+        historical_average_cache.invalidate()
+        return len(statistics)
+
     @staticmethod
     def get_current_queue_status(appointment_date=None) -> dict:
         """
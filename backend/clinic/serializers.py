@@ -1,5 +1,6 @@
 from rest_framework import serializers
-from .models import Service, Patient, Appointment, Testimonial, BlogPost, ContactMessage, BeforeAfterGallery, AppointmentNotification, QueueStatistics, QueueHistory
+from .models import normalize_phone, Service, Patient, Appointment, Testimonial, BlogPost, ContactMessage, BeforeAfterGallery, AppointmentNotification, QueueStatistics, QueueHistory
+from .durations import DEFAULT_VISIT_MINUTES
 
 
 class ServiceSerializer(serializers.ModelSerializer):
@@ -8,11 +9,27 @@ class ServiceSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+def validate_phone_number(value):
+    """Reject numbers that cannot be normalized to E.164 (9 to 15 digits)"""
+    if not 9 <= len(normalize_phone(value).lstrip('+')) <= 15:
+        raise serializers.ValidationError('Enter a valid phone number, e.g. +213555123456 or 0555123456')
+    return value
+
+
 class PatientSerializer(serializers.ModelSerializer):
     class Meta:
         model = Patient
         fields = '__all__'
 
+    def validate_phone(self, value):
+        # One patient per normalized number: "+213555..." and "0555..." are the same person
+        duplicates = Patient.objects.filter(phone_normalized=normalize_phone(value))
+        if self.instance is not None:
+            duplicates = duplicates.exclude(pk=self.instance.pk)
+        if duplicates.exists():
+            raise serializers.ValidationError('A patient with this phone number already exists')
+        return value
+
 
 class AppointmentSerializer(serializers.ModelSerializer):
     patient_name = serializers.CharField(source='patient.full_name', read_only=True)
@@ -27,57 +44,81 @@ class AppointmentSerializer(serializers.ModelSerializer):
 
 class AppointmentCreateSerializer(serializers.ModelSerializer):
     patient_name = serializers.CharField(write_only=True)
-    patient_phone = serializers.CharField(write_only=True)
+    patient_phone = serializers.CharField(write_only=True, validators=[validate_phone_number])
     patient_email = serializers.EmailField(write_only=True, required=False, allow_blank=True)
 
     class Meta:
         model = Appointment
         fields = ['patient_name', 'patient_phone', 'patient_email', 'service', 'appointment_date', 'appointment_time', 'notes']
+        # Slot conflicts are checked under the day lock (409 with alternatives), not by unique_together
+        validators = []
+
+    def validate(self, attrs):
+        # Reject bookings overlapping another appointment on every eligible chair, without scanning
+        # the day. A validation error (is_valid() stays side-effect free) that the view answers with
+        # the same 409 and alternatives as the locked check in BookingAllocator.book
+        from .booking import SLOT_UNAVAILABLE_CODE, BookingAllocator, booking_interval_index, format_slots
+        service = attrs.get('service')
+        duration = service.duration_minutes if service and service.duration_minutes else DEFAULT_VISIT_MINUTES
+        chair_ids = BookingAllocator.chairs_for(service.id if service else None)
+        if not booking_interval_index.free_chairs(
+            attrs['appointment_date'], attrs['appointment_time'], duration, chair_ids
+        ):
+            alternatives = BookingAllocator.alternative_slots(
+                attrs['appointment_date'], attrs['appointment_time'], duration, chair_ids
+            )
+            raise serializers.ValidationError({
+                'appointment_time': ['This time slot is already booked'],
+                'alternatives': format_slots(alternatives),
+            }, code=SLOT_UNAVAILABLE_CODE)
+        return attrs
 
     def create(self, validated_data):
         patient_name = validated_data.pop('patient_name')
         patient_phone = validated_data.pop('patient_phone')
         patient_email = validated_data.pop('patient_email', None)
         
-        # Get or create patient
-        patient, created = Patient.objects.get_or_create(
-            phone=patient_phone,
-            defaults={
-                'full_name': patient_name,
-                'email': patient_email
-            }
-        )
-        
-        # Update email if patient exists but email is new
-        if not created and patient_email and not patient.email:
-            patient.email = patient_email
-            patient.save()
-        
-        # Create appointment
-        appointment = Appointment.objects.create(
-            patient=patient,
+        # Lock the day, check the slot and create patient + appointment + one
+        # background job atomically; queue history and notifications are
+        # handled by the run_worker process
+        from .booking import BookingAllocator
+        appointment = BookingAllocator.book(
+            patient_name,
+            patient_phone,
+            patient_email,
             **validated_data
         )
         
-        # Create queue history and calculate wait time
-        try:
-            from .queue_service import QueueService
-            QueueService.create_queue_history(appointment)
-        except Exception as e:
-            # Log error but don't fail appointment creation
-            print(f"تحذير: فشل إنشاء سجل الطابور: {str(e)}")
-        
-        # Send notifications (optional - can be disabled if needed)
-        try:
-            from .notifications import NotificationService
-            NotificationService.create_appointment_notifications(appointment)
-        except Exception as e:
-            # Log error but don't fail appointment creation
-            print(f"تحذير: فشل إنشاء الإشعارات: {str(e)}")
-        
         return appointment
 
 
+class AppointmentSeriesSerializer(serializers.Serializer):
+    """Recurring appointments: every `every_weeks` weeks, `occurrences` times, same time of day"""
+    MAX_OCCURRENCES = 52
+
+    patient_name = serializers.CharField()
+    patient_phone = serializers.CharField(validators=[validate_phone_number])
+    patient_email = serializers.EmailField(required=False, allow_blank=True)
+    service = serializers.PrimaryKeyRelatedField(queryset=Service.objects.all(), required=False, allow_null=True)
+    start_date = serializers.DateField()
+    appointment_time = serializers.TimeField()
+    every_weeks = serializers.IntegerField(min_value=1, max_value=52, default=4)
+    occurrences = serializers.IntegerField(min_value=1, max_value=MAX_OCCURRENCES)
+    skip_conflicts = serializers.BooleanField(default=True)
+    notes = serializers.CharField(required=False, allow_blank=True, allow_null=True)
+
+    def create(self, validated_data):
+        # One transaction for the whole series: a single range query for conflicts,
+        # then bulk inserts of appointments, queue history and reminders
+        from .booking import BookingAllocator
+        return BookingAllocator.book_series(
+            validated_data.pop('patient_name'),
+            validated_data.pop('patient_phone'),
+            validated_data.pop('patient_email', None) or None,
+            **validated_data
+        )
+
+
 class TestimonialSerializer(serializers.ModelSerializer):
     class Meta:
         model = Testimonial
@@ -122,7 +163,7 @@ class QueueStatisticsSerializer(serializers.ModelSerializer):
         model = QueueStatistics
         fields = ['id', 'service', 'service_name', 'appointment_date', 'total_appointments', 'completed_appointments', 
                   'average_wait_minutes', 'average_service_duration_minutes', 'min_wait_minutes', 'max_wait_minutes', 
-                  'created_at', 'updated_at']
+                  'min_service_duration_minutes', 'max_service_duration_minutes', 'created_at', 'updated_at']
         read_only_fields = ['created_at', 'updated_at']
 
 
@@ -135,7 +176,7 @@ class QueueHistorySerializer(serializers.ModelSerializer):
     class Meta:
         model = QueueHistory
         fields = ['id', 'appointment', 'booking_id', 'patient_name', 'service_name', 'appointment_status',
-                  'scheduled_start_time', 'actual_start_time', 'actual_end_time', 'estimated_wait_minutes',
+                  'scheduled_start_time', 'check_in_time', 'actual_start_time', 'actual_end_time', 'estimated_wait_minutes',
                   'actual_wait_minutes', 'service_duration_minutes', 'queue_position', 'is_no_show',
                   'cancellation_reason', 'created_at', 'updated_at']
         read_only_fields = ['created_at', 'updated_at', 'actual_wait_minutes', 'service_duration_minutes']
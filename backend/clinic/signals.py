@@ -0,0 +1,177 @@
+"""
+إشارات العيادة
+Keeps in-process queue structures and live streams in sync with queue writes.
+"""
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_init, post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from .booking import slot_availability
+from .models import Appointment, Chair, Dentist, QueueHistory, QueueStatistics, Service
+from .queue_events import queue_broadcaster
+from .queue_service import (
+    ACTIVE_STATUSES,
+    QueueService,
+    chair_pool_cache,
+    day_schedule_cache,
+    QueueVersion,
+    historical_average_cache,
+    service_duration_cache,
+)
+
+
+def as_date(value):
+    """تحويل التاريخ النصي إلى date"""
+    return Appointment._meta.get_field('appointment_date').to_python(value)
+
+
+def appointment_event(status: str) -> str:
+    """تحديد نوع حدث الطابور من حالة الموعد"""
+    if status == 'cancelled':
+        return 'removed'
+    if status == 'completed':
+        return 'completed'
+    return 'position'
+
+
+@receiver(post_save, sender=Appointment)
+def appointment_saved(sender, instance, **kwargs):
+    """زيادة إصدار اليوم، ثم تحديث خريطة الفترات ونشر التغيير بعد تأكيد المعاملة"""
+    event = appointment_event(instance.status)
+    payload = {
+        'queue_position': instance.queue_number,
+        'status': instance.status,
+        'appointment_time': str(instance.appointment_time),
+    }
+    appointment_date = as_date(instance.appointment_date)
+    booking_id = instance.booking_id
+    affected_dates = {appointment_date}
+    previous_date, previous_time, previous_status = getattr(instance, '_loaded_queue_slot', (None, None, None))
+    if previous_date:
+        affected_dates.add(as_date(previous_date))
+
+    # تحديث خريطة الفترات المحجوزة: تحرير الفترة السابقة وحجز الحالية
+    chair_id = instance.chair_id
+    slot_patches = []
+    if previous_date and previous_status != 'cancelled':
+        slot_patches.append((as_date(previous_date), previous_time, getattr(instance, '_loaded_chair_id', None), False))
+    if instance.status != 'cancelled':
+        slot_patches.append((appointment_date, instance.appointment_time, chair_id, True))
+
+    # إصدار اليوم داخل المعاملة: يتغيّر ذرياً مع الموعد فترفض كل العمليات لقطاتها القديمة
+    version = QueueVersion.bump(*affected_dates, all_days=False)[str(appointment_date)]
+
+    def on_commit():
+        QueueVersion.bump()
+        for slot_patch in slot_patches:
+            slot_availability.patch(*slot_patch)
+        queue_broadcaster.publish(appointment_date, booking_id, event, payload, version)
+
+    transaction.on_commit(on_commit)
+
+
+@receiver(post_delete, sender=Appointment)
+def appointment_deleted(sender, instance, **kwargs):
+    """إعادة ترقيم ما بعد الموعد المحذوف، زيادة إصدار اليوم، ونشر الإزالة"""
+    if instance.status in ACTIVE_STATUSES:
+        QueueService.shift_queue(instance.appointment_date, instance.appointment_time, -1, after_id=instance.pk)
+    appointment_date = as_date(instance.appointment_date)
+    appointment_time = instance.appointment_time
+    chair_id = instance.chair_id
+    was_occupying = instance.status != 'cancelled'
+    booking_id = instance.booking_id
+
+    version = QueueVersion.bump(appointment_date, all_days=False)[str(appointment_date)]
+
+    def on_commit():
+        QueueVersion.bump()
+        if was_occupying:
+            slot_availability.patch(appointment_date, appointment_time, chair_id, False)
+        queue_broadcaster.publish(appointment_date, booking_id, 'removed', {}, version)
+
+    transaction.on_commit(on_commit)
+
+
+@receiver(post_init, sender=QueueHistory)
+def queue_history_loaded(sender, instance, **kwargs):
+    """حفظ وقت الانتهاء الأصلي لاكتشاف لحظة اكتمال الموعد"""
+    instance._loaded_actual_end_time = instance.actual_end_time
+
+
+@receiver(post_save, sender=QueueHistory)
+def queue_history_saved(sender, instance, **kwargs):
+    """تحديث الإحصائيات عند الاكتمال، ونشر بدء/انتهاء الخدمة أو تغيّر الترتيب"""
+    appointment = instance.appointment
+
+    if instance.actual_end_time and not instance._loaded_actual_end_time:
+        # ضمن نفس المعاملة حتى تبقى الإحصائيات متسقة مع سجل الطابور
+        QueueService.record_completion(
+            as_date(appointment.appointment_date),
+            appointment.service_id,
+            instance.actual_wait_minutes,
+            instance.service_duration_minutes
+        )
+    instance._loaded_actual_end_time = instance.actual_end_time
+    if instance.actual_end_time:
+        event = 'completed'
+    elif instance.actual_start_time:
+        event = 'started'
+    else:
+        event = 'position'
+    payload = {
+        'queue_position': instance.queue_position,
+        'estimated_wait_minutes': instance.estimated_wait_minutes,
+        'status': appointment.status,
+    }
+    appointment_date = as_date(appointment.appointment_date)
+    booking_id = appointment.booking_id
+
+    def on_commit():
+        version = QueueVersion.bump(appointment_date)[str(appointment_date)]
+        queue_broadcaster.publish(appointment_date, booking_id, event, payload, version)
+
+    transaction.on_commit(on_commit)
+
+
+@receiver(post_delete, sender=QueueHistory)
+def queue_history_deleted(sender, instance, **kwargs):
+    """زيادة إصدار اليوم عند حذف سجل طابور"""
+    scheduled = instance.scheduled_start_time
+    if timezone.is_aware(scheduled):
+        scheduled = timezone.localtime(scheduled)
+    appointment_date = scheduled.date()
+    transaction.on_commit(lambda: QueueVersion.bump(appointment_date))
+
+
+@receiver(post_save, sender=Service)
+@receiver(post_delete, sender=Service)
+def service_changed(sender, instance, **kwargs):
+    """إبطال كاش مدة الخدمة وفهرس الفترات (مبني على المدد)"""
+    service_id = instance.pk
+
+    def on_commit():
+        service_duration_cache.invalidate(service_id)
+        day_schedule_cache.invalidate()
+        # الفترات المحجوزة مبنية على المدد: إصدار جديد لكل الأيام في كل العمليات
+        QueueVersion.bump_all_days()
+
+    transaction.on_commit(on_commit)
+
+
+@receiver(post_save, sender=Chair)
+@receiver(post_delete, sender=Chair)
+@receiver(post_save, sender=Dentist)
+@receiver(post_delete, sender=Dentist)
+@receiver(m2m_changed, sender=Dentist.services.through)
+def resources_changed(sender, **kwargs):
+    """إبطال كاش الكراسي المؤهلة لكل خدمة"""
+    transaction.on_commit(chair_pool_cache.invalidate)
+
+
+@receiver(post_save, sender=QueueStatistics)
+@receiver(post_delete, sender=QueueStatistics)
+def queue_statistics_changed(sender, instance, **kwargs):
+    """إبطال كاش المتوسطات التاريخية للخدمة"""
+    service_id = instance.service_id
+    transaction.on_commit(lambda: historical_average_cache.invalidate(service_id))
@@ -0,0 +1,24 @@
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from clinic.booking import booking_interval_index
+from clinic.queue_service import (
+    chair_pool_cache, day_queue_index, day_schedule_cache, historical_average_cache, service_duration_cache,
+    wait_time_predictor
+)
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+# Production settings redirect plain-HTTP test requests (DEBUG=False turns on SECURE_SSL_REDIRECT)
+@override_settings(CACHES=LOCMEM_CACHES, SECURE_SSL_REDIRECT=False)
+class ClinicTestCase(TestCase):
+    """Each test starts with an empty shared cache, empty in-process queue indexes and no wait-time model"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        day_queue_index.invalidate()
+        booking_interval_index.invalidate()
+        for read_through in (historical_average_cache, service_duration_cache, chair_pool_cache, day_schedule_cache):
+            read_through.invalidate()
+        wait_time_predictor.load(force=True)
@@ -0,0 +1,280 @@
+from datetime import date, datetime, time, timedelta
+from unittest import mock
+from django.core import mail
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+from rest_framework.test import APIClient
+from clinic.booking import BookingAllocator, BookingIdSequence, booking_interval_index
+from clinic.jobs import send_notification
+from clinic.models import Appointment, AppointmentNotification, BookingDay, Chair, Dentist, IdempotencyKey, Patient, QueueHistory, Service
+from clinic.notifications import NotificationService
+from clinic.serializers import AppointmentCreateSerializer
+from clinic.queue_service import QueueService, QueueVersion
+from .base import ClinicTestCase
+
+
+class BookSeriesTests(ClinicTestCase):
+    def setUp(self):
+        super().setUp()
+        self.service = Service.objects.create(
+            name='Orthodontics', description='-', price_min=0, price_max=0, duration='30 دقيقة'
+        )
+        self.chair = Chair.objects.create(name='Chair 1')
+
+    def test_stored_estimates_match_a_fresh_estimate(self):
+        first_day = date(2099, 1, 6)
+        # Earlier visits on the first and second days of the series push the series visits back
+        with self.captureOnCommitCallbacks(execute=True):
+            for phone, day, start in [
+                ('0550000001', first_day, time(9, 0)),
+                ('0550000002', first_day, time(9, 30)),
+                ('0550000003', date(2099, 2, 3), time(9, 15)),
+            ]:
+                BookingAllocator.book('Earlier', phone, service=self.service, appointment_date=day, appointment_time=start)
+        # Warm the cached day schedule and queue index before the series is booked
+        QueueService.estimate_wait_time(first_day, time(10, 0), self.service.id, booked=False)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            appointments, skipped = BookingAllocator.book_series(
+                'Series', '0551112233', service=self.service, start_date=first_day,
+                appointment_time=time(10, 0), every_weeks=4, occurrences=3
+            )
+
+        self.assertEqual(skipped, [])
+        self.assertEqual(len(appointments), 3)
+        stored = dict(
+            QueueHistory.objects.filter(appointment__in=appointments).values_list('appointment_id', 'estimated_wait_minutes')
+        )
+        for appointment in appointments:
+            fresh = QueueService.estimate_wait_time(
+                appointment.appointment_date, appointment.appointment_time, self.service.id,
+                appointment_id=appointment.id
+            )
+            self.assertEqual(stored[appointment.id], fresh, appointment.appointment_date)
+        self.assertGreater(stored[appointments[0].id], 0)
+        self.assertEqual(
+            list(Appointment.objects.filter(appointment_date=first_day).order_by('appointment_time').values_list('queue_number', flat=True)),
+            [1, 2, 3]
+        )
+
+
+class AppointmentCreateTests(ClinicTestCase):
+    def setUp(self):
+        super().setUp()
+        self.service = Service.objects.create(
+            name='Cleaning', description='-', price_min=0, price_max=0, duration='30 دقيقة'
+        )
+        self.chair = Chair.objects.create(name='Chair 1')
+        self.client = APIClient(SERVER_NAME='localhost')
+
+    def post(self, appointment_time, phone='0551112233'):
+        return self.client.post('/api/appointments/', {
+            'patient_name': 'Patient', 'patient_phone': phone, 'service': self.service.id,
+            'appointment_date': '2099-01-06', 'appointment_time': appointment_time,
+        }, format='json')
+
+    def test_overlap_is_a_conflict_with_alternatives(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.post('09:00').status_code, 201)
+
+        response = self.post('09:15', phone='0552223344')
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['alternatives'][0], {'date': '2099-01-06', 'time': '10:00'})
+        self.assertEqual(Appointment.objects.count(), 1)
+
+    def test_overlap_leaves_is_valid_side_effect_free(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.post('09:00').status_code, 201)
+
+        serializer = AppointmentCreateSerializer(data={
+            'patient_name': 'Patient', 'patient_phone': '0552223344', 'service': self.service.id,
+            'appointment_date': '2099-01-06', 'appointment_time': '09:15',
+        })
+
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors['appointment_time'][0].code, 'slot_unavailable')
+
+    def test_overlap_check_sees_writes_from_another_process(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.post('09:00').status_code, 201)
+        patient = Appointment.objects.get().patient
+        # bulk_create skips the signals, like a booking made by another process; only the day version moves
+        Appointment.objects.bulk_create([Appointment(
+            patient=patient, service=self.service, chair=self.chair, appointment_date=date(2099, 1, 6),
+            appointment_time=time(10, 0), booking_id='BK-20990106-9999', queue_number=2,
+        )])
+        QueueVersion.bump(date(2099, 1, 6))
+
+        self.assertEqual(booking_interval_index.free_chairs(date(2099, 1, 6), time(10, 15), 30, [self.chair.id]), [])
+        self.assertEqual(self.post('10:15', phone='0552223344').status_code, 409)
+
+    def test_overlapping_bookings_take_the_next_free_chair(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            chair_2 = Chair.objects.create(name='Chair 2')
+            self.assertEqual(self.post('09:00').status_code, 201)
+            self.assertEqual(self.post('09:15', phone='0552223344').status_code, 201)
+
+        self.assertEqual(
+            list(Appointment.objects.order_by('appointment_time').values_list('chair_id', flat=True)),
+            [self.chair.id, chair_2.id]
+        )
+        self.assertEqual(self.post('09:15', phone='0553334455').status_code, 409)
+        # A visit that no longer overlaps the first one takes its chair again
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.post('09:45', phone='0553334455').status_code, 201)
+        self.assertEqual(Appointment.objects.get(appointment_time=time(9, 45)).chair_id, self.chair.id)
+
+    def test_chair_of_a_dentist_without_the_service_is_not_used(self):
+        implants = Service.objects.create(name='Implants', description='-', price_min=0, price_max=0, duration='1 ساعة')
+        with self.captureOnCommitCallbacks(execute=True):
+            dentist = Dentist.objects.create(full_name='Dentist')
+            dentist.services.add(implants)
+            Chair.objects.create(name='Chair 2', dentist=dentist)
+            self.assertEqual(self.post('09:00').status_code, 201)
+
+        self.assertEqual(self.post('09:15', phone='0552223344').status_code, 409)
+
+    def test_malformed_input_is_a_bad_request(self):
+        response = self.post('nine')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('appointment_time', response.data)
+
+
+class BookingIdSequenceTests(ClinicTestCase):
+    day = date(2099, 1, 6)
+
+    def test_processes_share_one_counter_without_collisions(self):
+        first, second = BookingIdSequence(block_size=3), BookingIdSequence(block_size=3)
+        # Outside a transaction each process reserves a block of numbers from the day counter
+        with mock.patch('clinic.booking.connection', mock.Mock(in_atomic_block=False)):
+            ids = [first.next_id(self.day) for _ in range(3)]
+            self.assertEqual(BookingDay.objects.get(date=self.day).last_booking_number, 3)
+            ids += [second.next_id(self.day), first.next_id(self.day)]
+
+        self.assertEqual(ids, [f'BK-20990106-{n:04d}' for n in (1, 2, 3, 4, 7)])
+        self.assertEqual(BookingDay.objects.get(date=self.day).last_booking_number, 9)
+
+    def test_rolled_back_booking_does_not_keep_its_number(self):
+        sequence = BookingIdSequence(block_size=10)
+        self.assertEqual(sequence.next_id(self.day), 'BK-20990106-0001')
+        with self.assertRaises(DatabaseError), transaction.atomic():
+            self.assertEqual(sequence.next_id(self.day), 'BK-20990106-0002')
+            raise DatabaseError('booking failed')
+
+        self.assertEqual(sequence.next_id(self.day), 'BK-20990106-0002')
+
+
+class PatientPhoneTests(ClinicTestCase):
+    def test_phones_that_cannot_be_normalized_do_not_collide(self):
+        first = Patient.objects.create(full_name='First', phone='-')
+        second = Patient.objects.create(full_name='Second', phone='')
+
+        self.assertIsNone(first.phone_normalized)
+        self.assertIsNone(second.phone_normalized)
+        self.assertEqual(Patient.objects.filter(phone_normalized__isnull=True).count(), 2)
+
+
+class IdempotencyKeyTests(ClinicTestCase):
+    def setUp(self):
+        super().setUp()
+        self.service = Service.objects.create(
+            name='Cleaning', description='-', price_min=0, price_max=0, duration='30 دقيقة'
+        )
+        Chair.objects.create(name='Chair 1')
+        self.client = APIClient(SERVER_NAME='localhost')
+
+    def post(self, key, appointment_time='09:00', remote_addr='127.0.0.1'):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/appointments/', {
+                'patient_name': 'Patient', 'patient_phone': '0551112233', 'service': self.service.id,
+                'appointment_date': '2099-01-06', 'appointment_time': appointment_time,
+            }, format='json', HTTP_IDEMPOTENCY_KEY=key, REMOTE_ADDR=remote_addr)
+
+    def test_retry_replays_the_stored_response(self):
+        first = self.post('booking-1')
+        retry = self.post('booking-1')
+
+        self.assertEqual((first.status_code, retry.status_code), (201, 201))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(Appointment.objects.count(), 1)
+
+    def test_same_key_with_another_request_is_rejected(self):
+        self.assertEqual(self.post('booking-1').status_code, 201)
+        self.assertEqual(self.post('booking-1', appointment_time='10:00').status_code, 422)
+        self.assertEqual(Appointment.objects.count(), 1)
+
+    def test_in_progress_key_is_taken_over_after_its_lease(self):
+        IdempotencyKey.objects.create(
+            scope='appointment', client='ip:127.0.0.1', key='booking-1', request_hash='-',
+            expires_at=timezone.now() + timedelta(days=1)
+        )
+        self.assertEqual(self.post('booking-1').status_code, 409)
+
+        # The process that reserved the key died without saving a response or deleting the row
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(seconds=61))
+
+        self.assertEqual(self.post('booking-1').status_code, 201)
+        self.assertEqual(IdempotencyKey.objects.get().status_code, 201)
+
+    def test_keys_are_scoped_per_client(self):
+        self.assertEqual(self.post('booking-1').status_code, 201)
+        other = self.post('booking-1', appointment_time='10:00', remote_addr='10.0.0.2')
+
+        self.assertEqual(other.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', other)
+        self.assertEqual(Appointment.objects.count(), 2)
+
+
+class NotificationDispatchTests(ClinicTestCase):
+    def setUp(self):
+        super().setUp()
+        service = Service.objects.create(name='Cleaning', description='-', price_min=0, price_max=0, duration='30 دقيقة')
+        patient = Patient.objects.create(full_name='Patient', phone='0551112233', email='patient@example.com')
+        self.appointment = Appointment.objects.create(
+            patient=patient, service=service, appointment_date=date(2099, 1, 6), appointment_time=time(9, 0)
+        )
+
+    def notify(self, notification_type='email', recipient='patient@example.com', **fields):
+        return AppointmentNotification.objects.create(
+            appointment=self.appointment, notification_type=notification_type, recipient=recipient,
+            scheduled_time=datetime.now() - timedelta(minutes=1), message='-', **fields
+        )
+
+    def test_batch_writes_each_notification_status(self):
+        email = self.notify()
+        whatsapp = self.notify('whatsapp', '0551112233')
+
+        with mock.patch.object(NotificationService, 'send_whatsapp_notification', side_effect=RuntimeError('down')):
+            batches = list(NotificationService.dispatch_due_notifications())
+
+        self.assertEqual([(batch['sent'], batch['failed']) for batch in batches], [(1, 1)])
+        email.refresh_from_db()
+        whatsapp.refresh_from_db()
+        self.assertEqual((email.status, email.error_message), ('sent', None))
+        self.assertIsNotNone(email.sent_time)
+        self.assertEqual((whatsapp.status, whatsapp.error_message, whatsapp.sent_time), ('failed', 'down', None))
+        self.assertEqual([message.to for message in mail.outbox], [['patient@example.com']])
+
+    def test_notification_claimed_by_another_sender_is_not_sent_again(self):
+        notification = self.notify()
+        self.assertEqual(NotificationService.claim([notification.id]), [notification])
+
+        self.assertEqual(list(NotificationService.dispatch_due_notifications()), [])
+        send_notification(notification.id)
+
+        self.assertEqual(mail.outbox, [])
+        self.assertEqual(AppointmentNotification.objects.get().status, 'sending')
+
+    def test_notification_left_sending_by_a_dead_process_is_sent(self):
+        notification = self.notify(status='sending')
+        AppointmentNotification.objects.update(
+            updated_at=timezone.now() - timedelta(seconds=NotificationService.SENDING_TIMEOUT_SECONDS + 1)
+        )
+
+        self.assertEqual(NotificationService.send_pending_notifications(), 1)
+        notification.refresh_from_db()
+        self.assertEqual(notification.status, 'sent')
+        self.assertEqual(len(mail.outbox), 1)
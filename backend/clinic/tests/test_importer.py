@@ -0,0 +1,68 @@
+import io
+from clinic.importer import AppointmentImporter
+from clinic.models import Appointment, Patient
+from .base import ClinicTestCase
+
+CSV = (
+    'patient_name,patient_phone,appointment_date,appointment_time\n'
+    'Amina,+213 555 12 34 56,2099-02-01,09:00\n'
+    'Karim,0777000000,2099-02-01,09:30\n'
+    'Amina,0555123456,2099-02-02,10:00\n'
+)
+
+
+class AppointmentImporterTests(ClinicTestCase):
+    def test_import_matches_patients_by_normalized_phone(self):
+        Patient.objects.create(full_name='Karim', phone='00213777000000')
+
+        summary = AppointmentImporter().run(io.StringIO(CSV))
+
+        self.assertEqual((summary['imported'], summary['patients_created'], summary['invalid']), (3, 1, 0))
+        self.assertEqual(Patient.objects.count(), 2)
+        self.assertEqual(Appointment.objects.filter(patient__phone_normalized='+213555123456').count(), 2)
+
+    def test_patient_created_after_lookups_are_loaded(self):
+        class RacingImporter(AppointmentImporter):
+            def _load_lookups(self):
+                super()._load_lookups()
+                # A booking creates the same patient while the file is being read
+                Patient.objects.create(full_name='Amina', phone='0555123456')
+
+        summary = RacingImporter().run(io.StringIO(CSV))
+
+        self.assertEqual((summary['imported'], summary['patients_created']), (3, 1))
+        self.assertEqual(Patient.objects.filter(phone_normalized='+213555123456').count(), 1)
+        self.assertEqual(Appointment.objects.filter(patient__phone_normalized='+213555123456').count(), 2)
+
+    def test_invalid_rows_are_reported_and_skipped(self):
+        rows = (
+            'patient_name,patient_phone,appointment_date,appointment_time,service,status\n'
+            'Amina,0555123456,2099-02-01,09:00,,\n'
+            'Bad phone,12,2099-02-01,09:30,,\n'
+            'Karim,0777000000,2099-02-31,09:30,,\n'
+            'Karim,0777000000,2099-02-01,9h,,\n'
+            'Karim,0777000000,2099-02-01,10:00,Whitening,\n'
+            'Karim,0777000000,2099-02-01,10:00,,lost\n'
+            'Karim,0777000000,2099-02-01,09:00,,\n'
+        )
+
+        summary = AppointmentImporter().run(io.StringIO(rows))
+
+        self.assertEqual(
+            (summary['rows'], summary['imported'], summary['invalid'], summary['conflicts']), (7, 1, 5, 1)
+        )
+        self.assertEqual([error['line'] for error in summary['errors']], [3, 4, 5, 6, 7])
+        self.assertEqual(Appointment.objects.get().patient.full_name, 'Amina')
+
+    def test_malformed_ndjson_lines_are_reported(self):
+        rows = (
+            '{"patient_name": "Amina", "patient_phone": "0555123456", "date": "2099-02-01", "time": "09:00"}\n'
+            '{"patient_name": "Karim",\n'
+            '\n'
+            '["not", "an", "object"]\n'
+        )
+
+        summary = AppointmentImporter().run(io.StringIO(rows), 'ndjson')
+
+        self.assertEqual((summary['rows'], summary['imported'], summary['invalid']), (3, 1, 2))
+        self.assertEqual([error['line'] for error in summary['errors']], [2, 4])
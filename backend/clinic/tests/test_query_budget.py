@@ -0,0 +1,59 @@
+from datetime import date
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from clinic.jobs import JobQueue
+from clinic.models import BackgroundJob, Patient, Service
+from clinic.serializers import AppointmentCreateSerializer
+from .base import ClinicTestCase
+
+
+class BookingQueryBudgetTests(ClinicTestCase):
+    """A booking and its appointment_booked job stay under a fixed query budget, after-commit work included"""
+
+    day = date(2099, 4, 1)
+    # Savepoints included. The day's first booking also loads the day, the chair pool and the version rows
+    FIRST_BOOKING_BUDGET = 40
+    BOOKING_BUDGET = 25
+    JOB_BUDGET = 16
+
+    def setUp(self):
+        super().setUp()
+        self.service = Service.objects.create(
+            name='Query budget', description='-', price_min=0, price_max=0, duration='30 دقيقة'
+        )
+        Patient.objects.create(full_name='Query budget', phone='0988000002')
+
+    def assertWithinBudget(self, queries, budget):
+        self.assertLessEqual(
+            len(queries), budget,
+            '\n'.join(f"{i}. {query['sql']}" for i, query in enumerate(queries.captured_queries, start=1))
+        )
+
+    def book(self, phone, appointment_time, booking_budget):
+        serializer = AppointmentCreateSerializer(data={
+            'patient_name': 'Query budget',
+            'patient_phone': phone,
+            'patient_email': 'budget@example.com',
+            'service': self.service.id,
+            'appointment_date': self.day.isoformat(),
+            'appointment_time': appointment_time,
+        })
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            serializer.is_valid(raise_exception=True)
+            appointment = serializer.save()
+        self.assertWithinBudget(queries, booking_budget)
+
+        job = BackgroundJob.objects.get(kind='appointment_booked', payload__appointment_id=appointment.id)
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(JobQueue.run(job.id, job.kind, job.payload, 1, job.max_attempts))
+        self.assertWithinBudget(queries, self.JOB_BUDGET)
+
+    def test_booking_query_budget(self):
+        # New patient, first booking of the day
+        self.book('0988000001', '09:00', self.FIRST_BOOKING_BUDGET)
+        # Existing patient, email added
+        self.book('0988000002', '10:00', self.BOOKING_BUDGET)
+        # Existing patient, later booking
+        self.book('0988000002', '11:00', self.BOOKING_BUDGET)
+
+        self.assertTrue(Patient.objects.filter(phone='0988000002', email='budget@example.com').exists())
@@ -0,0 +1,467 @@
+from datetime import date, datetime, time, timedelta
+from unittest import mock
+from django.db import DatabaseError, transaction
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from clinic.durations import parse_duration
+from clinic.jobs import appointment_booked
+from clinic.models import Appointment, Chair, Patient, QueueHistory, QueueStatistics, Service, WaitTimeModel
+from clinic.queue_service import (
+    QueueService, QueueVersion, WaitTimePredictor, chair_pool_cache, day_queue_index, service_duration_cache
+)
+from .base import ClinicTestCase
+
+
+class QueueTestCase(ClinicTestCase):
+    day = date(2099, 1, 5)
+
+    def setUp(self):
+        super().setUp()
+        self.service = Service.objects.create(
+            name='Checkup', description='-', price_min=0, price_max=0, duration='30 دقيقة'
+        )
+        self.chair = Chair.objects.create(name='Chair 1')
+        self.patient = Patient.objects.create(full_name='Patient', phone='0550000000')
+
+    def add_appointment(self, start, estimated_wait=0, status='pending', service=None, chair=None):
+        appointment = Appointment.objects.create(
+            patient=self.patient, service=service or self.service, chair=chair or self.chair, appointment_date=self.day,
+            appointment_time=start, status=status
+        )
+        QueueHistory.objects.create(
+            appointment=appointment,
+            scheduled_start_time=timezone.make_aware(datetime.combine(self.day, start)),
+            estimated_wait_minutes=estimated_wait,
+            queue_position=appointment.queue_number,
+        )
+        return appointment
+
+    def at(self, hour, minute=0):
+        return timezone.make_aware(datetime.combine(self.day, time(hour, minute)))
+
+
+class ReestimateDownstreamTests(QueueTestCase):
+    def test_late_start_pushes_later_visits(self):
+        current = self.add_appointment(time(9, 0))
+        second = self.add_appointment(time(9, 30))
+        third = self.add_appointment(time(10, 0))
+
+        # The chair is busy until 10:00: the 9:30 visit waits 30 minutes, the 10:00 one 35
+        self.assertEqual(QueueService.reestimate_downstream(current.id, self.at(10, 0)), 2)
+        self.assertEqual(QueueHistory.objects.get(appointment=second).estimated_wait_minutes, 30)
+        self.assertEqual(QueueHistory.objects.get(appointment=third).estimated_wait_minutes, 35)
+
+    def test_early_finish_lowers_later_estimates(self):
+        current = self.add_appointment(time(9, 0))
+        # Estimates inflated by an earlier late start
+        second = self.add_appointment(time(9, 30), estimated_wait=40)
+        third = self.add_appointment(time(10, 0), estimated_wait=45)
+
+        # The chair is free at 9:40: the 9:30 visit waits 10 minutes, the 10:00 one 15
+        self.assertEqual(QueueService.reestimate_downstream(current.id, self.at(9, 40)), 2)
+        self.assertEqual(QueueHistory.objects.get(appointment=second).estimated_wait_minutes, 10)
+        self.assertEqual(QueueHistory.objects.get(appointment=third).estimated_wait_minutes, 15)
+
+    def test_visit_that_absorbs_an_early_finish_drops_to_zero(self):
+        current = self.add_appointment(time(9, 0))
+        second = self.add_appointment(time(9, 30), estimated_wait=25)
+        third = self.add_appointment(time(10, 0), estimated_wait=30)
+
+        self.assertEqual(QueueService.reestimate_downstream(current.id, self.at(9, 20)), 1)
+        self.assertEqual(QueueHistory.objects.get(appointment=second).estimated_wait_minutes, 0)
+        # Propagation stops at the visit that absorbed the delay
+        self.assertEqual(QueueHistory.objects.get(appointment=third).estimated_wait_minutes, 30)
+
+
+class QueueStatisticsTests(QueueTestCase):
+    def complete(self, start, wait, duration):
+        appointment = self.add_appointment(start, status='completed')
+        history = QueueHistory.objects.get(appointment=appointment)
+        history.actual_start_time = history.scheduled_start_time + timedelta(minutes=wait)
+        history.actual_end_time = history.actual_start_time + timedelta(minutes=duration)
+        history.save()
+
+    def statistics(self):
+        return QueueStatistics.objects.filter(service=self.service, appointment_date=self.day).values(
+            'total_appointments', 'completed_appointments', 'average_wait_minutes',
+            'average_service_duration_minutes', 'min_wait_minutes', 'max_wait_minutes',
+            'min_service_duration_minutes', 'max_service_duration_minutes', 'wait_sum_minutes',
+            'wait_sum_squares', 'duration_samples', 'duration_sum_minutes', 'duration_sum_squares',
+        ).get()
+
+    def test_completions_keep_running_aggregates_equal_to_a_recount(self):
+        for start, wait, duration in [(time(9, 0), 12, 20), (time(9, 30), 5, 31), (time(10, 0), 9, 26)]:
+            self.complete(start, wait, duration)
+
+        incremental = self.statistics()
+        self.assertEqual(
+            (incremental['completed_appointments'], incremental['average_wait_minutes'],
+             incremental['min_wait_minutes'], incremental['max_wait_minutes'], incremental['wait_sum_squares']),
+            (3, 8, 5, 12, 250)
+        )
+        self.assertEqual(
+            (incremental['average_service_duration_minutes'], incremental['min_service_duration_minutes'],
+             incremental['max_service_duration_minutes']),
+            (25, 20, 31)
+        )
+
+        QueueService.update_queue_statistics(self.day)
+        self.assertEqual(self.statistics(), incremental)
+
+
+class ServiceDurationTests(QueueTestCase):
+    def test_free_text_durations_are_parsed_into_minutes(self):
+        self.assertEqual(parse_duration('30-60 دقيقة'), (45, 30, 60))
+        self.assertEqual(parse_duration('1-2 ساعة'), (90, 60, 120))
+        self.assertEqual(parse_duration('ساعة ونصف'), (90, 90, 90))
+        self.assertEqual(parse_duration('٤٥ دقيقة'), (45, 45, 45))
+        # Long treatments: the range covers the whole treatment, a visit keeps the default length
+        self.assertEqual(parse_duration('12-24 شهر'), (30, 518400, 1036800))
+        self.assertEqual(parse_duration('1-3 جلسات'), (30, 30, 90))
+        self.assertEqual(parse_duration(''), (30, 30, 30))
+
+    def test_saving_the_duration_text_updates_the_minutes(self):
+        self.service.duration = '1-2 ساعة'
+        self.service.save(update_fields=['duration'])
+
+        self.service.refresh_from_db()
+        self.assertEqual(
+            (self.service.duration_minutes, self.service.duration_min_minutes, self.service.duration_max_minutes),
+            (90, 60, 120)
+        )
+        self.assertEqual(QueueService.get_service_duration(self.service.id), 90)
+
+
+class ReadThroughCacheTests(QueueTestCase):
+    def test_historical_average_is_cached_until_statistics_change(self):
+        yesterday = self.day - timedelta(days=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            stats = QueueStatistics.objects.create(
+                service=self.service, appointment_date=yesterday, completed_appointments=2, average_wait_minutes=20
+            )
+        self.assertEqual(QueueService.get_historical_average_wait(self.service.id, self.day), 20)
+        with self.assertNumQueries(0):
+            self.assertEqual(QueueService.get_historical_average_wait(self.service.id, self.day), 20)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            stats.average_wait_minutes = 40
+            stats.save()
+        self.assertEqual(QueueService.get_historical_average_wait(self.service.id, self.day), 40)
+
+    def test_service_duration_is_cached_until_the_service_changes(self):
+        self.assertEqual(QueueService.get_service_duration(self.service.id), 30)
+        with self.assertNumQueries(0):
+            self.assertEqual(QueueService.get_service_duration(self.service.id), 30)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.service.duration = '45 دقيقة'
+            self.service.save()
+        self.assertEqual(QueueService.get_service_duration(self.service.id), 45)
+
+    @override_settings(QUEUE_SHARED_CACHE=True)
+    def test_shared_tier_serves_other_processes(self):
+        self.assertEqual(QueueService.get_service_duration(self.service.id), 30)
+        # Another process: empty local tier, same shared cache
+        service_duration_cache._entries.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(QueueService.get_service_duration(self.service.id), 30)
+        self.assertEqual(service_duration_cache.stats()['shared_hits'], 1)
+
+
+class QueueRenumberingTests(QueueTestCase):
+    def numbers(self):
+        return list(
+            Appointment.objects.filter(appointment_date=self.day).exclude(status='cancelled')
+            .order_by('appointment_time', 'id').values_list('booking_id', 'queue_number', 'queue_history__queue_position')
+        )
+
+    def test_cancel_reschedule_and_delete_shift_later_visits(self):
+        first, second, third, fourth = (
+            self.add_appointment(start) for start in (time(9, 0), time(9, 30), time(10, 0), time(10, 30))
+        )
+
+        second.status = 'cancelled'
+        second.save()
+        self.assertEqual(self.numbers(), [
+            (first.booking_id, 1, 1), (third.booking_id, 2, 2), (fourth.booking_id, 3, 3),
+        ])
+
+        fourth.appointment_time = time(8, 30)
+        fourth.save()
+        self.assertEqual(self.numbers(), [
+            (fourth.booking_id, 1, 1), (first.booking_id, 2, 2), (third.booking_id, 3, 3),
+        ])
+
+        first.delete()
+        self.assertEqual(self.numbers(), [(fourth.booking_id, 1, 1), (third.booking_id, 2, 2)])
+
+
+class VisitActionTests(QueueTestCase):
+    def post(self, appointment_id, action, now):
+        with mock.patch('django.utils.timezone.now', return_value=now), self.captureOnCommitCallbacks(execute=True):
+            return APIClient(SERVER_NAME='localhost').post(f'/api/appointments/{appointment_id}/{action}/')
+
+    def test_actions_stamp_the_visit_and_complete_it(self):
+        appointment = self.add_appointment(time(9, 0))
+
+        self.assertEqual(self.post(appointment.id, 'check_in', self.at(8, 55)).status_code, 200)
+        self.assertEqual(self.post(appointment.id, 'start', self.at(9, 10)).data['actual_wait_minutes'], 10)
+        self.assertEqual(self.post(appointment.id, 'finish', self.at(9, 40)).data['service_duration_minutes'], 30)
+
+        history = QueueHistory.objects.get(appointment=appointment)
+        self.assertEqual(
+            (history.check_in_time, history.actual_start_time, history.actual_end_time),
+            (self.at(8, 55), self.at(9, 10), self.at(9, 40))
+        )
+        self.assertEqual(Appointment.objects.get(id=appointment.id).status, 'completed')
+        stats = QueueStatistics.objects.get(service=self.service, appointment_date=self.day)
+        self.assertEqual((stats.completed_appointments, stats.average_wait_minutes), (1, 10))
+
+    def test_out_of_order_actions_are_conflicts(self):
+        appointment = self.add_appointment(time(9, 0))
+
+        self.assertEqual(self.post(appointment.id, 'finish', self.at(9, 0)).status_code, 409)
+        self.assertEqual(self.post(appointment.id, 'start', self.at(9, 0)).status_code, 200)
+        self.assertEqual(self.post(appointment.id, 'start', self.at(9, 5)).status_code, 409)
+        self.assertEqual(self.post(appointment.id, 'check_in', self.at(9, 5)).status_code, 409)
+        self.assertEqual(self.post(appointment.id + 1, 'start', self.at(9, 5)).status_code, 404)
+
+
+class QueueVersionTests(ClinicTestCase):
+    def test_bump_increments_the_day_and_all_days_once(self):
+        day = date(2099, 1, 5)
+        other_day = date(2099, 1, 6)
+        before = QueueVersion.get(day), QueueVersion.get(), QueueVersion.get(other_day)
+
+        QueueVersion.bump(day)
+        QueueVersion.bump(day, day)
+
+        self.assertEqual(
+            (QueueVersion.get(day), QueueVersion.get(), QueueVersion.get(other_day)),
+            (before[0] + 2, before[1] + 2, before[2])
+        )
+
+    def test_bump_seeds_a_day_without_a_version(self):
+        day = date(2099, 1, 7)
+        QueueVersion.bump(day)
+        version = QueueVersion.get(day)
+        QueueVersion.bump(day)
+        self.assertEqual(QueueVersion.get(day), version + 1)
+
+
+class DayQueueIndexTests(QueueTestCase):
+    def test_snapshot_is_reused_while_the_day_version_is_unchanged(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_appointment(time(9, 0))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(day_queue_index.count_before(self.day, time(10, 0)), 1)
+        # Only the version read
+        with self.assertNumQueries(1):
+            self.assertEqual(day_queue_index.count_before(self.day, time(10, 0)), 1)
+
+    def test_write_from_another_process_rebuilds_the_snapshot(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_appointment(time(9, 0))
+            self.assertEqual(day_queue_index.count_before(self.day, time(10, 0)), 1)
+        # bulk_create skips the signals, like a write this process never saw; only the day version moves
+        Appointment.objects.bulk_create([Appointment(
+            patient=self.patient, service=self.service, appointment_date=self.day,
+            appointment_time=time(9, 30), booking_id='BK-20990105-9999', queue_number=2,
+        )])
+        QueueVersion.bump(self.day)
+        self.assertEqual(day_queue_index.count_before(self.day, time(10, 0)), 2)
+
+    def test_snapshot_of_a_rolled_back_transaction_is_not_kept(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_appointment(time(9, 0))
+        with self.assertRaises(DatabaseError), transaction.atomic():
+            self.add_appointment(time(9, 30))
+            self.assertEqual(day_queue_index.count_before(self.day, time(9, 40)), 2)
+            raise DatabaseError('rolled back')
+        # The next write moves the day to the version the rolled-back transaction had seen
+        Appointment.objects.bulk_create([Appointment(
+            patient=self.patient, service=self.service, appointment_date=self.day,
+            appointment_time=time(9, 45), booking_id='BK-20990105-9999', queue_number=2,
+        )])
+        QueueVersion.bump(self.day, all_days=False)
+        self.assertEqual(day_queue_index.count_before(self.day, time(9, 40)), 1)
+
+
+class WaitTimePredictorTests(QueueTestCase):
+    @override_settings(WAIT_MODEL_WITH_CHAIRS=True)
+    def test_training_and_inference_share_the_queue_depth(self):
+        other = Service.objects.create(name='Whitening', description='-', price_min=0, price_max=0, duration='30 دقيقة')
+        chair_2, chair_3 = Chair.objects.create(name='Chair 2'), Chair.objects.create(name='Chair 3')
+        with self.captureOnCommitCallbacks(execute=True):
+            first = self.add_appointment(time(9, 0), status='completed')
+            self.add_appointment(time(9, 0), service=other, chair=chair_2)
+            same_time = self.add_appointment(time(9, 0), chair=chair_3)
+            self.add_appointment(time(9, 30), status='cancelled')
+            last = self.add_appointment(time(10, 0), status='completed')
+        QueueHistory.objects.filter(appointment__in=[first, last]).update(actual_wait_minutes=5)
+
+        # Depth = active visits of the same service earlier in (time, id) order
+        training = {row[7]: row[3] for row in WaitTimePredictor.training_rows()}
+        self.assertEqual(training, {time(9, 0): 0, time(10, 0): 2})
+
+        depth_only = WaitTimePredictor.from_coefficients(['queue_depth'], [1.0])
+        with mock.patch('clinic.queue_service.wait_time_predictor', depth_only):
+            day = QueueService.estimate_day(self.day, save=False)
+            single = {
+                appointment.id: QueueService.estimate_wait_time(
+                    self.day, appointment.appointment_time, self.service.id, appointment_id=appointment.id
+                )
+                for appointment in (first, same_time, last)
+            }
+        self.assertEqual(single, {first.id: 0, same_time.id: 1, last.id: 2})
+        self.assertEqual({appointment_id: day[appointment_id] for appointment_id in single}, single)
+
+    def test_chair_simulation_wins_over_the_model_when_chairs_are_configured(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_appointment(time(9, 0))
+            second = self.add_appointment(time(9, 15))
+        simulated = QueueService.estimate_wait_time(self.day, time(9, 15), self.service.id, appointment_id=second.id)
+        open_slot = QueueService.estimate_open_slots(self.day, [time(9, 15)], self.service.id)
+        self.assertGreater(simulated, 0)
+
+        flat = WaitTimePredictor.from_coefficients(['bias'], [999.0])
+        with mock.patch('clinic.queue_service.wait_time_predictor', flat):
+            self.assertEqual(
+                QueueService.estimate_wait_time(self.day, time(9, 15), self.service.id, appointment_id=second.id),
+                simulated
+            )
+            self.assertEqual(QueueService.estimate_day(self.day, save=False)[second.id], simulated)
+            self.assertEqual(QueueService.estimate_open_slots(self.day, [time(9, 15)], self.service.id), open_slot)
+            with self.settings(WAIT_MODEL_WITH_CHAIRS=True):
+                self.assertEqual(
+                    QueueService.estimate_wait_time(self.day, time(9, 15), self.service.id, appointment_id=second.id),
+                    999
+                )
+
+    def test_failed_load_is_retried_after_a_delay(self):
+        WaitTimeModel.objects.create(feature_names=['bias'], coefficients=[10.0])
+        predictor = WaitTimePredictor()
+        with mock.patch.object(WaitTimeModel.objects, 'only', side_effect=DatabaseError('down')):
+            self.assertFalse(predictor.is_available())
+
+        self.assertFalse(predictor.is_available())
+        predictor._failed_at -= WaitTimePredictor.RETRY_SECONDS
+        self.assertTrue(predictor.is_available())
+
+
+class QueuePositionTests(QueueTestCase):
+    def test_counts_only_visits_still_waiting(self):
+        chair_2 = Chair.objects.create(name='Chair 2')
+        self.add_appointment(time(8, 30), status='completed')
+        started = self.add_appointment(time(9, 0))
+        QueueHistory.objects.filter(appointment=started).update(actual_start_time=self.at(9, 5))
+        self.add_appointment(time(9, 15), status='cancelled')
+        waiting = self.add_appointment(time(9, 30))
+        same_time = self.add_appointment(time(9, 30), chair=chair_2)
+
+        first = QueueService.get_queue_position(waiting.booking_id)
+        second = QueueService.get_queue_position(same_time.booking_id)
+
+        self.assertEqual((first['position'], first['people_ahead'], first['next_position']), (1, 0, 2))
+        self.assertEqual((second['position'], second['people_ahead'], second['next_position']), (2, 1, None))
+        self.assertIsNone(QueueService.get_queue_position(started.booking_id)['position'])
+
+
+    def test_position_comes_from_the_day_snapshot_until_the_queue_moves(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            first = self.add_appointment(time(9, 0))
+            second = self.add_appointment(time(9, 30))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(QueueService.get_queue_position(second.booking_id)['position'], 2)
+        # The booking and the day version, no day-wide count
+        with self.assertNumQueries(2):
+            self.assertEqual(QueueService.get_queue_position(second.booking_id)['people_ahead'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            QueueService.start_visit(first.id)
+
+        position = QueueService.get_queue_position(second.booking_id)
+        self.assertEqual((position['position'], position['people_ahead']), (1, 0))
+
+
+class AppointmentBookedJobTests(QueueTestCase):
+    def test_estimate_counts_bookings_made_by_another_process(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_appointment(time(9, 0))
+            # The worker has already loaded the day
+            self.assertEqual(day_queue_index.count_before(self.day, time(10, 0)), 1)
+        # Booked by a web process: the worker only sees the day version move
+        Appointment.objects.bulk_create([Appointment(
+            patient=self.patient, service=self.service, chair=self.chair, appointment_date=self.day,
+            appointment_time=time(9, 30), booking_id='BK-20990105-9999', queue_number=2,
+        )])
+        QueueVersion.bump(self.day)
+        with self.captureOnCommitCallbacks(execute=True):
+            booked = Appointment.objects.create(
+                patient=self.patient, service=self.service, chair=self.chair, appointment_date=self.day,
+                appointment_time=time(9, 45)
+            )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            appointment_booked(booked.id)
+
+        history = QueueHistory.objects.get(appointment=booked)
+        self.assertEqual(history.queue_position, 3)
+        # The chair frees at 10:10, after the 9:00 and 9:30 visits and their buffers
+        self.assertEqual(history.estimated_wait_minutes, 25)
+
+
+class EstimateDayTests(QueueTestCase):
+    def add_day(self):
+        other = Service.objects.create(name='Whitening', description='-', price_min=0, price_max=0, duration='45 دقيقة')
+        QueueStatistics.objects.create(
+            service=self.service, appointment_date=self.day - timedelta(days=1),
+            completed_appointments=3, average_wait_minutes=20
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            return [
+                self.add_appointment(time(9, 0)),
+                self.add_appointment(time(11, 30), service=other),
+                self.add_appointment(time(12, 0)),
+                self.add_appointment(time(12, 30)),
+                self.add_appointment(time(13, 0), service=other, status='completed'),
+            ]
+
+    def assertMatchesSingleEstimates(self, appointments):
+        day = QueueService.estimate_day(self.day, save=False)
+        single = {
+            appointment.id: QueueService.estimate_wait_time(
+                self.day, appointment.appointment_time, appointment.service_id,
+                use_model=False, appointment_id=appointment.id
+            )
+            for appointment in appointments
+        }
+        self.assertEqual(day, single)
+        return day
+
+    def test_queue_depth_estimates_match_single_estimates(self):
+        self.chair.delete()
+        self.chair = None
+        appointments = self.add_day()
+        day = self.assertMatchesSingleEstimates(appointments)
+        # 12:00-14:00 is a peak hour (x1.5); the checkup blends in its 20-minute historical average
+        self.assertEqual([day[appointment.id] for appointment in appointments], [5, 0, 44, 83, 75])
+
+    def test_chair_simulation_estimates_match_single_estimates(self):
+        self.assertMatchesSingleEstimates(self.add_day())
+
+    def test_open_slot_estimates_match_single_estimates(self):
+        self.add_day()
+        slots = [time(9, 0), time(10, 0), time(12, 0), time(15, 0)]
+        for chair_pool in (True, False):
+            if not chair_pool:
+                Chair.objects.update(is_active=False)
+                chair_pool_cache.invalidate()
+            single = [
+                QueueService.estimate_wait_time(self.day, slot, self.service.id, booked=False) for slot in slots
+            ]
+            self.assertEqual(QueueService.estimate_open_slots(self.day, slots, self.service.id), single)
+            self.assertEqual(QueueService.estimate_open_slots(self.day, slots), [
+                QueueService.estimate_wait_time(self.day, slot, None, booked=False) for slot in slots
+            ])
@@ -0,0 +1,53 @@
+import asyncio
+from datetime import date
+from clinic.models import QueueDayVersion
+from clinic.queue_events import QueueBroadcaster
+from .base import ClinicTestCase
+
+DAY = date(2099, 1, 6)
+
+
+class QueueRelayTests(ClinicTestCase):
+    """Local events carry the day version; version changes from other processes reach this process's subscribers"""
+
+    def setUp(self):
+        super().setUp()
+        self.broadcaster = QueueBroadcaster()
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.queue = asyncio.Queue()
+        # registered directly: subscribe() would start the relay thread
+        self.broadcaster._subscribers.add((self.loop, self.queue, DAY))
+
+    def received(self) -> list:
+        self.loop.run_until_complete(asyncio.sleep(0))
+        messages = []
+        while not self.queue.empty():
+            messages.append(self.queue.get_nowait())
+        return messages
+
+    def test_publishes_the_bumped_version_without_queries(self):
+        QueueDayVersion.objects.create(key=str(DAY), version=7)
+        with self.assertNumQueries(0):
+            self.broadcaster.publish(DAY, 'FS-1', 'position', {'estimated_wait_minutes': 15}, 8)
+        QueueDayVersion.objects.filter(key=str(DAY)).update(version=8)
+
+        # The relay does not announce a version this process has already published
+        self.broadcaster._relay_versions({DAY})
+
+        self.assertEqual(
+            self.received(),
+            [{'event': 'position', 'booking_id': 'FS-1', 'estimated_wait_minutes': 15, 'version': 8}],
+        )
+
+    def test_announces_version_changes_without_an_event(self):
+        QueueDayVersion.objects.create(key=str(DAY), version=7)
+        self.broadcaster._relay_versions({DAY})
+        self.broadcaster._relay_versions({DAY})
+        self.assertEqual(self.received(), [])
+
+        QueueDayVersion.objects.filter(key=str(DAY)).update(version=9)
+        self.broadcaster._relay_versions({DAY})
+        self.broadcaster._relay_versions({DAY})
+
+        self.assertEqual(self.received(), [{'event': 'version', 'booking_id': None, 'version': 9}])
@@ -12,8 +12,9 @@ from .views import (
     AppointmentNotificationViewSet,
     QueueStatisticsViewSet,
     QueueHistoryViewSet,
+    queue_stream,
 )
-from .views_admin import admin_login, check_admin_exists, create_admin, admin_init
+from .views_admin import admin_login, check_admin_exists, create_admin, admin_init, import_appointments
 
 router = DefaultRouter()
 router.register(r'services', ServiceViewSet, basename='service')
@@ -33,5 +34,7 @@ urlpatterns = [
     path('admin/login/', admin_login, name='admin-login'),
     path('admin/check/', check_admin_exists, name='check-admin-exists'),
     path('admin/create/', create_admin, name='create-admin'),
+    path('admin/import-appointments/', import_appointments, name='import-appointments'),
+    path('queue-history/stream/', queue_stream, name='queue-stream'),
     path('', include(router.urls)),
 ]
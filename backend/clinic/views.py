@@ -1,18 +1,26 @@
+import hashlib
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter, OrderingFilter
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.http import parse_etags, quote_etag
 from django.contrib.auth.models import User
+from .booking import SLOT_UNAVAILABLE_CODE, BookingAllocator, SeriesConflict, SlotUnavailable, format_slots, slot_availability
+from .idempotency import IdempotentCreateMixin
+from .queue_events import stream_queue_events
+from .queue_service import QueueService, QueueTransitionError, QueueVersion
 from .pdf_reports import generate_appointment_report_pdf, generate_patient_report_pdf
-from .models import Service, Patient, Appointment, Testimonial, BlogPost, ContactMessage, BeforeAfterGallery, AppointmentNotification, QueueStatistics, QueueHistory
+from .models import normalize_phone, Service, Patient, Appointment, Testimonial, BlogPost, ContactMessage, BeforeAfterGallery, AppointmentNotification, QueueStatistics, QueueHistory
 from .serializers import (
     ServiceSerializer, 
     PatientSerializer, 
     AppointmentSerializer,
     AppointmentCreateSerializer,
+    AppointmentSeriesSerializer,
     TestimonialSerializer, 
     BlogPostSerializer, 
     ContactMessageSerializer,
@@ -23,6 +31,23 @@ from .serializers import (
 )
 
 
+def queue_version_response(request, etag_parts, build_response):
+    """
+    Answer a queue poll with 304 when the client's ETag matches the current
+    queue version; otherwise build the response and tag it.
+    """
+    path_hash = hashlib.md5(request.get_full_path().encode()).hexdigest()[:8]
+    etag = quote_etag(':'.join(str(part) for part in etag_parts + [path_hash]))
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match and (etag in parse_etags(if_none_match) or if_none_match.strip() == '*'):
+        response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        response = build_response()
+    response['ETag'] = etag
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
 class ServiceViewSet(viewsets.ModelViewSet):
     """API endpoint for services"""
     queryset = Service.objects.filter(is_active=True)
@@ -37,8 +62,16 @@ class PatientViewSet(viewsets.ModelViewSet):
     queryset = Patient.objects.all()
     serializer_class = PatientSerializer
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
-    search_fields = ['full_name', 'phone', 'email']
+    search_fields = ['full_name', 'phone', 'phone_normalized', 'email']
     ordering_fields = ['full_name', 'created_at']
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        # ?phone= matches any spelling of the number through the unique normalized index
+        phone = self.request.query_params.get('phone')
+        if phone:
+            queryset = queryset.filter(phone_normalized=normalize_phone(phone))
+        return queryset
     
     @action(detail=True, methods=['get'])
     def download_pdf(self, request, pk=None):
@@ -51,20 +84,65 @@ class PatientViewSet(viewsets.ModelViewSet):
         return Response({"error": "Patient not found"}, status=404)
 
 
-class AppointmentViewSet(viewsets.ModelViewSet):
-    """API endpoint for appointments"""
+class AppointmentViewSet(IdempotentCreateMixin, viewsets.ModelViewSet):
+    """API endpoint for appointments (create honours the Idempotency-Key header)"""
     queryset = Appointment.objects.all()
     serializer_class = AppointmentSerializer
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     filterset_fields = ['status', 'appointment_date']
     search_fields = ['patient__full_name', 'service__name']
     ordering_fields = ['appointment_date', 'appointment_time', 'created_at']
+    MAX_AVAILABILITY_DAYS = 31
 
     def get_serializer_class(self):
         if self.action == 'create':
             return AppointmentCreateSerializer
         return AppointmentSerializer
 
+    def create(self, request, *args, **kwargs):
+        """Book an appointment; 409 with alternative slots if the time is already taken"""
+        try:
+            return super().create(request, *args, **kwargs)
+        except SlotUnavailable as e:
+            # Found under the day lock
+            alternatives = format_slots(e.alternatives)
+        except ValidationError as e:
+            # Found by the serializer's overlap pre-check; other validation errors stay 400
+            codes = e.get_codes()
+            if not isinstance(codes, dict) or codes.get('appointment_time') != [SLOT_UNAVAILABLE_CODE]:
+                raise
+            alternatives = e.detail['alternatives']
+        return Response({
+            "error": "This time slot is already booked",
+            "alternatives": alternatives
+        }, status=status.HTTP_409_CONFLICT)
+
+    @action(detail=False, methods=['post'])
+    def series(self, request):
+        """Book a recurring series (e.g. monthly orthodontic visits).
+
+        Dates already taken on every eligible chair are skipped (listed in `skipped`),
+        or with `skip_conflicts: false` the whole series is refused with 409.
+        """
+        serializer = AppointmentSeriesSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            appointments, skipped = serializer.save()
+        except SeriesConflict as e:
+            return Response({
+                "error": "Some dates in this series are already booked",
+                "conflicts": [day.isoformat() for day in e.conflicts]
+            }, status=status.HTTP_409_CONFLICT)
+        if not appointments:
+            return Response({
+                "error": "No date in this series is available",
+                "conflicts": [day.isoformat() for day in skipped]
+            }, status=status.HTTP_409_CONFLICT)
+        return Response({
+            "appointments": AppointmentSerializer(appointments, many=True).data,
+            "skipped": [day.isoformat() for day in skipped]
+        }, status=status.HTTP_201_CREATED)
+
     @action(detail=True, methods=['post'])
     def confirm(self, request, pk=None):
         """Confirm an appointment"""
@@ -92,13 +170,80 @@ class AppointmentViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(appointment)
         return Response(serializer.data)
 
+    def _visit_transition(self, transition, pk):
+        try:
+            return Response(transition(int(pk)))
+        except (Appointment.DoesNotExist, ValueError):
+            return Response({"error": "Appointment not found"}, status=404)
+        except QueueTransitionError as e:
+            return Response({"error": str(e)}, status=status.HTTP_409_CONFLICT)
+
+    @action(detail=True, methods=['post'])
+    def check_in(self, request, pk=None):
+        """Patient arrived: confirm the appointment and stamp the check-in time"""
+        return self._visit_transition(QueueService.check_in, pk)
+
+    @action(detail=True, methods=['post'])
+    def start(self, request, pk=None):
+        """Visit started: stamp actual_start_time and the actual wait"""
+        return self._visit_transition(QueueService.start_visit, pk)
+
+    @action(detail=True, methods=['post'])
+    def finish(self, request, pk=None):
+        """Visit finished: stamp actual_end_time, complete the appointment and update statistics"""
+        return self._visit_transition(QueueService.finish_visit, pk)
+
     @action(detail=False, methods=['get'])
     def today(self, request):
         """Get today's appointments"""
         from datetime import date
-        today_appointments = self.queryset.filter(appointment_date=date.today())
-        serializer = self.get_serializer(today_appointments, many=True)
-        return Response(serializer.data)
+        today = date.today()
+
+        def build_response():
+            today_appointments = self.queryset.filter(appointment_date=today)
+            serializer = self.get_serializer(today_appointments, many=True)
+            return Response(serializer.data)
+
+        return queue_version_response(request, [today, QueueVersion.get(today)], build_response)
+
+    @action(detail=False, methods=['get'])
+    def availability(self, request):
+        """Free booking slots between `from` and `to` (default: 7 days from today), with estimated waits.
+
+        With `service`, slots that would overlap another appointment for the service's duration are left out.
+        """
+        from datetime import date, timedelta
+        from django.utils import timezone
+
+        service_id = request.query_params.get('service')
+        try:
+            start = date.fromisoformat(request.query_params['from']) if request.query_params.get('from') else timezone.localdate()
+            end = date.fromisoformat(request.query_params['to']) if request.query_params.get('to') else start + timedelta(days=6)
+            service_id = int(service_id) if service_id else None
+        except ValueError:
+            return Response({"error": "Invalid parameters, expected from/to as YYYY-MM-DD and a numeric service"}, status=400)
+        if end < start or (end - start).days >= self.MAX_AVAILABILITY_DAYS:
+            return Response({"error": f"Date range must be 1 to {self.MAX_AVAILABILITY_DAYS} days"}, status=400)
+        duration = None
+        if service_id:
+            duration = Service.objects.filter(id=service_id).values_list('duration_minutes', flat=True).first()
+            if duration is None:
+                return Response({"error": "Service not found"}, status=404)
+
+        chair_ids = BookingAllocator.chairs_for(service_id)
+        days = []
+        for day, chairs in slot_availability.bitmaps(start, end).items():
+            slots = BookingAllocator.open_slots(day, chairs, chair_ids, duration)
+            # One day snapshot for every slot's estimate
+            estimates = QueueService.estimate_open_slots(day, slots, service_id)
+            days.append({
+                "date": day,
+                "slots": [
+                    {"time": slot.strftime('%H:%M'), "estimated_wait_minutes": wait}
+                    for slot, wait in zip(slots, estimates)
+                ],
+            })
+        return Response({"service": service_id, "from": start, "to": end, "days": days})
     
     @action(detail=True, methods=['get'])
     def download_pdf(self, request, pk=None):
@@ -129,8 +274,8 @@ class BlogPostViewSet(viewsets.ModelViewSet):
     ordering_fields = ['created_at']
 
 
-class ContactMessageViewSet(viewsets.ModelViewSet):
-    """API endpoint for contact messages"""
+class ContactMessageViewSet(IdempotentCreateMixin, viewsets.ModelViewSet):
+    """API endpoint for contact messages (create honours the Idempotency-Key header)"""
     queryset = ContactMessage.objects.all()
     serializer_class = ContactMessageSerializer
     filter_backends = [DjangoFilterBackend, OrderingFilter]
@@ -245,6 +390,11 @@ class QueueStatisticsViewSet(viewsets.ReadOnlyModelViewSet):
         serializer = self.get_serializer(stats, many=True)
         return Response(serializer.data)
     
+    @action(detail=False, methods=['get'])
+    def cache_stats(self, request):
+        """Hit/miss counters of this worker's queue caches"""
+        return Response(QueueService.cache_stats())
+
     @action(detail=False, methods=['get'])
     def service_stats(self, request):
         """Get average statistics for a specific service"""
@@ -294,12 +444,23 @@ class QueueHistoryViewSet(viewsets.ReadOnlyModelViewSet):
         today_start = datetime.combine(today, datetime.min.time())
         today_end = datetime.combine(today, datetime.max.time())
         
-        queue_history = QueueHistory.objects.filter(
-            scheduled_start_time__range=[today_start, today_end]
-        )
-        serializer = self.get_serializer(queue_history, many=True)
-        return Response(serializer.data)
+        def build_response():
+            queue_history = QueueHistory.objects.filter(
+                scheduled_start_time__range=[today_start, today_end]
+            )
+            serializer = self.get_serializer(queue_history, many=True)
+            return Response(serializer.data)
+
+        return queue_version_response(request, [today, QueueVersion.get(today)], build_response)
     
+    @action(detail=False, methods=['get'], url_path=r'position/(?P<booking_id>[^/]+)')
+    def position(self, request, booking_id=None):
+        """Get a single booking's live queue position - GET /api/queue-history/position/<booking_id>/"""
+        position = QueueService.get_queue_position(booking_id)
+        if position is None:
+            return Response({"error": "Booking not found"}, status=404)
+        return Response(position)
+
     @action(detail=False, methods=['get'])
     def current_queue(self, request):
         """Get current queue status (appointments waiting or being served)"""
@@ -307,12 +468,46 @@ class QueueHistoryViewSet(viewsets.ReadOnlyModelViewSet):
         from django.db.models import Q
         
         now = timezone.now()
-        
-        queue_history = QueueHistory.objects.filter(
-            Q(actual_start_time__isnull=True, scheduled_start_time__lte=now) |
-            Q(actual_start_time__isnull=False, actual_end_time__isnull=True),
-            appointment__status__in=['pending', 'confirmed', 'completed']
-        ).order_by('queue_position')
-        
-        serializer = self.get_serializer(queue_history, many=True)
-        return Response(serializer.data)
+        local_now = timezone.localtime(now)
+        # The queue also changes as scheduled times pass, so tag with how many
+        # of today's appointments are already due (answered from the day index).
+        due_today = QueueService.count_appointments_before(local_now.date(), local_now.time(), inclusive=True)
+
+        def build_response():
+            queue_history = QueueHistory.objects.filter(
+                Q(actual_start_time__isnull=True, scheduled_start_time__lte=now) |
+                Q(actual_start_time__isnull=False, actual_end_time__isnull=True),
+                appointment__status__in=['pending', 'confirmed', 'completed']
+            ).order_by('queue_position')
+
+            serializer = self.get_serializer(queue_history, many=True)
+            return Response(serializer.data)
+
+        return queue_version_response(request, [QueueVersion.get(), due_today], build_response)
+
+
+async def queue_stream(request):
+    """
+    Server-Sent Events stream of live queue deltas for a day.
+    GET /api/queue-history/stream/?date=YYYY-MM-DD (defaults to today)
+
+    Requires the ASGI app (future_smile/asgi.py) so idle watchers do not hold a worker thread.
+    """
+    from datetime import date as date_type
+    from django.utils import timezone
+
+    appointment_date = timezone.localdate()
+    date_param = request.GET.get('date')
+    if date_param:
+        try:
+            appointment_date = date_type.fromisoformat(date_param)
+        except ValueError:
+            return HttpResponse('Invalid date', status=400)
+
+    response = StreamingHttpResponse(
+        stream_queue_events(appointment_date),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -1,8 +1,13 @@
+import io
 from django.contrib.auth import authenticate, login
-from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import AllowAny
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.decorators import api_view, authentication_classes, parser_classes, permission_classes
+from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import AllowAny, IsAdminUser
 from rest_framework.response import Response
+from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework_simplejwt.tokens import RefreshToken
+from .importer import AppointmentImporter
 from django.contrib.auth.models import User
 from django.views.decorators.http import require_http_methods
 import logging
@@ -184,3 +189,38 @@ def create_admin(request):
             'error': str(e),
             'message': 'Failed to create admin user'
         }, status=400)
+
+
+@api_view(['POST'])
+@authentication_classes([JWTAuthentication, SessionAuthentication])
+@permission_classes([IsAdminUser])
+@parser_classes([MultiPartParser])
+def import_appointments(request):
+    """
+    Bulk-import appointments from an uploaded CSV or NDJSON file
+
+    Multipart fields:
+        file: the CSV/NDJSON file (columns: patient_name, patient_phone, patient_email,
+              service, appointment_date, appointment_time, status, notes)
+        format: "csv" or "ndjson" (optional, guessed from the file name)
+        dry_run: "true" to validate without saving (optional)
+    """
+    upload = request.FILES.get('file')
+    if upload is None:
+        return Response({'error': 'A file is required'}, status=400)
+
+    file_format = request.data.get('format') or AppointmentImporter.detect_format(upload.name)
+    if file_format not in AppointmentImporter.FORMATS:
+        return Response({'error': f'Unsupported format: {file_format}'}, status=400)
+
+    importer = AppointmentImporter(dry_run=str(request.data.get('dry_run', '')).lower() in ('1', 'true', 'yes'))
+    stream = io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+    try:
+        summary = importer.run(stream, file_format)
+    except UnicodeDecodeError:
+        return Response({'error': 'The file must be UTF-8 encoded'}, status=400)
+    finally:
+        stream.detach()
+
+    logger.info(f"Imported {summary['imported']} appointments ({summary['rows_per_second']} rows/s)")
+    return Response(summary, status=200)
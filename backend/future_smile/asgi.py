@@ -1,5 +1,8 @@
 """
 ASGI config for future_smile project.
+
+Served by gunicorn with uvicorn workers so the live queue stream
+(/api/queue-history/stream/) can hold many idle connections cheaply.
 """
 
 import os
@@ -4,6 +4,7 @@ Django settings for future_smile project.
 
 from pathlib import Path
 import os
+import tempfile
 from decouple import config
 import dj_database_url
 
@@ -87,6 +88,30 @@ else:
         }
     }
 
+# Cache - shared between workers on the same host (queue versions / ETags)
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': config('CACHE_LOCATION', default=os.path.join(tempfile.gettempdir(), 'future_smile_cache')),
+    }
+}
+
+# Back QueueService's per-process caches with the shared cache above
+QUEUE_SHARED_CACHE = config('QUEUE_SHARED_CACHE', default=False, cast=bool)
+
+# Estimate waits with the trained model even when chairs are configured; by default the multi-chair
+# simulation wins there, since the model has no chair features (without chairs the model always wins)
+WAIT_MODEL_WITH_CHAIRS = config('WAIT_MODEL_WITH_CHAIRS', default=False, cast=bool)
+
+# Booking IDs reserved per database round trip by each worker process (gaps on restart are fine)
+BOOKING_ID_BLOCK_SIZE = config('BOOKING_ID_BLOCK_SIZE', default=1, cast=int)
+
+# How long a response stored under an Idempotency-Key is replayed (seconds)
+IDEMPOTENCY_KEY_TTL = config('IDEMPOTENCY_KEY_TTL', default=24 * 3600, cast=int)
+# How long a request that never finished (crashed process) keeps its key before a retry may take it over
+# (seconds); keep it above the longest request time
+IDEMPOTENCY_IN_PROGRESS_TIMEOUT = config('IDEMPOTENCY_IN_PROGRESS_TIMEOUT', default=60, cast=int)
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -167,6 +192,7 @@ CORS_ALLOW_HEADERS = [
     'authorization',
     'content-type',
     'dnt',
+    'idempotency-key',
     'origin',
     'user-agent',
     'x-csrftoken',
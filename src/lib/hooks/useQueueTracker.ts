@@ -13,6 +13,15 @@ interface QueueItem {
   actual_start_time: string | null;
 }
 
+interface QueueEvent {
+  event: string;
+  booking_id: string | null;
+  version?: number | null;
+  queue_position?: number;
+  estimated_wait_minutes?: number;
+  status?: string;
+}
+
 interface QueueTrackerData {
   items: QueueItem[];
   currentUserPosition: number | null;
@@ -22,19 +31,95 @@ interface QueueTrackerData {
   nextUserName: string | null;
 }
 
+// حساب موضع المستخدم والموعد التالي من قائمة الطابور
+const summarize = (
+  items: QueueItem[],
+  bookingId?: string
+): QueueTrackerData => {
+  let userPosition = null;
+  let userWaitTime = null;
+  let nextPosition = null;
+  let nextName = null;
+
+  if (bookingId && items.length > 0) {
+    const userItem = items.find((item) => item.booking_id === bookingId);
+    if (userItem) {
+      userPosition = userItem.queue_position;
+      userWaitTime = userItem.estimated_wait_minutes;
+
+      // البحث عن الموعد التالي
+      const nextItem = items.find(
+        (item) => item.queue_position === userPosition! + 1
+      );
+      if (nextItem) {
+        nextPosition = nextItem.queue_position;
+        nextName = nextItem.patient_name;
+      }
+    }
+  }
+
+  return {
+    items,
+    currentUserPosition: userPosition,
+    currentUserWaitTime: userWaitTime,
+    totalInQueue: items.length,
+    nextUserPosition: nextPosition,
+    nextUserName: nextName,
+  };
+};
+
+// تطبيق حدث على القائمة المحلية؛ null إذا لم يكن الحجز فيها ويلزم جلب الطابور
+const applyEvent = (
+  items: QueueItem[],
+  message: QueueEvent
+): QueueItem[] | null => {
+  const index = items.findIndex(
+    (item) => item.booking_id === message.booking_id
+  );
+  if (message.event === "completed" || message.event === "removed") {
+    return index === -1 ? items : items.filter((_, i) => i !== index);
+  }
+  if (index === -1) {
+    return null;
+  }
+
+  const item = { ...items[index] };
+  if (message.queue_position !== undefined) {
+    item.queue_position = message.queue_position;
+  }
+  if (message.estimated_wait_minutes !== undefined) {
+    item.estimated_wait_minutes = message.estimated_wait_minutes;
+  }
+  if (message.status !== undefined) {
+    item.appointment_status = message.status;
+  }
+  if (message.event === "started" && !item.actual_start_time) {
+    item.actual_start_time = new Date().toISOString();
+  }
+
+  const next = [...items];
+  next[index] = item;
+  return next.sort((a, b) => a.queue_position - b.queue_position);
+};
+
+// مهلة قبل جلب الطابور عند حدث version، لتجميع التغييرات المتتالية (استيراد عدة أيام) في جلب واحد
+const VERSION_GAP_DELAY_MS = 1500;
+
+// مهلة قبل إعادة فتح SSE بعد انقطاعه (مع التحديث الدوري خلالها)
+const RECONNECT_DELAY_MS = 30000;
+
 export const useQueueTracker = (bookingId?: string) => {
-  const [data, setData] = useState<QueueTrackerData>({
-    items: [],
-    currentUserPosition: null,
-    currentUserWaitTime: null,
-    totalInQueue: 0,
-    nextUserPosition: null,
-    nextUserName: null,
-  });
+  const [data, setData] = useState<QueueTrackerData>(() => summarize([]));
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState<string | null>(null);
   const [lastUpdated, setLastUpdated] = useState<Date>(new Date());
   const intervalRef = useRef<NodeJS.Timeout | null>(null);
+  const eventSourceRef = useRef<EventSource | null>(null);
+  const itemsRef = useRef<QueueItem[]>([]);
+  const versionRef = useRef(0);
+  const gapTimerRef = useRef<NodeJS.Timeout | null>(null);
+  const reconnectTimerRef = useRef<NodeJS.Timeout | null>(null);
+  const connectRef = useRef<() => void>(() => {});
 
   const fetchQueueData = useCallback(async () => {
     try {
@@ -55,44 +140,12 @@ export const useQueueTracker = (bookingId?: string) => {
       }
 
       const responseData = await response.json();
-      const items = Array.isArray(responseData)
+      const items: QueueItem[] = Array.isArray(responseData)
         ? responseData
         : responseData.results || [];
 
-      // البحث عن موضع المستخدم الحالي
-      let userPosition = null;
-      let userWaitTime = null;
-      let nextPosition = null;
-      let nextName = null;
-
-      if (bookingId && items.length > 0) {
-        const userItem = items.find(
-          (item: QueueItem) => item.booking_id === bookingId
-        );
-        if (userItem) {
-          userPosition = userItem.queue_position;
-          userWaitTime = userItem.estimated_wait_minutes;
-
-          // البحث عن الموعد التالي
-          const nextItem = items.find(
-            (item: QueueItem) => item.queue_position === userPosition! + 1
-          );
-          if (nextItem) {
-            nextPosition = nextItem.queue_position;
-            nextName = nextItem.patient_name;
-          }
-        }
-      }
-
-      setData({
-        items,
-        currentUserPosition: userPosition,
-        currentUserWaitTime: userWaitTime,
-        totalInQueue: items.length,
-        nextUserPosition: nextPosition,
-        nextUserName: nextName,
-      });
-
+      itemsRef.current = items;
+      setData(summarize(items, bookingId));
       setLastUpdated(new Date());
       setError(null);
     } catch (err) {
@@ -103,21 +156,129 @@ export const useQueueTracker = (bookingId?: string) => {
     }
   }, [bookingId]);
 
-  // جلب البيانات في البداية
-  useEffect(() => {
-    fetchQueueData();
+  // جلب الطابور مرة واحدة بعد مهلة (يُلغى إذا أُعيد الاتصال وجُلب الطابور كاملاً)
+  const scheduleRefetch = useCallback(() => {
+    if (!gapTimerRef.current) {
+      gapTimerRef.current = setTimeout(() => {
+        gapTimerRef.current = null;
+        fetchQueueData();
+      }, VERSION_GAP_DELAY_MS);
+    }
   }, [fetchQueueData]);
 
-  // تحديث تلقائي كل 5 ثوان
-  useEffect(() => {
-    intervalRef.current = setInterval(fetchQueueData, 5000);
+  const cancelRefetch = useCallback(() => {
+    if (gapTimerRef.current) {
+      clearTimeout(gapTimerRef.current);
+      gapTimerRef.current = null;
+    }
+  }, []);
 
-    return () => {
-      if (intervalRef.current) {
-        clearInterval(intervalRef.current);
+  // الرجوع للتحديث كل 5 ثوان عند عدم توفر SSE أو انقطاعه
+  const startPolling = useCallback(() => {
+    if (!intervalRef.current) {
+      fetchQueueData();
+      intervalRef.current = setInterval(fetchQueueData, 5000);
+    }
+  }, [fetchQueueData]);
+
+  const stopPolling = useCallback(() => {
+    if (intervalRef.current) {
+      clearInterval(intervalRef.current);
+      intervalRef.current = null;
+    }
+  }, []);
+
+  const connect = useCallback(() => {
+    if (typeof window === "undefined" || !("EventSource" in window)) {
+      startPolling();
+      return;
+    }
+
+    const apiBase =
+      process.env.NEXT_PUBLIC_API_URL ||
+      "https://future-smile-clinic.onrender.com/api";
+    const source = new EventSource(`${apiBase}/queue-history/stream/`);
+    eventSourceRef.current = source;
+
+    // تطبيق الحدث على الحالة المحلية بدلاً من جلب الطابور كاملاً
+    const onChange = (event: MessageEvent) => {
+      const message: QueueEvent = JSON.parse(event.data);
+      if (message.version) {
+        versionRef.current = Math.max(versionRef.current, message.version);
+      }
+      const items = applyEvent(itemsRef.current, message);
+      if (items === null) {
+        // حجز دخل الطابور الحالي للتو
+        scheduleRefetch();
+        return;
+      }
+      itemsRef.current = items;
+      setData(summarize(items, bookingId));
+      setLastUpdated(new Date());
+    };
+
+    // تغيّر الإصدار دون حدث يغطيه (استيراد، إعادة تقدير، حدث ضائع)
+    const onVersion = (event: MessageEvent) => {
+      const { version } = JSON.parse(event.data);
+      if (version > versionRef.current) {
+        scheduleRefetch();
       }
     };
-  }, [fetchQueueData]);
+
+    ["position", "started", "completed", "removed"].forEach((event) =>
+      source.addEventListener(event, onChange as EventListener)
+    );
+    source.addEventListener("version", onVersion as EventListener);
+    // عند (إعادة) الاتصال: إيقاف التحديث الدوري وجلب ما فات من تغييرات
+    source.addEventListener("ready", ((event: MessageEvent) => {
+      const { version } = JSON.parse(event.data);
+      versionRef.current = version || 0;
+      cancelRefetch();
+      stopPolling();
+      fetchQueueData();
+    }) as EventListener);
+    source.onopen = () => stopPolling();
+    // إغلاق الاتصال قبل التحديث الدوري حتى لا يعملا معاً، ثم إعادة المحاولة لاحقاً
+    source.onerror = () => {
+      source.close();
+      if (eventSourceRef.current === source) {
+        eventSourceRef.current = null;
+      }
+      startPolling();
+      if (!reconnectTimerRef.current) {
+        reconnectTimerRef.current = setTimeout(() => {
+          reconnectTimerRef.current = null;
+          connectRef.current();
+        }, RECONNECT_DELAY_MS);
+      }
+    };
+  }, [
+    bookingId,
+    cancelRefetch,
+    fetchQueueData,
+    scheduleRefetch,
+    startPolling,
+    stopPolling,
+  ]);
+
+  connectRef.current = connect;
+
+  const disconnect = useCallback(() => {
+    eventSourceRef.current?.close();
+    eventSourceRef.current = null;
+    if (reconnectTimerRef.current) {
+      clearTimeout(reconnectTimerRef.current);
+      reconnectTimerRef.current = null;
+    }
+    cancelRefetch();
+    stopPolling();
+  }, [cancelRefetch, stopPolling]);
+
+  // الجلب الأول يتم عند حدث ready (أو مع بدء التحديث الدوري)
+  useEffect(() => {
+    connect();
+    return disconnect;
+  }, [connect, disconnect]);
 
   // إعادة تحميل يدوية
   const refetch = useCallback(() => {
@@ -127,15 +288,14 @@ export const useQueueTracker = (bookingId?: string) => {
 
   // إيقاف المراقبة
   const stop = useCallback(() => {
-    if (intervalRef.current) {
-      clearInterval(intervalRef.current);
-    }
-  }, []);
+    disconnect();
+  }, [disconnect]);
 
-  // استئناف المراقبة
+  // استئناف المراقبة (حدث ready يجلب الطابور)
   const resume = useCallback(() => {
-    intervalRef.current = setInterval(fetchQueueData, 5000);
-  }, [fetchQueueData]);
+    disconnect();
+    connect();
+  }, [connect, disconnect]);
 
   return {
     ...data,